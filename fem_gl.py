@@ -36,11 +36,47 @@ def parse_commandline():
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
     )
     parser.add_argument(
-        '-p', '--port', default=8008,
+        '-p', '--port', default=8008, type=int,
         help='The port for the web server.')
     parser.add_argument(
         '-m', '--mesh-dir', required=True,
         help='The directory in which we want to look for mesh files.')
+    parser.add_argument(
+        '--mesh-cache-mb', default=2048, type=int,
+        help='Memory budget in MB for processed meshes kept between '
+        'requests.')
+    parser.add_argument(
+        '--surface-cache-dir', default=None,
+        help='Directory for the extracted mesh surfaces and the field '
+        'statistics. If not given they are stored in a .fem-gl-cache '
+        'directory next to each mesh and in each object directory.')
+    parser.add_argument(
+        '--field-cache-mb', default=512, type=int,
+        help='Memory budget in MB for field values kept between requests.')
+    parser.add_argument(
+        '--prefetch-window', default=2, type=int,
+        help='Number of timesteps before and after the displayed one that '
+        'are loaded in the background. 0 turns prefetching off.')
+    parser.add_argument(
+        '--threads', default=10, type=int,
+        help='Number of threads that handle requests.')
+    parser.add_argument(
+        '--mesh-workers', default=0, type=int,
+        help='Number of worker processes that extract mesh surfaces. 0 '
+        'extracts them in the request threads.')
+    parser.add_argument(
+        '--field-reads', default='mmap', choices=['mmap', 'pread'],
+        help='How the surface values are read from field files. pread reads '
+        'runs of values with few large reads, which is faster on network '
+        'file systems.')
+    parser.add_argument(
+        '--lod-cache-mb', default=256, type=int,
+        help='Memory budget in MB for the coarser versions of mesh surfaces '
+        'that are shown while the full surface loads.')
+    parser.add_argument(
+        '--view-cache-mb', default=256, type=int,
+        help='Memory budget in MB for the render buffers, cross sections '
+        'and isosurfaces, shared by all viewers.')
     args = parser.parse_args()
 
     return args
@@ -67,10 +103,21 @@ def start_web_instance(args):
     web_instance = fem_web.WebServer(
         html_directory=html_dir,
         mesh_directory=mesh_dir,
-        port=port)
+        port=port,
+        mesh_cache_bytes=args.mesh_cache_mb*1024**2,
+        surface_cache_directory=args.surface_cache_dir,
+        field_cache_bytes=args.field_cache_mb*1024**2,
+        prefetch_window=args.prefetch_window,
+        thread_pool=args.threads,
+        mesh_workers=args.mesh_workers,
+        field_read_mode=args.field_reads,
+        lod_cache_bytes=args.lod_cache_mb*1024**2,
+        view_cache_bytes=args.view_cache_mb*1024**2)
     web_instance.start()
 
 
-# Start the program.
-ARGS = parse_commandline()
-start_web_instance(ARGS)
+# Start the program. The guard keeps the worker processes (see
+# modules/process_pool.py) from starting a server when they import this file.
+if __name__ == '__main__':
+    ARGS = parse_commandline()
+    start_web_instance(ARGS)
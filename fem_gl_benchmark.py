@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmark the mesh pipeline on synthetic C3D8 plates of several sizes.
+
+Every stage (binary load, surface detection, triangulation, index remap,
+metadata, field gather, render buffers, JSON and binary encoding) is timed
+on its own and its peak memory is traced. The results are written as json
+and can be compared against the results of another commit.
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import resource
+import argparse
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+import modules.element_types as element_types
+import modules.render_buffers as render_buffers
+import modules.binary_transport as binary_transport
+import modules.synthetic_mesh as synthetic_mesh
+
+RESULTS_FORMAT = 2
+
+SIZE_SUFFIXES = {'k': 10 ** 3, 'm': 10 ** 6}
+
+# Stages that are faster than this (in seconds) are not reported as
+# regressions, their timings are mostly noise.
+NOISE_FLOOR = 1e-3
+
+
+def parse_size(size):
+    """Return the number of elements of a size like 10k, 2.5M or 5000.
+    """
+    suffix = size[-1:].lower()
+    if suffix in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[suffix])
+    return int(size)
+
+
+def parse_commandline():
+    """Parse the command line and return the parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        '-s', '--sizes', nargs='+', default=['10k', '100k', '1M'],
+        help='The (approximate) numbers of elements of the meshes, e.g. '
+        '10k 100k 1M 10M.')
+    parser.add_argument(
+        '-d', '--data-dir', default=None,
+        help='Where the synthetic meshes are written and reused from. A '
+        'temporary directory that is removed afterwards if not given.')
+    parser.add_argument(
+        '-t', '--timesteps', type=int, default=3,
+        help='The number of timesteps of the temperature field.')
+    parser.add_argument(
+        '--perturb', type=float, default=0.,
+        help='Move the nodes at random by up to this fraction of the '
+        'element size (below 0.5), 0 for a structured mesh.')
+    parser.add_argument(
+        '--shuffle', action='store_true',
+        help='Write the elements in random order.')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed of the perturbation and the shuffle.')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=3,
+        help='How often the pipeline is run per mesh.')
+    parser.add_argument(
+        '-o', '--output', default=None,
+        help='Write the results to this json file.')
+    parser.add_argument(
+        '-c', '--compare', default=None,
+        help='Compare the results against this json file and exit with 1 '
+        'if a stage got slower by more than the threshold.')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='The relative slowdown of a stage that counts as a '
+        'regression.')
+    parser.add_argument(
+        '--generate-only', action='store_true',
+        help='Only write the synthetic meshes (into --data-dir).')
+    args = parser.parse_args()
+
+    if not 0 <= args.perturb < 0.5:
+        parser.error('--perturb must be at least 0 and below 0.5.')
+    if (args.timesteps < 1 or args.repeat < 1):
+        parser.error('--timesteps and --repeat must be at least 1.')
+    try:
+        args.element_counts = [parse_size(size) for size in args.sizes]
+    except ValueError:
+        parser.error('Sizes are numbers of elements like 10k or 1M.')
+
+    return args
+
+
+def object_directory(data_dir, element_count, args):
+    """Return the directory of the synthetic object for element_count, named
+    after everything it is generated from.
+    """
+    return os.path.join(data_dir, 'plate_{count_t}_{timesteps_t}_{perturb_t}'
+                        '_{shuffle_t}_{seed_t}'.format(
+                            count_t=element_count, timesteps_t=args.timesteps,
+                            perturb_t=args.perturb,
+                            shuffle_t=int(args.shuffle), seed_t=args.seed))
+
+
+def generate_object(data_dir, element_count, args):
+    """Write the synthetic object for element_count, unless it has already
+    been written, and return its description (see
+    synthetic_mesh.write_object).
+    """
+    directory = object_directory(data_dir, element_count, args)
+    description_path = os.path.join(directory, 'synthetic.json')
+    if os.path.isfile(description_path):
+        with open(description_path) as description_file:
+            description = json.load(description_file)
+        if 'generator' in description:
+            return description
+
+    print('Generating {count_t} elements in {directory_t}.'.format(
+        count_t=element_count, directory_t=directory))
+    description = synthetic_mesh.write_object(
+        directory, element_count, timesteps=args.timesteps,
+        perturbation=args.perturb, shuffle=args.shuffle, seed=args.seed)
+    description['object'] = directory
+
+    # Written last, so an interrupted generation is started over.
+    with open(description_path, 'w') as description_file:
+        json.dump(description, description_file)
+    return description
+
+
+def measure(stage_times, name, function):
+    """Run function, add its time and traced peak memory to stage_times
+    under name and return its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stage = stage_times.setdefault(name, {'seconds': [], 'peak_bytes': 0})
+    stage['seconds'].append(seconds)
+    stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+    return result
+
+
+def run_pipeline(description, stage_times):
+    """Run all stages once on a synthetic object and return the counts of
+    the surface.
+
+    The binary load only memory-maps the files, the pages are read by the
+    first stage that touches them (the surface detection for the elements
+    and the metadata for the nodes).
+    """
+    object_name = description['object']
+    timesteps = description['timesteps']
+
+    mesh = measure(stage_times, 'binary_load', lambda: fem_mesh.UnpackMesh(
+        description['node_path'], description['element_path']))
+
+    batches = measure(stage_times, 'surface_detection',
+                      lambda: element_types.boundary_faces(
+                          mesh.element_blocks))
+
+    def triangulation():
+        mesh.surface_triangles, mesh.surface_faces = \
+            element_types.triangulate_faces(batches)
+    measure(stage_times, 'triangulation', triangulation)
+
+    measure(stage_times, 'index_remap', mesh.generate_unique_surface_triangles)
+
+    def metadata():
+        return (mesh.return_unique_surface_nodes(),
+                mesh.return_surface_indices(),
+                mesh.return_bounding_box(), mesh.return_metadata())
+    surface_nodes, surface_indices, bounding_box, center = measure(
+        stage_times, 'metadata', metadata)
+
+    def field_gather(mode):
+        def gather():
+            saved_mode = fem_mesh.FIELD_READ_MODE
+            fem_mesh.FIELD_READ_MODE = mode
+            try:
+                return [mesh.return_data_for_unique_nodes(
+                    object_name, synthetic_mesh.FIELD, timestep)
+                        for timestep in timesteps]
+            finally:
+                fem_mesh.FIELD_READ_MODE = saved_mode
+        return gather
+    field_values = measure(stage_times, 'field_gather', field_gather('mmap'))
+    measure(stage_times, 'field_gather_pread', field_gather('pread'))
+
+    buffers = render_buffers.RenderBuffers()
+
+    def expand():
+        return buffers.geometry(mesh), [
+            buffers.field(mesh, object_name, synthetic_mesh.FIELD, timestep,
+                          lambda: field_values[timesteps.index(timestep)])
+            for timestep in timesteps]
+    (positions, barycentrics), _ = measure(stage_times, 'render_buffers',
+                                           expand)
+
+    def json_encoding():
+        # As mesher_init and get_timestep_data.
+        encoded = [json.dumps({
+            'surface_nodes': surface_nodes.ravel().tolist(),
+            'surface_indexfile': surface_indices.ravel().tolist(),
+            'surface_metadata': center.tolist()})]
+        encoded.extend(json.dumps({'timestep_data': values.tolist()})
+                       for values in field_values)
+        return encoded
+    measure(stage_times, 'json_encoding', json_encoding)
+
+    def binary_encoding():
+        # As mesher_init_binary, get_render_geometry and
+        # get_timestep_data_binary.
+        encoded = [
+            binary_transport.pack_geometry(
+                surface_nodes, surface_indices, bounding_box, center),
+            binary_transport.pack_render_geometry(
+                positions, barycentrics, bounding_box, center)]
+        encoded.extend(binary_transport.pack_field(values)
+                       for values in field_values)
+        return encoded
+    measure(stage_times, 'binary_encoding', binary_encoding)
+
+    return {'surface_triangles': int(surface_indices.shape[0]),
+            'surface_nodes': int(surface_nodes.shape[0])}
+
+
+def benchmark(description, repeat):
+    """Run the pipeline repeat times on a synthetic object and return its
+    results.
+    """
+    stage_times = {}
+    for _ in range(repeat):
+        counts = run_pipeline(description, stage_times)
+
+    stages = {}
+    for name, stage in stage_times.items():
+        stages[name] = {'seconds': stage['seconds'],
+                        'min': min(stage['seconds']),
+                        'median': statistics.median(stage['seconds']),
+                        'peak_bytes': stage['peak_bytes']}
+
+    result = {'elements': description['elements'],
+              'generator': description['generator'],
+              'nodes': description['nodes'],
+              'timesteps': len(description['timesteps']),
+              'stages': stages,
+              # Of the whole process so far, in bytes (kilobytes on Linux).
+              'max_rss_bytes': resource.getrusage(
+                  resource.RUSAGE_SELF).ru_maxrss * 1024}
+    result.update(counts)
+    return result
+
+
+def git_commit():
+    """Return the commit of the working tree, with '-dirty' appended if it
+    has changes, or None outside of a git repository.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory,
+            stderr=subprocess.DEVNULL).decode().strip()
+        changes = subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=directory, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if changes else '')
+
+
+def print_results(results):
+    """Print the median time and peak memory of every stage.
+    """
+    for result in results:
+        print('{elements_t} elements, {nodes_t} nodes, {triangles_t} surface '
+              'triangles:'.format(elements_t=result['elements'],
+                                  nodes_t=result['nodes'],
+                                  triangles_t=result['surface_triangles']))
+        for name, stage in result['stages'].items():
+            print('    {name_t:20s} {median_t:10.4f} s {peak_t:10.1f} '
+                  'MiB'.format(name_t=name, median_t=stage['median'],
+                               peak_t=stage['peak_bytes'] / 2 ** 20))
+
+
+def generator_key(result):
+    """Return what a result is matched with its baseline by: the number of
+    elements and all parameters of the synthetic mesh, or None for results
+    that do not record them.
+    """
+    if 'generator' not in result:
+        return None
+    return (result['elements'],) + tuple(sorted(result['generator'].items()))
+
+
+def compare_results(results, baseline, threshold):
+    """Print the change of the median time of every stage against the
+    baseline results and return the number of regressions.
+
+    A result is only compared with a baseline result of a mesh with the
+    same number of elements that was generated with the same parameters.
+    """
+    baseline_results = dict((generator_key(result), result)
+                            for result in baseline['results']
+                            if generator_key(result) is not None)
+    baseline_parameters = dict((result['elements'], result.get('generator'))
+                               for result in baseline['results'])
+    print('Compared against {commit_t}:'.format(
+        commit_t=baseline.get('commit')))
+
+    regressions = 0
+    for result in results:
+        key = generator_key(result)
+        if key not in baseline_results:
+            if result['elements'] in baseline_parameters:
+                print('Not comparing {elements_t} elements, the baseline mesh '
+                      'was generated with {baseline_t}, this one with '
+                      '{parameters_t}.'.format(
+                          elements_t=result['elements'],
+                          baseline_t=baseline_parameters[result['elements']],
+                          parameters_t=result['generator']))
+            else:
+                print('No baseline for {elements_t} elements.'.format(
+                    elements_t=result['elements']))
+            continue
+        baseline_stages = baseline_results[key]['stages']
+        print('{elements_t} elements:'.format(elements_t=result['elements']))
+        for name, stage in result['stages'].items():
+            if name not in baseline_stages:
+                continue
+            old, new = baseline_stages[name]['median'], stage['median']
+            ratio = new / old if old > 0 else float('inf')
+            regression = (ratio > 1 + threshold and new - old > NOISE_FLOOR)
+            regressions += regression
+            print('    {name_t:20s} {old_t:10.4f} s -> {new_t:10.4f} s '
+                  '({ratio_t:6.2f}x){flag_t}'.format(
+                      name_t=name, old_t=old, new_t=new, ratio_t=ratio,
+                      flag_t=' REGRESSION' if regression else ''))
+    return regressions
+
+
+if __name__ == '__main__':
+    ARGS = parse_commandline()
+
+    if ARGS.data_dir is None:
+        if ARGS.generate_only:
+            sys.exit('--generate-only needs a --data-dir.')
+        DATA_DIR = tempfile.mkdtemp(prefix='fem-gl-benchmark-')
+    else:
+        DATA_DIR = os.path.abspath(ARGS.data_dir)
+
+    try:
+        DESCRIPTIONS = [generate_object(DATA_DIR, ELEMENT_COUNT, ARGS)
+                        for ELEMENT_COUNT in ARGS.element_counts]
+        if ARGS.generate_only:
+            sys.exit(0)
+
+        RESULTS = []
+        for DESCRIPTION in DESCRIPTIONS:
+            print('Benchmarking {elements_t} elements.'.format(
+                elements_t=DESCRIPTION['elements']))
+            RESULTS.append(benchmark(DESCRIPTION, ARGS.repeat))
+    finally:
+        if ARGS.data_dir is None:
+            shutil.rmtree(DATA_DIR)
+
+    print_results(RESULTS)
+
+    ARGUMENTS = vars(ARGS)
+    ARGUMENTS.pop('element_counts')
+    OUTPUT = {'format': RESULTS_FORMAT,
+              'commit': git_commit(),
+              'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'processor': platform.processor(),
+              'cpu_count': os.cpu_count(),
+              'arguments': ARGUMENTS,
+              'results': RESULTS}
+
+    if ARGS.output is not None:
+        with open(ARGS.output, 'w') as output_file:
+            json.dump(OUTPUT, output_file, indent=2)
+
+    if ARGS.compare is not None:
+        with open(ARGS.compare) as baseline_file:
+            BASELINE = json.load(baseline_file)
+        if compare_results(RESULTS, BASELINE, ARGS.threshold) > 0:
+            sys.exit(1)
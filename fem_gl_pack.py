@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Pack the timestep files of the nodal fields of an object into time-series
+stores (one file per field in <object>/ts). fem-gl reads a store instead of
+the timestep files when it exists.
+"""
+
+import os
+import argparse
+
+import modules.catalog as catalog
+import modules.timeseries as timeseries
+
+
+def parse_commandline():
+    """Parse the command line and return the parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        'object_dir',
+        help='The directory of the object (the one with the fo directory).')
+    parser.add_argument(
+        '-f', '--field', action='append', default=None,
+        help='A field to pack, can be given more than once. All nodal '
+        'fields are packed if none is given.')
+    parser.add_argument(
+        '--layout', default='time', choices=sorted(timeseries.LAYOUTS),
+        help='time keeps the values of a timestep together (fast playback), '
+        'node keeps the history of a node together (fast time-series '
+        'queries).')
+    args = parser.parse_args()
+
+    return args
+
+
+if __name__ == '__main__':
+    ARGS = parse_commandline()
+    OBJECT_DIR = os.path.abspath(ARGS.object_dir)
+    FIELDS = ARGS.field
+    if FIELDS is None:
+        FIELDS = catalog.ObjectCatalog(OBJECT_DIR).fields(['nf'])
+    for FIELD in FIELDS:
+        timeseries.pack_field(OBJECT_DIR, FIELD, layout=ARGS.layout)
@@ -5,6 +5,11 @@ function addColorbar(Tmin, Tmax) {
 
     var cbar = document.getElementById('colorbar');
 
+    // Drop the segments of an earlier colorbar.
+    while (cbar.firstChild) {
+        cbar.removeChild(cbar.firstChild);
+    }
+
     // The intervals for displaying the colorbar
     var intervals = [
         1.0,
@@ -68,7 +73,7 @@ function addColorbar(Tmin, Tmax) {
     div.setAttribute('style', 'background-color: #000000');
     var divText = document.createElement('div');
     divText.setAttribute('class', 'colorbar_text');
-    divText.innerHTML = '> '+ Tmax;
+    divText.innerHTML = '> '+ Math.round(Tmax);
     div.appendChild(divText);
     cbar.appendChild(div);
 
@@ -90,7 +95,7 @@ function addColorbar(Tmin, Tmax) {
     div.setAttribute('style', 'background-color: #000000');
     divText = document.createElement('div');
     divText.setAttribute('class', 'colorbar_text');
-    divText.innerHTML = Tmin;
+    divText.innerHTML = Math.round(Tmin);
     div.appendChild(divText);
     cbar.appendChild(div);
 
@@ -100,7 +105,7 @@ function addColorbar(Tmin, Tmax) {
     div.setAttribute('style', 'height: 0px;');
     divText = document.createElement('div');
     divText.setAttribute('class', 'colorbar_text');
-    divText.innerHTML = '< ' + Tmin;
+    divText.innerHTML = '< ' + Math.round(Tmin);
     div.appendChild(divText);
     cbar.appendChild(div);
 }
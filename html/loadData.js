@@ -116,3 +116,29 @@ function postJSONPromise(post_url, json_string) {
 	      };
     });
 }
+
+// Post a json string to an url on the server and return a promise for the
+// binary answer (an ArrayBuffer).
+function postBinaryPromise(post_url, json_string) {
+    // Return a promise for XHR data
+    return new Promise(function(resolve, reject) {
+	      var xhr = new XMLHttpRequest;
+	      xhr.responseType = 'arraybuffer';
+	      xhr.open('POST', '/' + post_url, true);
+        xhr.setRequestHeader("Content-Type", "application/json;charset=UTF-8");
+	      // Send the request
+	      xhr.send(JSON.stringify(json_string));
+	      xhr.onload = function() {
+	          if (xhr.status === 200) {
+		            resolve(xhr.response);
+	          } else {
+		            // If unsuccessful return an error
+		            reject(Error('postBinaryPromise() - ERROR with '+post_url+' and '+json_string));
+	          }
+	      };
+	      xhr.onerror = function() {
+	          // Maybe we have more severe problems. Also return an error then
+	          reject(Error('postBinaryPromise() - network issues'));
+	      };
+    });
+}
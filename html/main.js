@@ -28,7 +28,22 @@ var model_metadata;
 var fragmentShaderTMin = 100.0;
 var fragmentShaderTMax = 1000.0;
 
-var bufferIndexArray;
+// One of 'float32', 'float16' or 'uint16', see get_timestep_data_binary.
+var fieldDataEncoding = 'float32';
+
+// Average the field values over every triangle (on the server).
+var flatShading = false;
+
+// The level of detail of the displayed surface (see get_surface_levels),
+// null for the full surface, and the displayed timestep.
+var surfaceLevel = null;
+var displayedTimestep = null;
+
+// Every load of a surface gets a new generation, responses that belong to an
+// older generation are dropped. displayedGeneration is the generation of the
+// surface in bufferDataArray.
+var surfaceGeneration = 0;
+var displayedGeneration = null;
 
 function grabCanvas(canvasElementName) {
     // Select the canvas element from the html
@@ -126,123 +141,230 @@ function glRoutine(gl, vs, fs) {
     drawScene();
 }
 
-function updateFragmentShaderData(object_name, field, timestep) {
-    var timestep_promise = postJSONPromise(
-        'get_timestep_data',
-        {'object_name': object_name, 'field': field, 'timestep': timestep}
+function requestRenderField(object_name, field, timestep, level) {
+    // Return a promise for the field values of every vertex of the render
+    // buffers, normalised between fragmentShaderTMin and fragmentShaderTMax
+    // by the server. level defaults to the displayed level of detail.
+    if (level === undefined) {
+        level = surfaceLevel;
+    }
+    var fieldPromise = postBinaryPromise(
+        'get_render_field',
+        {'object_name': object_name, 'field': field, 'timestep': timestep,
+         'flat_shading': flatShading,
+         'value_range': [fragmentShaderTMin, fragmentShaderTMax],
+         'encoding': fieldDataEncoding,
+         'level': level}
     );
-    // var timestep_promise = postDataPromise(
-    //     '/get_timestep_data?object_name=' + object_name +
-    //         '&field=' + field + '&timestep='+timestep);
-    var timestep_data;
+    return fieldPromise.then(parseFieldBuffer);
+}
 
-    timestep_promise.then(function(value){
-        var normalisedTimestepData = normaliseFieldValues(
-            value['timestep_data'],
-            fragmentShaderTMin,
-            fragmentShaderTMax
-        );
-        timestep_data = expandDataWithIndices(
-            bufferIndexArray,
-            normalisedTimestepData,
-            chunksize=1
-        );
+function autoRangeField(object_name, field) {
+    // Set fragmentShaderTMin and fragmentShaderTMax to the range of a field
+    // over all timesteps (from the statistics on the server) and redraw the
+    // colorbar. Returns a promise that resolves once that is done.
+    var statisticsPromise = postJSONPromise(
+        'get_field_statistics',
+        {'object_name': object_name, 'field': field, 'per_timestep': false}
+    );
+    return statisticsPromise.then(function(statistics){
+        var globalStatistics = statistics['global'];
+        if (globalStatistics['min'] === null) {
+            return;
+        }
+        fragmentShaderTMin = globalStatistics['min'];
+        fragmentShaderTMax = globalStatistics['max'];
+        addColorbar(fragmentShaderTMin, fragmentShaderTMax);
+    });
+}
+
+function refreshFieldRange(object_name, field) {
+    // Request the displayed field values again after fragmentShaderTMin or
+    // fragmentShaderTMax has changed. Levels that are still to be loaded
+    // use the new range anyway.
+    if (displayedGeneration == surfaceGeneration) {
+        updateFragmentShaderData(object_name, field, displayedTimestep);
+    }
+}
 
-        averageFieldValsOverElement(timestep_data);
+function updateFragmentShaderData(object_name, field, timestep) {
+    displayedTimestep = timestep;
+    var generation = displayedGeneration;
+    var level = surfaceLevel;
+    var timestep_promise = requestRenderField(object_name, field, timestep);
 
-        bufferDataArray['a_temp']['data'] = new Float32Array(timestep_data);
+    timestep_promise.then(function(value){
+        // Drop values for a surface that is no longer displayed.
+        if (generation != displayedGeneration || level != surfaceLevel) {
+            return;
+        }
+        bufferDataArray['a_temp']['data'] = value;
 
         fragmentDataHasChanged = true;
     });
 }
 
 function updateVertexShaderData(object_name, field, nodepath, elementpath, timestep) {
+    // Show the coarsest level of detail of the surface first, then load
+    // the finer levels one after the other until the full surface is
+    // displayed.
 
-    var node_file;
-    var meta_file;
-
-    var timestep_data;
+    displayedTimestep = timestep;
+    surfaceGeneration += 1;
+    var generation = surfaceGeneration;
 
-    var meshPromise = postJSONPromise(
-        'mesher_init',
+    var levelsPromise = postJSONPromise(
+        'get_surface_levels',
         {'nodepath': nodepath, 'elementpath': elementpath}
     );
-    // var meshPromise = postDataPromise('/mesher_init?nodepath='+nodepath+'&elementpath='+elementpath);
-
-    meshPromise.then(function(value){
 
-        bufferIndexArray = value['surface_indexfile'];
-        node_file = expandDataWithIndices(
-            bufferIndexArray,
-            value['surface_nodes'],
-            chunksize=3
+    function loadLevel(level, levelCount) {
+        var meshPromise = postBinaryPromise(
+            'get_render_geometry',
+            {'nodepath': nodepath, 'elementpath': elementpath,
+             'level': level}
         );
-        meta_file = value['surface_metadata'];
 
-        var bary_coords = generateBarycentricCoordinatesFromIndices(bufferIndexArray);
+        meshPromise.then(function(value){
+            if (generation != surfaceGeneration) {
+                return;
+            }
 
-        var initialTimestepDataPromise = postJSONPromise(
-            'get_timestep_data',
-            {'object_name': object_name, 'field': field, 'timestep': timestep}
-        );
-        // var initialTimestepDataPromise = postDataPromise(
-        //     '/get_timestep_data?object_name=' + object_name +
-        //         '&field=' + field + '&timestep='+timestep);
-
-        initialTimestepDataPromise.then(function(value){
-            var normalisedTimestepData = normaliseFieldValues(
-                value['timestep_data'],
-                fragmentShaderTMin,
-                fragmentShaderTMax
-            );
-            timestep_data = expandDataWithIndices(
-                bufferIndexArray,
-                normalisedTimestepData,
-                chunksize=1
-            );
-
-            averageFieldValsOverElement(timestep_data);
-
-            bufferDataArray['a_position']['data'] = node_file;
-            bufferDataArray['a_temp']['data'] = new Float32Array(timestep_data);
-            bufferDataArray['a_bc']['data'] = bary_coords;
-
-            model_metadata = meta_file;
-
-            vertexDataHasChanged = true;
+            var geometry = parseRenderGeometryBuffer(value);
+
+            var valueRange = [fragmentShaderTMin, fragmentShaderTMax];
+            var timestepDataPromise = requestRenderField(
+                object_name, field, displayedTimestep, level);
+
+            timestepDataPromise.then(function(value){
+                // Another object or field has been opened in the meantime.
+                if (generation != surfaceGeneration) {
+                    return;
+                }
+                bufferDataArray['a_position']['data'] = geometry.positions;
+                bufferDataArray['a_temp']['data'] = value;
+                bufferDataArray['a_bc']['data'] = geometry.barycentrics;
+
+                if (level == 0) {
+                    // A new object, center it.
+                    model_metadata = geometry.center;
+                    vertexDataHasChanged = true;
+                } else {
+                    fragmentDataHasChanged = true;
+                }
+                surfaceLevel = level;
+                displayedGeneration = generation;
+
+                // The range has changed while the values were requested.
+                if (valueRange[0] != fragmentShaderTMin ||
+                        valueRange[1] != fragmentShaderTMax) {
+                    updateFragmentShaderData(
+                        object_name, field, displayedTimestep);
+                }
+
+                if (level + 1 < levelCount) {
+                    loadLevel(level + 1, levelCount);
+                }
+            });
         });
+    }
+
+    levelsPromise.then(function(value){
+        if (generation != surfaceGeneration) {
+            return;
+        }
+        loadLevel(0, value['levels'].length);
     });
 }
 
-function expandDataWithIndices(indices, data, chunksize) {
-    // Given some index data for a non-redundant vertex array, expand this
-    // vertex array data so we don't need the index data.
+function parseRenderGeometryBuffer(buffer) {
+    // Split a buffer from get_render_geometry into its parts. The layout is
+    // described in modules/binary_transport.py. The arrays are views on the
+    // buffer and can be uploaded as they are.
 
-    var expanded_data = [];
-    for (index in indices) {
-        for (var i = 0; i < chunksize; i++) {
-            expanded_data.push(data[chunksize * indices[index] + i]);
-        }
+    var header = new DataView(buffer, 0, 52);
+    var vertexCount = header.getUint32(8, true);
 
+    var floats = [];
+    for (var i = 0; i < 9; i++) {
+        floats.push(header.getFloat32(16 + 4*i, true));
     }
-    return expanded_data;
+
+    var positionOffset = 52;
+    var barycentricOffset = positionOffset + 4 * 3 * vertexCount;
+
+    return {
+        positions: new Float32Array(buffer, positionOffset, 3 * vertexCount),
+        barycentrics: new Float32Array(buffer, barycentricOffset, 3 * vertexCount),
+        boundingBox: [floats.slice(0, 3), floats.slice(3, 6)],
+        center: floats.slice(6, 9)
+    };
+}
+
+function parseFieldBuffer(buffer) {
+    // Decode a buffer from get_timestep_data_binary into a Float32Array of
+    // field values. The layout is described in modules/binary_transport.py.
+
+    var header = new DataView(buffer, 0, 32);
+    var valueCount = header.getUint32(8, true);
+    var valueType = header.getUint32(12, true);
+    var minVal = header.getFloat64(16, true);
+    var maxVal = header.getFloat64(24, true);
+
+    var valueOffset = 32;
+
+    if (valueType == 1) {
+        // float32, nothing to decode.
+        return new Float32Array(buffer, valueOffset, valueCount);
+    }
+
+    var rawValues = new Uint16Array(buffer, valueOffset, valueCount);
+    var values = new Float32Array(valueCount);
+
+    if (valueType == 3) {
+        // float16
+        for (var i = 0; i < valueCount; i++) {
+            values[i] = halfToFloat(rawValues[i]);
+        }
+    } else if (valueType == 4) {
+        // uint16, quantised between minVal and maxVal
+        var scale = (maxVal - minVal) / 65535;
+        for (var i = 0; i < valueCount; i++) {
+            values[i] = minVal + rawValues[i] * scale;
+        }
+    } else {
+        throw Error('parseFieldBuffer() - unknown value type ' + valueType);
+    }
+    return values;
 }
 
-function averageFieldValsOverElement(fieldValues) {
-    // Set the values on an element to the average of the node values.
+function halfToFloat(half) {
+    // Convert the bits of an IEEE 754 half precision float to a number.
+
+    var sign = (half & 0x8000) ? -1 : 1;
+    var exponent = (half >> 10) & 0x1f;
+    var fraction = half & 0x03ff;
+
+    if (exponent == 0) {
+        return sign * Math.pow(2, -14) * (fraction / 1024);
+    } else if (exponent == 0x1f) {
+        return fraction ? NaN : sign * Infinity;
+    }
+    return sign * Math.pow(2, exponent - 15) * (1 + fraction / 1024);
+}
 
-    var averageArray = [];
+function expandDataWithIndices(indices, data, chunksize) {
+    // Given some index data for a non-redundant vertex array, expand this
+    // vertex array data so we don't need the index data.
 
-    // Assume the fieldvalues are divisible by 3. This should always be the
-    // case. If not then something is borked..
-    for (var it = 0; it < fieldValues.length/3; it++) {
-        var avgValue = fieldValues[3*it] + fieldValues[3*it+1] + fieldValues[3*it+2];
-        avgValue = avgValue/3;
-        for (var jt = 0; jt < 3; jt++) {
-            averageArray.push(avgValue);
+    var expanded_data = new Float32Array(indices.length * chunksize);
+    for (var index = 0; index < indices.length; index++) {
+        for (var i = 0; i < chunksize; i++) {
+            expanded_data[chunksize * index + i] = data[chunksize * indices[index] + i];
         }
+
     }
-    return averageArray;
+    return expanded_data;
 }
 
 function generateBarycentricCoordinatesFromIndices(indices) {
@@ -264,10 +386,10 @@ function generateBarycentricCoordinatesFromIndices(indices) {
 
 function normaliseFieldValues(originalField, minVal, maxVal) {
     // Normalise the fieldvalues between 0 and 1.
-    var normalisedField = [];
+    var normalisedField = new Float32Array(originalField.length);
     var deltaVal = maxVal - minVal;
-    for (index in originalField) {
-        normalisedField.push((originalField[index] - minVal)/deltaVal);
+    for (var index = 0; index < originalField.length; index++) {
+        normalisedField[index] = (originalField[index] - minVal)/deltaVal;
     }
     return normalisedField;
 }
@@ -322,7 +444,6 @@ function main() {
             fragmentShaderTMax
         );
         var temperatureSource = expandDataWithIndices(indexSource, normalisedTimestepData, chunksize=1);
-        // temperatureSource = averageFieldValsOverElement(temperatureSource);
         var metaSource = meta_file;
 
         bufferDataArray = {
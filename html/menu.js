@@ -273,10 +273,9 @@ function main() {
         object_property_container.setAttribute('class', 'object_property_container');
         object_property_container.setAttribute('id', 'object_property_container'+object_name);
 
+        // Everything needed to open the object comes in one request.
         var xhr = new XMLHttpRequest();
-        // xhr.open('POST', '/get_object_properties?object_name='+object_name, true);
-        // xhr.send();
-        xhr.open('POST', '/get_object_properties', true);
+        xhr.open('POST', '/get_object_manifest', true);
         xhr.setRequestHeader("Content-Type", "application/json;charset=UTF-8");
         xhr.send(JSON.stringify({'object_name': object_name}));
 
@@ -299,18 +298,37 @@ function main() {
                 object_property_container.appendChild(object_property);
             }
 
-            var nodepath = object_name + '/fo/' + initial_timestep + '/mesh/case.nodes.bin';
-            var elementpath = object_name + '/fo/' + initial_timestep + '/mesh/case.dc3d8.bin';
+            var nodepath = temp_json['nodepath'];
+            var elementpath = temp_json['elementpath'];
+
+            // An object without a mesh has nothing to show.
+            if (nodepath === null) {
+                return;
+            }
 
             // FIXME
             var field = 'temperatures';
 
+            // Scale the colours to the range of the field that the server
+            // already knows, and load the object right away.
+            var value_range = temp_json['value_ranges'][field];
+            if (value_range !== undefined) {
+                fragmentShaderTMin = value_range['min'];
+                fragmentShaderTMax = value_range['max'];
+                addColorbar(fragmentShaderTMin, fragmentShaderTMax);
+            }
             updateVertexShaderData(
                 object_name=object_name,
                 field=field,
                 nodepath=nodepath,
                 elementpath=elementpath,
                 timestep=initial_timestep);
+
+            // The range over all timesteps comes later, as the statistics
+            // read every timestep file of the field.
+            autoRangeField(object_name, field).then(function() {
+                refreshFieldRange(object_name, field);
+            }, function() {});
         };
 
         var object_controls_container = document.createElement('div');
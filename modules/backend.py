@@ -19,15 +19,26 @@
 
 
 import os
-import re
 import json
 
-import numpy as np
-
 # conda install cherrypy
 import cherrypy
+import numpy as np
 
+import modules.binary_transport as binary_transport
+import modules.render_buffers as render_buffers
+import modules.view_cache as view_cache
 import modules.mesh_parser as fem_mesh
+import modules.mesh_cache as mesh_cache
+import modules.surface_cache as surface_cache
+import modules.field_cache as field_cache
+import modules.field_statistics as field_statistics
+import modules.prefetch as prefetch
+import modules.surface_lod as surface_lod
+import modules.process_pool as process_pool
+import modules.catalog as catalog
+import modules.viewer_state as viewer_state
+import modules.metrics as metrics
 import modules.global_settings as global_settings
 
 class WebServer:
@@ -35,9 +46,29 @@ class WebServer:
     Host a web server on a given port and hand out the files in the path.
     """
 
-    def __init__(self, html_directory, mesh_directory, port=8008):
+    def __init__(self, html_directory, mesh_directory, port=8008,
+                 mesh_cache_bytes=2*1024**3, surface_cache_directory=None,
+                 field_cache_bytes=512*1024**2, prefetch_window=2,
+                 thread_pool=10, mesh_workers=0, field_read_mode='mmap',
+                 lod_cache_bytes=256*1024**2, view_cache_bytes=256*1024**2):
         """
         Initialise the webserver.
+
+        mesh_cache_bytes is the memory budget for the processed meshes that
+        are kept between requests. Extracted surfaces and field statistics
+        are stored on disk in surface_cache_directory, or next to the mesh
+        files and in the object directories if that is None.
+        field_cache_bytes is the memory budget for the surface values of
+        field files. prefetch_window is the number of timesteps before and
+        after the displayed one that are loaded in the background (0 turns
+        prefetching off). thread_pool is the number of request threads.
+        mesh_workers is the number of worker processes that extract mesh
+        surfaces (0 extracts them in the request threads).
+        field_read_mode is how the surface values are read from field files,
+        see mesh_parser.FIELD_READ_MODE. lod_cache_bytes is the memory
+        budget for the coarser versions of mesh surfaces. view_cache_bytes
+        is the memory budget for the render buffers, cross sections and
+        isosurfaces, shared by all viewers.
         """
 
         self.conf = {
@@ -45,11 +76,31 @@ class WebServer:
                 'tools.gzip.on': True,
                 'tools.staticdir.on': True,
                 'tools.staticdir.dir': html_directory,
-                'tools.staticdir.index': 'index.html'
+                'tools.staticdir.index': 'index.html',
+                # Every viewer gets its own state (see FemGL.viewer_state).
+                'tools.sessions.on': True
             }
         }
         self.port = port
+        self.thread_pool = thread_pool
         self.mesh_directory = mesh_directory
+        fem_mesh.FIELD_READ_MODE = field_read_mode
+        self.process_pool = None
+        if (mesh_workers > 0):
+            self.process_pool = process_pool.MeshProcessPool(mesh_workers)
+        self.mesh_cache = mesh_cache.MeshCache(
+            max_bytes=mesh_cache_bytes,
+            surface_cache=surface_cache.SurfaceCache(
+                cache_directory=surface_cache_directory),
+            process_pool=self.process_pool)
+        self.field_cache = field_cache.FieldCache(max_bytes=field_cache_bytes)
+        self.prefetcher = prefetch.TimestepPrefetcher(
+            field_cache=self.field_cache, window=prefetch_window)
+        self.field_statistics = field_statistics.FieldStatistics(
+            cache_directory=surface_cache_directory)
+        self.surface_lods = surface_lod.SurfaceLODCache(
+            max_bytes=lod_cache_bytes)
+        self.view_cache = view_cache.ViewCache(max_bytes=view_cache_bytes)
 
         # Initialise the global variables
         global_settings.init()
@@ -61,24 +112,89 @@ class WebServer:
 
         # Set the port
         cherrypy.config.update(
-            {'server.socket_port': self.port}
+            {'server.socket_port': self.port,
+             'server.thread_pool': self.thread_pool}
         )
 
         # Load the server class for displaying fem data
         cherrypy.tree.mount(
-            self.FemGL(mesh_directory=self.mesh_directory), '/', self.conf)
+            self.FemGL(mesh_directory=self.mesh_directory,
+                       mesh_cache=self.mesh_cache,
+                       field_cache=self.field_cache,
+                       view_cache=self.view_cache,
+                       prefetcher=self.prefetcher,
+                       field_statistics=self.field_statistics,
+                       surface_lods=self.surface_lods),
+            '/', self.conf)
+
+        # Serve the metrics in the Prometheus text format. Without sessions,
+        # so every scrape does not create one.
+        metrics.REGISTRY.set_collector('caches', metrics.cache_collector({
+            'mesh': self.mesh_cache.stats,
+            'surface_disk': self.mesh_cache.surface_cache.stats,
+            'field': self.field_cache.stats,
+            'surface_lod': self.surface_lods.stats,
+            'view': self.view_cache.stats}))
+        metrics.REGISTRY.set_collector('process',
+                                       metrics.process_collector())
+        # Served on /metrics itself, not redirected to /metrics/.
+        cherrypy.tree.mount(self.Metrics(), '/metrics',
+                            {'/': {'tools.gzip.on': True,
+                                   'tools.trailing_slash.on': False}})
+
+        # Stop the prefetch threads together with the server
+        cherrypy.engine.subscribe('stop', self.prefetcher.shutdown)
+        cherrypy.engine.subscribe('stop', self.field_statistics.shutdown)
+        cherrypy.engine.subscribe('stop', self.mesh_cache.shutdown)
+        if self.process_pool is not None:
+            cherrypy.engine.subscribe('stop', self.process_pool.shutdown)
+
+        # Run the stop listeners on SIGTERM too, otherwise the worker
+        # processes outlive the server.
+        cherrypy.engine.signal_handler.subscribe()
 
         # Start the server
         cherrypy.engine.start()
         cherrypy.engine.block()
 
+    class Metrics:
+        """
+        Serve the metrics of the server, see modules/metrics.py.
+        """
+
+        @cherrypy.expose
+        def index(self):
+            """Return all metrics in the Prometheus text format.
+            """
+            cherrypy.response.headers['Content-Type'] = \
+                'text/plain; version=0.0.4; charset=utf-8'
+            return metrics.REGISTRY.render()
+
+    @metrics.instrument_handlers
     class FemGL:
         """
         Handle the data for fem-gl.
+
+        The handlers run concurrently in the CherryPy thread pool. Meshes,
+        field values and catalogs are shared through thread-safe caches,
+        which mesh a viewer looks at is kept in its session (see
+        modules/viewer_state.py). A handler gets the mesh of a viewer once
+        from the mesh cache and passes it on, nothing else holds it. All
+        paths are resolved against the mesh directory, the working
+        directory is never changed.
         """
 
-        def __init__(self, mesh_directory):
-            self.mesh_directory = mesh_directory
+        def __init__(self, mesh_directory, mesh_cache, field_cache,
+                     view_cache, prefetcher=None, field_statistics=None,
+                     surface_lods=None):
+            self.mesh_directory = os.path.abspath(mesh_directory)
+            self.mesh_cache = mesh_cache
+            self.field_cache = field_cache
+            self.prefetcher = prefetcher
+            self.field_statistics = field_statistics
+            self.surface_lods = surface_lods
+            self.view_cache = view_cache
+            self.catalog = catalog.Catalog(self.mesh_directory)
             self.timestep_list = []
 
         @cherrypy.expose
@@ -136,10 +252,10 @@ class WebServer:
             """Return a list of properties for a given element on catching
             'get_object_properties'
 
-            Go through all timestep folders and look in every ef- and nf-folder
-            for files. Append every file to an array, afterwards find the unique
-            files in that array. Append this list to a list containing an entry
-            for a simple wireframe (i.e. no field values, just the bare mesh).
+            Take the unique names of the files in every no- and eo-folder of
+            all timesteps from the catalog. Append this list to a list
+            containing an entry for a simple wireframe (i.e. no field values,
+            just the bare mesh).
 
             Returns a json file.
             """
@@ -148,39 +264,14 @@ class WebServer:
             json_input = cherrypy.request.json
             object_name = json_input['object_name']
 
-            object_directory = os.path.join(self.mesh_directory, object_name, 'fo')
+            object_catalog = self.object_catalog(object_name)
 
             # Get the smallest timestep.
-            dirs_in_fo = os.listdir(object_directory)
-
-            object_timesteps = []
-
-            for timestep in dirs_in_fo:
-                timestep_path = os.path.join(object_directory, timestep)
-                if os.path.isdir(timestep_path):
-                    object_timesteps.append(timestep)
-            object_timesteps = sorted(object_timesteps)
-
-            initial_timestep = object_timesteps[0]
+            initial_timestep = object_catalog.timesteps()[0]
 
             # Get all available properties.
-            file_array = []
-            for path, _, files in os.walk(object_directory):
-                if (os.path.basename(path) == 'no' or
-                    os.path.basename(path) == 'eo'):
-                # if (os.path.basename(path) == 'nf' or
-                #     os.path.basename(path) == 'ef'):
-                    for single_file in files:
-                        if re.match(r'(.*)\.bin', single_file):
-                            file_array.append(single_file)
-            unique_field_names = np.unique(file_array)
-
             object_properties = ['wireframe']
-
-            for field_name in unique_field_names:
-                # Remove the .bin ending from the file.
-                name_without_ending = re.match(r'(.*)\.bin', field_name).groups(0)[0]
-                object_properties.append(name_without_ending)
+            object_properties.extend(object_catalog.fields(['no', 'eo']))
 
             return json.dumps({'object_properties': object_properties,
                                'initial_timestep': initial_timestep})
@@ -189,26 +280,89 @@ class WebServer:
         def get_sorted_timesteps(self, object_name):
             """Generate a sorted list of timesteps.
 
-            Go through all the folders in the object/fo folder. Every folder
-            here is a timestep.
+            Every folder in the object/fo folder is a timestep, see
+            modules/catalog.py.
 
             Returns a list of lists.
             """
 
-            object_directory = os.path.join(self.mesh_directory, object_name, 'fo')
+            object_catalog = self.object_catalog(object_name)
+            return [[float(timestep), timestep]
+                    for timestep in object_catalog.timesteps()]
 
-            object_timesteps = []
-            sorted_timesteps = []
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_object_manifest(self):
+            """Return everything the viewer needs to open an object on
+            catching 'get_object_manifest'
+
+            That is the timesteps, the field names, the paths of the mesh,
+            the size, bounding box and center of its surface and the value
+            ranges of the fields that have been loaded so far (on the
+            surface nodes). The timesteps and fields come from the catalog,
+            the surface from the mesh cache or the surface cache on disk.
+            The mesh is never loaded here: if its surface is not known yet,
+            'surface' is null and the mesh starts loading in the background,
+            so the requests for its geometry that follow find it (or wait
+            for it). A value range comes from get_field_statistics if that
+            has been asked for the field before, then it covers all nodes
+            and timesteps.
+
+            Returns a json file.
+            """
 
-            dirs_in_fo = os.listdir(object_directory)
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+
+            object_catalog = self.object_catalog(object_name)
+            timesteps = object_catalog.timesteps()
+            nodal_fields = object_catalog.fields(['nf', 'no'])
+            element_fields = object_catalog.fields(['ef', 'eo'])
 
-            for timestep in dirs_in_fo:
-                timestep_path = os.path.join(object_directory, timestep)
-                if os.path.isdir(timestep_path):
-                    object_timesteps.append([float(timestep), timestep])
+            object_properties = ['wireframe']
+            object_properties.extend(object_catalog.fields(['no', 'eo']))
+
+            manifest = {
+                'object_name': object_name,
+                'timesteps': timesteps,
+                'initial_timestep': timesteps[0] if timesteps else None,
+                'object_properties': object_properties,
+                'nodal_fields': nodal_fields,
+                'element_fields': element_fields,
+                'nodepath': None,
+                'elementpath': None,
+                'surface': None,
+                'value_ranges': {}
+            }
 
-            sorted_timesteps = sorted(object_timesteps)
-            return sorted_timesteps
+            nodepath, elementpath = object_catalog.mesh_paths(object_name)
+            if nodepath is not None:
+                mesh_key = self.mesh_cache.mesh_key(
+                    node_path=self.resolve_path(nodepath),
+                    element_path=[self.resolve_path(path) for path in
+                                  fem_mesh.element_paths(elementpath)]
+                )
+                manifest['nodepath'] = nodepath
+                manifest['elementpath'] = elementpath
+                manifest['surface'] = self.mesh_cache.surface_summary(
+                    mesh_key)
+                self.mesh_cache.preload(mesh_key)
+
+            object_directory = self.resolve_path(object_name)
+            for field in nodal_fields + element_fields:
+                value_range = object_catalog.known_value_range(field)
+                if self.field_statistics is not None:
+                    statistics = self.field_statistics.cached(
+                        object_directory, field)
+                    if (statistics is not None and
+                            statistics['global']['min'] is not None):
+                        value_range = dict(
+                            (key, statistics['global'][key])
+                            for key in ('min', 'max', 'timesteps'))
+                if value_range is not None:
+                    manifest['value_ranges'][field] = value_range
+
+            return json.dumps(manifest)
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
@@ -225,11 +379,8 @@ class WebServer:
             json_input = cherrypy.request.json
             object_name = json_input['object_name']
 
-            object_timesteps = self.get_sorted_timesteps(object_name)
-            sorted_timesteps = []
-            for timestep in object_timesteps:
-                sorted_timesteps.append(timestep[1])
-            return json.dumps({'object_timesteps': sorted_timesteps})
+            object_timesteps = self.object_catalog(object_name).timesteps()
+            return json.dumps({'object_timesteps': object_timesteps})
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
@@ -243,15 +394,9 @@ class WebServer:
             object_name = json_input['object_name']
             current_timestep = json_input['current_timestep']
 
-            object_timesteps = self.get_sorted_timesteps(object_name)
-            sorted_timesteps = []
-            for it in object_timesteps:
-                sorted_timesteps.append(it[1])
-            object_index = sorted_timesteps.index(current_timestep)
-            if object_index == 0:
-                return json.dumps({'previous_timestep': sorted_timesteps[0]})
-            else:
-                return json.dumps({'previous_timestep': sorted_timesteps[object_index - 1]})
+            previous_timestep = self.object_catalog(object_name).timestep_before(
+                current_timestep)
+            return json.dumps({'previous_timestep': previous_timestep})
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
@@ -265,17 +410,249 @@ class WebServer:
             object_name = json_input['object_name']
             current_timestep = json_input['current_timestep']
 
-            object_timesteps = self.get_sorted_timesteps(object_name)
-            sorted_timesteps = []
-            for it in object_timesteps:
-                sorted_timesteps.append(it[1])
+            next_timestep = self.object_catalog(object_name).timestep_after(
+                current_timestep)
+            return json.dumps({'next_timestep': next_timestep})
 
-            number_of_timesteps = len(sorted_timesteps)
-            object_index = sorted_timesteps.index(current_timestep)
-            if object_index == number_of_timesteps - 1:
-                return json.dumps({'next_timestep': sorted_timesteps[number_of_timesteps - 1]})
-            else:
-                return json.dumps({'next_timestep': sorted_timesteps[object_index + 1]})
+        def resolve_path(self, relative_path):
+            """Return the absolute path of a path relative to the mesh
+            directory.
+
+            Raises a 403 for paths that point outside of the mesh directory.
+            """
+            path = os.path.abspath(
+                os.path.join(self.mesh_directory, relative_path))
+            if (os.path.commonpath([path, self.mesh_directory]) !=
+                    self.mesh_directory):
+                raise cherrypy.HTTPError(
+                    403, 'Path outside of the mesh directory')
+            return path
+
+        def object_catalog(self, object_name):
+            """Return the catalog of an object.
+            """
+            self.resolve_path(object_name)
+            try:
+                return self.catalog.get(object_name)
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'Unknown object {}'.format(object_name))
+
+        def viewer_state(self):
+            """Return the state of the viewer (session) of this request.
+            """
+            state = cherrypy.session.get('viewer_state')
+            if state is None:
+                state = viewer_state.ViewerState()
+                cherrypy.session['viewer_state'] = state
+            return state
+
+        def load_mesh(self, json_input):
+            """Load the mesh given by the node and element path in the
+            request for the viewer of this request and return its handle.
+
+            The paths are relative to the mesh directory, the element path
+            can be a list of paths (one per element type). The object the
+            mesh belongs to is 'object_name' in the request or else the
+            first directory of the node path.
+            """
+            nodepath = json_input.get('nodepath')
+            elementpath = json_input.get('elementpath')
+            if (not isinstance(nodepath, str) or not elementpath):
+                raise cherrypy.HTTPError(
+                    400, 'A mesh needs a nodepath and an elementpath.')
+            object_name = json_input.get(
+                'object_name', nodepath.replace('\\', '/').split('/')[0])
+
+            try:
+                mesh_key = self.mesh_cache.mesh_key(
+                    node_path=self.resolve_path(nodepath),
+                    element_path=[self.resolve_path(path) for path in
+                                  fem_mesh.element_paths(elementpath)]
+                )
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No mesh at {}'.format(nodepath))
+            handle = viewer_state.ObjectHandle(
+                object_name=object_name,
+                object_directory=self.resolve_path(object_name),
+                mesh_key=mesh_key
+            )
+            return self.viewer_state().set(handle)
+
+        def object_handle(self, object_name):
+            """Return the handle of the mesh of an object for the viewer of
+            this request.
+
+            If the viewer did not load a mesh for the object yet, the mesh
+            from the catalog is loaded.
+            """
+            handle = self.viewer_state().get(object_name)
+            if handle is not None:
+                return handle
+
+            nodepath, elementpath = self.object_catalog(
+                object_name).mesh_paths(object_name)
+            if nodepath is None:
+                raise cherrypy.HTTPError(
+                    404, 'No mesh for object {}'.format(object_name))
+            return self.load_mesh({'object_name': object_name,
+                                   'nodepath': nodepath,
+                                   'elementpath': elementpath})
+
+        def handle_mesh(self, handle):
+            """Return the mesh of a handle from the mesh cache, loading it
+            again if it has been evicted.
+            """
+            return self.mesh_cache.get_by_key(handle.mesh_key)
+
+        def surface_field_values(self, handle, mesh, field, timestep):
+            """Return the values of a field on the surface nodes of the mesh
+            of a handle, through the field cache.
+            """
+            try:
+                values = self.field_cache.get(
+                    handle.mesh_key, mesh, handle.object_directory,
+                    field, timestep)
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} at timestep {}'.format(field, timestep))
+            self.catalog.get(handle.object_name).record_value_range(
+                field, timestep, values)
+            return values
+
+        def surface_element_values(self, handle, mesh, field, timestep):
+            """Return the values of an element field on the surface elements
+            of the mesh of a handle, through the field cache.
+            """
+            try:
+                values = self.field_cache.get_elements(
+                    handle.mesh_key, mesh, handle.object_directory,
+                    field, timestep)
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No element field {} at timestep {}'.format(
+                        field, timestep))
+            except IndexError:
+                raise cherrypy.HTTPError(
+                    400, 'Element field {} does not fit the mesh'.format(
+                        field))
+            self.catalog.get(handle.object_name).record_value_range(
+                field, timestep, values)
+            return values
+
+        def value_range(self, json_input):
+            """Return the 'value_range' of the request as (min, max), or None
+            if there is none.
+            """
+            value_range = json_input.get('value_range', None)
+            if value_range is None:
+                return None
+            try:
+                minimum, maximum = (float(value) for value in value_range)
+            except (TypeError, ValueError):
+                raise cherrypy.HTTPError(
+                    400, 'The value range must be [min, max].')
+            if not (np.isfinite(minimum) and np.isfinite(maximum)):
+                raise cherrypy.HTTPError(
+                    400, 'The value range must be finite.')
+            return minimum, maximum
+
+        def render_buffers(self, handle, mesh, json_input):
+            """Return the RenderBuffers and the surface for the 'level' of
+            detail in the request (see get_surface_levels), or for the full
+            surface if there is none, and a function that returns the
+            values of a nodal ('node') or element ('element') field on that
+            surface.
+            """
+            def values(location, field, timestep):
+                if (location == 'element'):
+                    return self.surface_element_values(
+                        handle, mesh, field, timestep)[
+                            mesh.surface_element_indices]
+                return self.surface_field_values(
+                    handle, mesh, field, timestep)
+
+            level = json_input.get('level')
+            if (level is None or self.surface_lods is None):
+                return (self.view_cache.render_buffers(handle.mesh_key),
+                        mesh, values)
+
+            lod = self.surface_lods.get(handle.mesh_key, mesh)
+            if (not isinstance(level, int) or isinstance(level, bool) or
+                    not 0 <= level < lod.level_count()):
+                raise cherrypy.HTTPError(
+                    400, 'No level {} for this mesh'.format(level))
+            # The last level is the surface itself.
+            if (level == lod.level_count() - 1):
+                return (self.view_cache.render_buffers(handle.mesh_key),
+                        mesh, values)
+
+            surface_level = lod.levels[level]
+
+            def level_values(location, field, timestep):
+                if (location == 'element'):
+                    return surface_level.triangle_values(
+                        values(location, field, timestep),
+                        mesh.return_surface_indices())
+                return surface_level.field_values(
+                    values(location, field, timestep))
+
+            return (self.view_cache.render_buffers(handle.mesh_key, level),
+                    surface_level, level_values)
+
+        def cross_section(self, handle, mesh, json_input):
+            """Return the Section of the mesh of a handle with the plane in
+            the request: a 'normal' and either a 'point' on the plane or
+            the 'offset' of the plane from the origin along the normal.
+            """
+            try:
+                normal = [float(value) for value in json_input['normal']]
+                if (len(normal) != 3):
+                    raise ValueError('The normal must have 3 components.')
+                if 'point' in json_input:
+                    point = [float(value) for value in json_input['point']]
+                    if (len(point) != 3):
+                        raise ValueError('The point must have 3 components.')
+                    return self.view_cache.cross_sections(
+                        handle.mesh_key).section(mesh, normal, point=point)
+                return self.view_cache.cross_sections(handle.mesh_key).section(
+                    mesh, normal, offset=float(json_input.get('offset', 0.)))
+            except (KeyError, TypeError, ValueError) as error:
+                raise cherrypy.HTTPError(400, str(error))
+
+        def isosurface(self, handle, mesh, json_input):
+            """Return the isosurface of the mesh of a handle for the
+            'field', 'timestep' and iso-'value' in the request.
+            """
+            field = json_input['field']
+            timestep = json_input['timestep']
+            try:
+                field_key = (field, timestep, fem_mesh.field_identity(
+                    handle.object_directory, field, timestep))
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} at timestep {}'.format(field, timestep))
+            try:
+                iso_value = float(json_input['value'])
+                return self.view_cache.isosurfaces(handle.mesh_key).surface(
+                    mesh, field_key,
+                    fem_mesh.read_field(
+                        handle.object_directory, field, timestep),
+                    iso_value)
+            except (KeyError, TypeError, ValueError) as error:
+                raise cherrypy.HTTPError(400, str(error))
+
+        def prefetch_around(self, handle, mesh, field, timestep):
+            """Load the neighbouring timesteps of a timestep into the field
+            cache in the background, for the viewer of this request.
+            """
+            if self.prefetcher is None:
+                return
+            timesteps = self.catalog.get(handle.object_name).timesteps()
+            self.prefetcher.schedule(
+                cherrypy.session.id, handle.mesh_key, mesh,
+                handle.object_directory, field, timesteps, timestep)
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
@@ -284,23 +661,40 @@ class WebServer:
             """
 
             json_input = cherrypy.request.json
-            print(json_input)
-            nodepath = json_input['nodepath']
-            elementpath = json_input['elementpath']
-
-            os.chdir(self.mesh_directory)
-            self.mesh_index = fem_mesh.UnpackMesh(
-                node_path=nodepath,
-                element_path=elementpath
-            )
+            mesh = self.handle_mesh(self.load_mesh(json_input))
 
-            surface_nodes = self.mesh_index.return_unique_surface_nodes()
-            surface_indexfile = self.mesh_index.return_surface_indices()
-            surface_metadata = self.mesh_index.return_metadata()
+            surface_nodes = mesh.return_unique_surface_nodes()
+            surface_indexfile = mesh.return_surface_indices()
+            surface_metadata = mesh.return_metadata()
 
-            return json.dumps({'surface_nodes': surface_nodes,
-                               'surface_indexfile': surface_indexfile,
-                               'surface_metadata': surface_metadata.tolist()})
+            with metrics.timed('json_encoding'):
+                return json.dumps({
+                    'surface_nodes': surface_nodes.ravel().tolist(),
+                    'surface_indexfile': surface_indexfile.ravel().tolist(),
+                    'surface_metadata': surface_metadata.tolist()
+                })
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def mesher_init_binary(self):
+            """Load the mesher class and return the surface as a binary
+            buffer.
+
+            Takes the same input as mesher_init. See
+            binary_transport.pack_geometry for the layout of the buffer.
+            """
+
+            json_input = cherrypy.request.json
+            mesh = self.handle_mesh(self.load_mesh(json_input))
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_geometry(
+                surface_nodes=mesh.return_unique_surface_nodes(),
+                surface_indices=mesh.return_surface_indices(),
+                bounding_box=mesh.return_bounding_box(),
+                center=mesh.return_metadata()
+            )
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
@@ -314,13 +708,407 @@ class WebServer:
             field = json_input['field']
             timestep = json_input['timestep']
 
-            timestep_data = self.mesh_index.return_data_for_unique_nodes(object_name, field, timestep)
+            handle = self.object_handle(object_name)
+            mesh = self.handle_mesh(handle)
+            timestep_data = self.surface_field_values(
+                handle, mesh, field, timestep)
+            self.prefetch_around(handle, mesh, field, timestep)
+
+            with metrics.timed('json_encoding'):
+                return json.dumps({'timestep_data': timestep_data.tolist()})
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_timestep_data_binary(self):
+            """Like get_timestep_data, but return the field values as a
+            binary buffer.
+
+            The optional 'encoding' in the request is one of 'float32'
+            (default), 'float16' or 'uint16'. See binary_transport.pack_field
+            for the layout of the buffer.
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            field = json_input['field']
+            timestep = json_input['timestep']
+            encoding = json_input.get('encoding', 'float32')
+
+            if encoding not in binary_transport.FIELD_ENCODINGS:
+                raise cherrypy.HTTPError(
+                    400, 'Unknown encoding {}'.format(encoding))
+
+            handle = self.object_handle(object_name)
+            mesh = self.handle_mesh(handle)
+            timestep_data = self.surface_field_values(
+                handle, mesh, field, timestep)
+            self.prefetch_around(handle, mesh, field, timestep)
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_field(timestep_data, encoding)
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_render_geometry(self):
+            """Load the mesher class and return ready-to-upload,
+            non-indexed vertex buffers for the surface.
+
+            Takes the same input as mesher_init and optionally a 'level'
+            of detail (see get_surface_levels). See
+            binary_transport.pack_render_geometry for the layout of the
+            buffer.
+            """
+
+            json_input = cherrypy.request.json
+            handle = self.load_mesh(json_input)
+            mesh = self.handle_mesh(handle)
+
+            buffers, surface, _ = self.render_buffers(
+                handle, mesh, json_input)
+            positions, barycentrics = buffers.geometry(surface)
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_render_geometry(
+                positions=positions,
+                barycentrics=barycentrics,
+                bounding_box=mesh.return_bounding_box(),
+                center=mesh.return_metadata()
+            )
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_render_field(self):
+            """Return the field values of a timestep for every vertex of
+            the render buffers from get_render_geometry.
+
+            Besides object_name, field and timestep the request can hold
+            'flat_shading' (average the values over every triangle),
+            'value_range' ([min, max], normalise the values onto [0, 1]),
+            'encoding' (see get_timestep_data_binary), 'level' (the level
+            of detail of the geometry) and 'location' ('node' for a nodal
+            field, the default, or 'element' for an element field, which
+            is shown flat on the faces of the elements).
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            field = json_input['field']
+            timestep = json_input['timestep']
+            flat_shading = bool(json_input.get('flat_shading', False))
+            value_range = self.value_range(json_input)
+            encoding = json_input.get('encoding', 'float32')
+            location = json_input.get('location', 'node')
+
+            if encoding not in binary_transport.FIELD_ENCODINGS:
+                raise cherrypy.HTTPError(
+                    400, 'Unknown encoding {}'.format(encoding))
+            if location not in ('node', 'element'):
+                raise cherrypy.HTTPError(
+                    400, 'Unknown location {}'.format(location))
+
+            handle = self.object_handle(object_name)
+            mesh = self.handle_mesh(handle)
+            buffers, surface, values = self.render_buffers(
+                handle, mesh, json_input)
+            try:
+                field_values = buffers.field(
+                    surface, handle.object_directory, field, timestep,
+                    lambda: values(location, field, timestep),
+                    flat_shading=flat_shading, value_range=value_range,
+                    location=location)
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} at timestep {}'.format(field, timestep))
+            if (location == 'node'):
+                self.prefetch_around(handle, mesh, field, timestep)
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_field(field_values, encoding)
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_cross_section(self):
+            """Return the section of the volume of a mesh with a plane as
+            non-indexed vertex buffers, like get_render_geometry.
+
+            The request holds object_name, the 'normal' of the plane and
+            either a 'point' on it or its 'offset' from the origin along the
+            normal. The triangles face along the normal, the bounding box
+            and center are those of the whole mesh.
+            """
+
+            json_input = cherrypy.request.json
+            handle = self.object_handle(json_input['object_name'])
+            mesh = self.handle_mesh(handle)
+            section = self.cross_section(handle, mesh, json_input)
+
+            positions = render_buffers.expand_positions(
+                section.positions, section.triangles)
+            barycentrics = render_buffers.barycentric_coordinates(
+                section.triangles.shape[0])
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_render_geometry(
+                positions=positions,
+                barycentrics=barycentrics,
+                bounding_box=mesh.return_bounding_box(),
+                center=mesh.return_metadata()
+            )
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_cross_section_field(self):
+            """Return the field values of a timestep for every vertex of the
+            buffers from get_cross_section, interpolated along the element
+            edges the plane cuts.
+
+            Takes the plane as get_cross_section, field and timestep, and
+            optionally 'value_range' and 'encoding' as get_render_field.
+            Only the field values at the nodes next to the plane are read.
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            field = json_input['field']
+            timestep = json_input['timestep']
+            value_range = self.value_range(json_input)
+            encoding = json_input.get('encoding', 'float32')
+
+            if encoding not in binary_transport.FIELD_ENCODINGS:
+                raise cherrypy.HTTPError(
+                    400, 'Unknown encoding {}'.format(encoding))
+
+            handle = self.object_handle(object_name)
+            section = self.cross_section(
+                handle, self.handle_mesh(handle), json_input)
+
+            try:
+                corner_values = section.interpolate(
+                    fem_mesh.read_field_entries(
+                        handle.object_directory, field, timestep,
+                        section.nodes))
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} at timestep {}'.format(field, timestep))
+            field_values = render_buffers.expand_field(
+                corner_values, section.triangles)
+            if value_range is not None:
+                field_values = render_buffers.normalise_field(
+                    field_values, value_range)
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_field(field_values, encoding)
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_isosurface(self):
+            """Return the isosurface of a nodal field through the volume of
+            a mesh as non-indexed vertex buffers, like get_render_geometry.
 
-            output_data = []
-            for datapoint in timestep_data:
-                output_data.append(datapoint[0])
+            The request holds object_name, field, timestep and the
+            iso-'value'. The triangles face towards higher values, the
+            bounding box and center are those of the whole mesh.
+            """
 
-            return json.dumps({'timestep_data': output_data})
+            json_input = cherrypy.request.json
+            handle = self.object_handle(json_input['object_name'])
+            mesh = self.handle_mesh(handle)
+            surface = self.isosurface(handle, mesh, json_input)
+
+            positions = render_buffers.expand_positions(
+                surface.positions, surface.triangles)
+            barycentrics = render_buffers.barycentric_coordinates(
+                surface.triangles.shape[0])
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_render_geometry(
+                positions=positions,
+                barycentrics=barycentrics,
+                bounding_box=mesh.return_bounding_box(),
+                center=mesh.return_metadata()
+            )
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_isosurface_field(self):
+            """Return the values of a nodal field for every vertex of the
+            buffers from get_isosurface.
+
+            Takes the same input as get_isosurface, with 'color_field' (by
+            default the field of the isosurface) the field whose values at
+            the same timestep are returned, and optionally 'value_range'
+            and 'encoding' as get_render_field.
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            color_field = json_input.get('color_field', json_input['field'])
+            value_range = self.value_range(json_input)
+            encoding = json_input.get('encoding', 'float32')
+
+            if encoding not in binary_transport.FIELD_ENCODINGS:
+                raise cherrypy.HTTPError(
+                    400, 'Unknown encoding {}'.format(encoding))
+
+            handle = self.object_handle(object_name)
+            surface = self.isosurface(
+                handle, self.handle_mesh(handle), json_input)
+
+            try:
+                corner_values = surface.interpolate(
+                    fem_mesh.read_field_entries(
+                        handle.object_directory, color_field,
+                        json_input['timestep'], surface.nodes))
+            except FileNotFoundError:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} at timestep {}'.format(
+                        color_field, json_input['timestep']))
+            field_values = render_buffers.expand_field(
+                corner_values, surface.triangles)
+            if value_range is not None:
+                field_values = render_buffers.normalise_field(
+                    field_values, value_range)
+
+            cherrypy.response.headers['Content-Type'] = \
+                'application/octet-stream'
+            return binary_transport.pack_field(field_values, encoding)
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_surface_levels(self):
+            """Return the vertex and triangle count of every level of detail
+            of the surface of a mesh, coarsest first. The last level is the
+            full surface.
+
+            Takes the same input as mesher_init. A viewer shows the coarsest
+            level first and then asks for finer levels with 'level' in
+            get_render_geometry and get_render_field.
+
+            Returns a json file.
+            """
+
+            json_input = cherrypy.request.json
+            handle = self.load_mesh(json_input)
+            lod = self.surface_lods.get(handle.mesh_key,
+                                        self.handle_mesh(handle))
+            return json.dumps({'levels': lod.describe()})
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_node_history(self):
+            """Return the values of a field at some nodes over all timesteps
+            of the field.
+
+            The request holds object_name, field and either 'nodes' (node
+            numbers, i.e. rows of the node file) or 'surface_vertices'
+            (vertex indices as in return_surface_indices). With 'format':
+            'binary' the answer is a buffer from
+            binary_transport.pack_history, otherwise a json file with the
+            timesteps and one list of values per node.
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            field = json_input['field']
+            answer_format = json_input.get('format', 'json')
+
+            handle = self.object_handle(object_name)
+            mesh = self.handle_mesh(handle)
+            try:
+                if 'surface_vertices' in json_input:
+                    vertices = np.asarray(
+                        json_input['surface_vertices'], dtype=np.int64)
+                    if np.any((vertices < 0) | (vertices >= len(
+                            mesh.return_unique_surface_nodes()))):
+                        raise ValueError('Surface vertex out of range.')
+                    nodes = mesh.return_nodes_for_surface_vertices(vertices)
+                else:
+                    nodes = np.asarray(json_input['nodes'], dtype=np.int64)
+                    if np.any((nodes < 0) | (nodes >= len(mesh.nodes))):
+                        raise ValueError('Node out of range.')
+            except (KeyError, TypeError, ValueError) as error:
+                raise cherrypy.HTTPError(400, str(error))
+
+            timesteps = self.object_catalog(object_name).field_timesteps(
+                field)
+            if not timesteps:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} for object {}'.format(
+                        field, object_name))
+            history = fem_mesh.read_node_history(
+                handle.object_directory, field, timesteps, nodes)
+            timestep_values = [float(timestep) for timestep in timesteps]
+
+            if (answer_format == 'binary'):
+                cherrypy.response.headers['Content-Type'] = \
+                    'application/octet-stream'
+                return binary_transport.pack_history(
+                    timestep_values, history, nodes.shape[0])
+
+            with metrics.timed('json_encoding'):
+                return json.dumps({'timesteps': timesteps,
+                                   'timestep_values': timestep_values,
+                                   'nodes': nodes.tolist(),
+                                   'values': history.T.tolist()})
+
+        @cherrypy.expose
+        @cherrypy.tools.json_in()
+        def get_field_statistics(self):
+            """Return the minimum, maximum, mean and histogram of a nodal
+            field over all its timesteps and the minimum, maximum and mean of
+            every timestep.
+
+            The request holds object_name and field, 'per_timestep': false
+            leaves out the timesteps and 'timestep_histograms': true adds the
+            histogram of every timestep. See FieldStatistics.summary for the
+            answer. The first request for a field reads all its timesteps,
+            later requests only read the ones that changed.
+
+            Returns a json file.
+            """
+
+            json_input = cherrypy.request.json
+            object_name = json_input['object_name']
+            field = json_input['field']
+            per_timestep = bool(json_input.get('per_timestep', True))
+            timestep_histograms = bool(
+                json_input.get('timestep_histograms', False))
+
+            timesteps = self.object_catalog(object_name).field_timesteps(
+                field)
+            if not timesteps:
+                raise cherrypy.HTTPError(
+                    404, 'No field {} for object {}'.format(
+                        field, object_name))
+
+            statistics = self.field_statistics.get(
+                self.resolve_path(object_name), field, timesteps,
+                per_timestep=per_timestep,
+                timestep_histograms=timestep_histograms)
+            statistics['field'] = field
+            return json.dumps(statistics)
+
+        @cherrypy.expose
+        def get_cache_stats(self):
+            """Return the hit, miss and eviction counts and the fill level of
+            the server side caches. The same counts are served by /metrics.
+
+            Returns a json file.
+            """
+            stats = {'mesh_cache': self.mesh_cache.stats(),
+                     'field_cache': self.field_cache.stats()}
+            if self.mesh_cache.surface_cache is not None:
+                stats['surface_cache'] = self.mesh_cache.surface_cache.stats()
+            if self.surface_lods is not None:
+                stats['surface_lods'] = self.surface_lods.stats()
+            stats['view_cache'] = self.view_cache.stats()
+            return json.dumps(stats)
 
         @cherrypy.expose
         @cherrypy.tools.json_in()
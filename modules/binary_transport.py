@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Pack mesh data into binary buffers for the browser.
+
+Every buffer starts with a fixed size little-endian header, followed by the
+raw arrays. The header size is a multiple of 4 bytes, so the browser can
+wrap the arrays directly in typed arrays (Float32Array, Uint32Array, ...)
+without copying them.
+"""
+
+import struct
+
+import numpy as np
+
+import modules.metrics as metrics
+
+FORMAT_VERSION = 1
+
+# Type codes for the arrays that follow the header.
+TYPE_FLOAT32 = 1
+TYPE_UINT32 = 2
+TYPE_FLOAT16 = 3
+TYPE_UINT16 = 4
+
+TYPE_DTYPES = {
+    TYPE_FLOAT32: np.dtype('<f4'),
+    TYPE_UINT32: np.dtype('<u4'),
+    TYPE_FLOAT16: np.dtype('<f2'),
+    TYPE_UINT16: np.dtype('<u2'),
+}
+
+# The encodings a client can ask for when requesting field values. uint16
+# maps the range [minimum, maximum] of the values linearly onto
+# [0, 65535].
+FIELD_ENCODINGS = {
+    'float32': TYPE_FLOAT32,
+    'float16': TYPE_FLOAT16,
+    'uint16': TYPE_UINT16,
+}
+
+# magic, version, vertex count, triangle count, position type, index type,
+# bounding box minimum (x, y, z), bounding box maximum (x, y, z),
+# center (x, y, z)
+GEOMETRY_MAGIC = b'FGLG'
+GEOMETRY_HEADER = struct.Struct('<4s5I9f')
+
+
+def as_bytes(array, type_code):
+    """Return the raw bytes of an array in the dtype of the type code.
+    """
+    return np.ascontiguousarray(
+        array, dtype=TYPE_DTYPES[type_code]).tobytes()
+
+
+@metrics.timed('binary_encoding')
+def pack_geometry(surface_nodes, surface_indices, bounding_box, center):
+    """Pack the surface of a mesh into one buffer.
+
+    The header holds the vertex and triangle count, the type codes of the
+    two arrays and the bounding box and center of the surface. It is
+    followed by the float32 vertex positions (x, y, z for every vertex) and
+    the uint32 triangle indices (three per triangle).
+    """
+    surface_nodes = np.asarray(surface_nodes).reshape(-1, 3)
+    surface_indices = np.asarray(surface_indices).reshape(-1, 3)
+    bounding_box = np.asarray(bounding_box, dtype=np.float64).reshape(2, 3)
+
+    header = GEOMETRY_HEADER.pack(
+        GEOMETRY_MAGIC, FORMAT_VERSION,
+        surface_nodes.shape[0], surface_indices.shape[0],
+        TYPE_FLOAT32, TYPE_UINT32,
+        *bounding_box[0], *bounding_box[1], *np.asarray(center))
+
+    return b''.join([
+        header,
+        as_bytes(surface_nodes, TYPE_FLOAT32),
+        as_bytes(surface_indices, TYPE_UINT32)
+    ])
+
+
+# magic, version, vertex count, value type, bounding box minimum (x, y, z),
+# bounding box maximum (x, y, z), center (x, y, z)
+RENDER_GEOMETRY_MAGIC = b'FGLR'
+RENDER_GEOMETRY_HEADER = struct.Struct('<4s3I9f')
+
+
+@metrics.timed('binary_encoding')
+def pack_render_geometry(positions, barycentrics, bounding_box, center):
+    """Pack non-indexed render buffers into one buffer.
+
+    The header holds the number of vertices (three per triangle), the type
+    code of the arrays and the bounding box and center of the surface. It
+    is followed by the float32 positions and the float32 barycentric
+    coordinates, three values per vertex each.
+    """
+    positions = np.asarray(positions).reshape(-1, 3)
+    bounding_box = np.asarray(bounding_box, dtype=np.float64).reshape(2, 3)
+
+    header = RENDER_GEOMETRY_HEADER.pack(
+        RENDER_GEOMETRY_MAGIC, FORMAT_VERSION, positions.shape[0],
+        TYPE_FLOAT32,
+        *bounding_box[0], *bounding_box[1], *np.asarray(center))
+
+    return b''.join([
+        header,
+        as_bytes(positions, TYPE_FLOAT32),
+        as_bytes(barycentrics, TYPE_FLOAT32)
+    ])
+
+
+# magic, version, value count, value type, minimum, maximum
+FIELD_MAGIC = b'FGLF'
+FIELD_HEADER = struct.Struct('<4s3I2d')
+
+
+@metrics.timed('binary_encoding')
+def pack_field(values, encoding='float32'):
+    """Pack field values (one per surface vertex or one per vertex of the
+    render buffers) into one buffer.
+
+    The header holds the number of values, the type code of the encoding
+    and the minimum and maximum of the values. For the uint16 encoding the
+    values v are stored as round((v - min)/(max - min)*65535), the client
+    reverses that with the minimum and maximum from the header.
+    """
+    if encoding not in FIELD_ENCODINGS:
+        raise ValueError('Unknown encoding {encoding_t}, use one of '
+                         '{encodings_t}.'.format(
+                             encoding_t=encoding,
+                             encodings_t=sorted(FIELD_ENCODINGS)))
+    type_code = FIELD_ENCODINGS[encoding]
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if (values.shape[0] == 0):
+        minimum, maximum = 0., 0.
+    else:
+        minimum, maximum = float(values.min()), float(values.max())
+
+    if (type_code == TYPE_UINT16):
+        value_range = maximum - minimum
+        if (value_range > 0):
+            values = np.rint((values - minimum) * (65535 / value_range))
+        else:
+            values = np.zeros_like(values)
+
+    header = FIELD_HEADER.pack(
+        FIELD_MAGIC, FORMAT_VERSION, values.shape[0], type_code,
+        minimum, maximum)
+
+    return header + as_bytes(values, type_code)
+
+
+# magic, version, timestep count, node count, value type
+HISTORY_MAGIC = b'FGLH'
+HISTORY_HEADER = struct.Struct('<4s4I')
+
+
+@metrics.timed('binary_encoding')
+def pack_history(timestep_values, history, node_count):
+    """Pack the values of a field at some nodes over time into one buffer.
+
+    history is a (timesteps, node_count) array. The header holds the number of
+    timesteps and nodes and the type code of the arrays. It is followed by
+    the float32 timestep values and the float32 field values, node by node
+    (the history of a node is contiguous).
+    """
+    timestep_values = np.asarray(timestep_values, dtype=np.float64).ravel()
+    history = np.asarray(history).reshape(timestep_values.shape[0],
+                                          node_count)
+
+    header = HISTORY_HEADER.pack(
+        HISTORY_MAGIC, FORMAT_VERSION, history.shape[0], history.shape[1],
+        TYPE_FLOAT32)
+
+    return b''.join([
+        header,
+        as_bytes(timestep_values, TYPE_FLOAT32),
+        as_bytes(history.T, TYPE_FLOAT32)
+    ])
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+A thread-safe least-recently-used cache with a memory budget.
+"""
+
+import collections
+import threading
+from concurrent.futures import Future
+
+
+class LRUCache:
+    """Keep values up to a total size of max_bytes, evict the least recently
+    used values first.
+
+    size_of is called once for every value that is stored (and again by
+    refresh, for values that grow) and returns its size in bytes. Loading
+    is single-flight: if several threads ask for the same missing key at
+    the same time, the loader runs once and all of them get its result (or
+    its exception).
+
+    dropped(key, value) is called for every value that is evicted,
+    replaced, discarded or cleared, after it has left the cache.
+    """
+
+    def __init__(self, max_bytes, size_of, dropped=None):
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.dropped = dropped
+
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> (value, size)
+        self._loading = {}                          # key -> Future
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the value for key without loading it.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get_or_load(self, key, loader):
+        """Return the value for key, call loader() to get it if it is not in
+        the cache.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+            self.misses += 1
+            future = self._loading.get(key)
+            if future is None:
+                future = Future()
+                self._loading[key] = future
+                is_loader = True
+            else:
+                is_loader = False
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as exception:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(exception)
+            raise
+
+        self.put(key, value)
+        with self._lock:
+            del self._loading[key]
+        future.set_result(value)
+        return value
+
+    def put(self, key, value):
+        """Store a value, evicting old values until it fits.
+
+        A value that is larger than the whole budget is not stored.
+        """
+        size = self.size_of(value)
+        dropped = []
+
+        with self._lock:
+            if key in self._entries:
+                old_value, old_size = self._entries.pop(key)
+                self._bytes -= old_size
+                if old_value is not value:
+                    dropped.append((key, old_value))
+
+            if (size <= self.max_bytes):
+                self._entries[key] = (value, size)
+                self._bytes += size
+                dropped.extend(self.evict())
+
+        self.notify_dropped(dropped)
+
+    def refresh(self, key):
+        """Measure the value of key again after it has grown or shrunk,
+        evicting old values until it fits.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return
+            value = self._entries[key][0]
+        size = self.size_of(value)
+        dropped = []
+
+        with self._lock:
+            # The value may have been evicted or replaced in the meantime.
+            if (key not in self._entries or
+                    self._entries[key][0] is not value):
+                return
+            self._bytes -= self._entries.pop(key)[1]
+            if (size > self.max_bytes):
+                self.evictions += 1
+                dropped.append((key, value))
+            else:
+                self._entries[key] = (value, size)
+                self._bytes += size
+                dropped.extend(self.evict())
+
+        self.notify_dropped(dropped)
+
+    def evict(self):
+        """Evict the least recently used values until the cache fits its
+        budget and return them as a list of (key, value).
+
+        Must be called with self._lock held.
+        """
+        evicted = []
+        while (self._bytes > self.max_bytes):
+            evicted_key, (evicted_value, evicted_size) = \
+                self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+            evicted.append((evicted_key, evicted_value))
+        return evicted
+
+    def notify_dropped(self, dropped):
+        """Call self.dropped for a list of (key, value) that left the cache.
+        """
+        if self.dropped is not None:
+            for key, value in dropped:
+                self.dropped(key, value)
+
+    def discard(self, key):
+        """Remove key from the cache if it is in there.
+        """
+        dropped = []
+        with self._lock:
+            if key in self._entries:
+                value, size = self._entries.pop(key)
+                self._bytes -= size
+                dropped.append((key, value))
+        self.notify_dropped(dropped)
+
+    def clear(self):
+        """Remove all values.
+        """
+        with self._lock:
+            dropped = [(key, value) for key, (value, _)
+                       in self._entries.items()]
+            self._entries.clear()
+            self._bytes = 0
+        self.notify_dropped(dropped)
+
+    def stats(self):
+        """Return a dict with the hit, miss and eviction counts and the
+        current fill level.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+A catalog of the timesteps and fields of the objects in the mesh directory.
+
+An object is a directory with a 'fo' directory in it. Every directory in
+'fo' whose name is a number is a timestep, and the .bin files in the field
+directories (see FIELD_DIRECTORIES) of a timestep are its fields.
+
+Scanning thousands of timestep directories (possibly on a network file
+system) for every request is slow, so the catalog remembers what it has
+seen and only looks again where a directory mtime has changed.
+
+Nodal fields that have been packed into a time-series store (see
+modules/timeseries.py) are listed at the timesteps of the store, also if
+the files of these timesteps have been deleted.
+"""
+
+import os
+import time
+import bisect
+import threading
+
+import modules.timeseries as timeseries
+import modules.element_types as element_types
+
+# Directories in a timestep that hold field files.
+FIELD_DIRECTORIES = ['nf', 'ef', 'no', 'eo']
+
+# The node file in the mesh directory of a timestep. The element files are
+# all files there that are named after an element type (see
+# modules/element_types.py), e.g. case.dc3d8.bin.
+NODE_FILE = 'case.nodes.bin'
+
+
+def directory_mtime(path):
+    """Return the mtime of a directory in ns, or None if it does not exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def list_fields(path):
+    """Return the set of field names (.bin files without the ending) in a
+    directory.
+    """
+    try:
+        file_names = os.listdir(path)
+    except OSError:
+        return set()
+    return set(file_name[:-len('.bin')] for file_name in file_names
+               if file_name.endswith('.bin'))
+
+
+def list_element_files(path):
+    """Return the sorted names of the element files in a mesh directory.
+    """
+    try:
+        file_names = os.listdir(path)
+    except OSError:
+        return []
+    return sorted(file_name for file_name in file_names
+                  if element_types.type_name_for_path(file_name)
+                  in element_types.ELEMENT_TYPES)
+
+
+class TimestepEntry:
+    """What the catalog knows about one timestep directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.directory_mtimes = {}
+        self.fields = {}
+        self.element_files = []
+        self.has_mesh = False
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the field directories whose mtime has changed and check
+        for a mesh.
+        """
+        mesh_path = os.path.join(self.path, 'mesh')
+        mtime = directory_mtime(mesh_path)
+        if (mtime != self.directory_mtimes.get('mesh', -1)):
+            self.directory_mtimes['mesh'] = mtime
+            self.element_files = list_element_files(mesh_path)
+            self.has_mesh = (
+                mtime is not None and
+                os.path.isfile(os.path.join(mesh_path, NODE_FILE)) and
+                len(self.element_files) > 0)
+
+        for field_directory in FIELD_DIRECTORIES:
+            path = os.path.join(self.path, field_directory)
+            mtime = directory_mtime(path)
+            if (mtime == self.directory_mtimes.get(field_directory, -1)):
+                continue
+            self.directory_mtimes[field_directory] = mtime
+            if mtime is None:
+                self.fields.pop(field_directory, None)
+            else:
+                self.fields[field_directory] = list_fields(path)
+
+
+class ObjectCatalog:
+    """The timesteps and fields of one object.
+
+    The catalog refreshes itself at most every min_refresh_interval seconds.
+    A refresh stats the 'fo' directory and lists it again only if its mtime
+    changed, new timesteps are scanned right away. The field directories of
+    timesteps that are already known are checked again every
+    field_refresh_interval seconds.
+    """
+
+    def __init__(self, object_directory, min_refresh_interval=1.,
+                 field_refresh_interval=30.):
+        self.object_directory = object_directory
+        self.fo_directory = os.path.join(object_directory, 'fo')
+        self.ts_directory = os.path.join(object_directory, 'ts')
+        self.min_refresh_interval = min_refresh_interval
+        self.field_refresh_interval = field_refresh_interval
+
+        self._lock = threading.RLock()
+        self._fo_mtime = None
+        self._ts_mtime = -1
+        self._last_refresh = None
+        self._last_field_refresh = None
+        self._entries = {}
+        self.timestep_values = []
+        self.timestep_names = []
+        self.store_timesteps = {}
+        self.value_ranges = {}
+
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Bring the catalog up to date with the file system.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (not force and self._last_refresh is not None and
+                    now - self._last_refresh < self.min_refresh_interval):
+                return
+            self._last_refresh = now
+
+            fo_mtime = directory_mtime(self.fo_directory)
+            if (fo_mtime is None):
+                raise FileNotFoundError(
+                    'No fo directory in {}'.format(self.object_directory))
+
+            ts_mtime = directory_mtime(self.ts_directory)
+            if (fo_mtime != self._fo_mtime or ts_mtime != self._ts_mtime):
+                self._fo_mtime = fo_mtime
+                self._ts_mtime = ts_mtime
+                self.rescan_timesteps()
+            elif (force or now - self._last_field_refresh >=
+                  self.field_refresh_interval):
+                for entry in self._entries.values():
+                    entry.refresh()
+            else:
+                return
+            self._last_field_refresh = now
+
+    def rescan_timesteps(self):
+        """List the fo directory and the time-series stores, add new and
+        drop removed timesteps.
+        """
+        self.store_timesteps = {}
+        for field in timeseries.list_stores(self.object_directory):
+            try:
+                store = timeseries.open_store(self.object_directory, field)
+            except (OSError, ValueError) as error:
+                print('Ignoring time-series store of {}: {}'.format(
+                    field, error))
+                continue
+            if store is not None:
+                self.store_timesteps[field] = set(store.timestep_names)
+
+        names = set()
+        for store_names in self.store_timesteps.values():
+            names |= store_names
+        for name in os.listdir(self.fo_directory):
+            try:
+                float(name)
+            except ValueError:
+                continue
+            if os.path.isdir(os.path.join(self.fo_directory, name)):
+                names.add(name)
+
+        for name in list(self._entries):
+            if name not in names:
+                del self._entries[name]
+        for name in names:
+            if name in self._entries:
+                self._entries[name].refresh()
+            else:
+                self._entries[name] = TimestepEntry(
+                    os.path.join(self.fo_directory, name))
+
+        sorted_timesteps = sorted((float(name), name) for name in names)
+        self.timestep_values = [value for value, _ in sorted_timesteps]
+        self.timestep_names = [name for _, name in sorted_timesteps]
+
+    def timesteps(self):
+        """Return the names of the timesteps, sorted by their value.
+        """
+        self.refresh()
+        return list(self.timestep_names)
+
+    def timestep_before(self, timestep):
+        """Return the timestep before the given one, or the first timestep
+        if there is none before.
+        """
+        self.refresh()
+        with self._lock:
+            index = bisect.bisect_left(self.timestep_values, float(timestep))
+            return self.timestep_names[max(index - 1, 0)]
+
+    def timestep_after(self, timestep):
+        """Return the timestep after the given one, or the last timestep if
+        there is none after.
+        """
+        self.refresh()
+        with self._lock:
+            index = bisect.bisect_right(self.timestep_values, float(timestep))
+            return self.timestep_names[
+                min(index, len(self.timestep_names) - 1)]
+
+    def fields(self, field_directories=FIELD_DIRECTORIES):
+        """Return the sorted names of all fields in the given kind of field
+        directories, over all timesteps.
+        """
+        self.refresh()
+        with self._lock:
+            field_names = set()
+            for entry in self._entries.values():
+                for field_directory in field_directories:
+                    field_names |= entry.fields.get(field_directory, set())
+            if 'nf' in field_directories:
+                field_names |= set(self.store_timesteps)
+            return sorted(field_names)
+
+    def field_timesteps(self, field, field_directory='nf'):
+        """Return the sorted timesteps at which a field exists.
+        """
+        self.refresh()
+        with self._lock:
+            store_names = set()
+            if (field_directory == 'nf'):
+                store_names = self.store_timesteps.get(field, set())
+            return [name for name in self.timestep_names
+                    if name in store_names or
+                    field in self._entries[name].fields.get(
+                        field_directory, set())]
+
+    def mesh_timestep(self):
+        """Return the first timestep that has a mesh directory with a node
+        and an element file, or None.
+        """
+        self.refresh()
+        with self._lock:
+            for name in self.timestep_names:
+                if self._entries[name].has_mesh:
+                    return name
+        return None
+
+    def mesh_paths(self, object_name):
+        """Return the node and element path of the mesh of the object,
+        relative to the mesh directory (as the viewer sends them to
+        mesher_init), or (None, None) if there is no mesh.
+
+        The element path is a list of paths if the mesh has elements of
+        several types.
+        """
+        timestep = self.mesh_timestep()
+        if timestep is None:
+            return None, None
+        with self._lock:
+            element_files = self._entries[timestep].element_files
+        mesh_path = os.path.join(object_name, 'fo', timestep, 'mesh')
+        element_paths = [os.path.join(mesh_path, element_file)
+                         for element_file in element_files]
+        if (len(element_paths) == 1):
+            element_paths = element_paths[0]
+        return os.path.join(mesh_path, NODE_FILE), element_paths
+
+    def record_value_range(self, field, timestep, values):
+        """Remember the minimum and maximum of the values of a field at a
+        timestep. Does nothing if the timestep is already known.
+        """
+        with self._lock:
+            field_ranges = self.value_ranges.setdefault(field, {})
+            if timestep in field_ranges or values.shape[0] == 0:
+                return
+            field_ranges[timestep] = (float(values.min()),
+                                      float(values.max()))
+
+    def known_value_range(self, field):
+        """Return the minimum and maximum over all timesteps of a field that
+        have been recorded so far and the number of these timesteps, or None
+        if none have been recorded.
+        """
+        with self._lock:
+            field_ranges = self.value_ranges.get(field)
+            if not field_ranges:
+                return None
+            minima, maxima = zip(*field_ranges.values())
+            return {'min': min(minima), 'max': max(maxima),
+                    'timesteps': len(field_ranges)}
+
+
+class Catalog:
+    """The catalogs of all objects in the mesh directory.
+    """
+
+    def __init__(self, mesh_directory):
+        self.mesh_directory = mesh_directory
+        self._lock = threading.Lock()
+        self._objects = {}
+
+    def get(self, object_name):
+        """Return the ObjectCatalog of an object.
+        """
+        with self._lock:
+            if object_name not in self._objects:
+                self._objects[object_name] = ObjectCatalog(
+                    os.path.join(self.mesh_directory, object_name))
+            return self._objects[object_name]
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Cut the element volume of a mesh with a plane.
+
+Every element that the plane cuts is split into tetrahedra (as given by its
+element type, see modules/element_types.py), and every tetrahedron is cut
+on its own (marching tetrahedra): one or two triangles with their corners
+on the tetrahedron edges that cross the plane. All elements and
+tetrahedra are handled at once with numpy.
+
+A corner of the section lies on an edge between two nodes a and b at
+x = (1 - t) * x_a + t * x_b, and its field value is interpolated the same
+way. A section is therefore kept as (a, b, t) per corner, and showing it at
+another timestep only reads the field values at the nodes a and b.
+
+The projection of every node onto the plane normal and its minimum and
+maximum per element are kept per normal, so moving the plane along its
+normal (dragging it) only compares these against the new offset.
+"""
+
+import threading
+import collections
+
+import numpy as np
+
+# The edges of a tetrahedron.
+TET_EDGES = np.array([[0, 1], [0, 2], [0, 3], [1, 2], [1, 3], [2, 3]])
+
+
+def tet_case_table():
+    """Return the marching tetrahedra table.
+
+    For each of the 16 cases (bit i set if corner i is below the plane) up
+    to two triangles, given as indices into TET_EDGES, -1 where there is
+    no triangle.
+    """
+    edge_index = dict(((int(a), int(b)), index)
+                      for index, (a, b) in enumerate(TET_EDGES))
+
+    def edge(a, b):
+        return edge_index[(min(a, b), max(a, b))]
+
+    table = -np.ones((16, 2, 3), dtype=np.int64)
+    for case in range(16):
+        below = [corner for corner in range(4) if case & (1 << corner)]
+        above = [corner for corner in range(4) if not case & (1 << corner)]
+        if (len(below) in (1, 3)):
+            lone, others = ((below[0], above) if len(below) == 1
+                            else (above[0], below))
+            table[case, 0] = [edge(lone, other) for other in others]
+        elif (len(below) == 2):
+            (a, b), (c, d) = below, above
+            table[case, 0] = [edge(a, c), edge(a, d), edge(b, d)]
+            table[case, 1] = [edge(a, c), edge(b, d), edge(b, c)]
+    return table
+
+
+TET_CASES = tet_case_table()
+
+
+class Section:
+    """The section of a mesh with a plane (or with an isosurface).
+
+    Corner i of the section lies between node edge_nodes[i, 0] and
+    edge_nodes[i, 1] at the weight weights[i]. triangles indexes the
+    corners, three per triangle, facing along the plane normal (towards
+    higher values for an isosurface). nodes are the (sorted, unique) nodes
+    at the ends of these edges.
+    """
+
+    def __init__(self, edge_nodes, weights, positions, triangles):
+        self.edge_nodes = edge_nodes
+        self.weights = weights
+        self.positions = positions
+        self.triangles = triangles
+        self.nodes, node_pairs = np.unique(edge_nodes, return_inverse=True)
+        self.node_pairs = node_pairs.reshape(-1, 2)
+
+    def interpolate(self, node_values):
+        """Return the values on the corners of the section from the values
+        at self.nodes.
+        """
+        node_values = np.asarray(node_values, dtype=np.float64).ravel()
+        return ((1 - self.weights) * node_values[self.node_pairs[:, 0]] +
+                self.weights * node_values[self.node_pairs[:, 1]])
+
+    def nbytes(self):
+        """Return the memory used by the section.
+        """
+        return (self.edge_nodes.nbytes + self.weights.nbytes +
+                self.positions.nbytes + self.triangles.nbytes +
+                self.nodes.nbytes + self.node_pairs.nbytes)
+
+
+def element_tetrahedra(element_blocks, selections):
+    """Return the tetrahedra, as a (tetrahedra, 4) array of nodes, of the
+    selected elements of every block of (ElementType, elements).
+    selections holds an index array or mask per block.
+    """
+    tets = [np.asarray(elements)[selection][:, element_type.tets].reshape(
+        -1, 4) for (element_type, elements), selection in
+            zip(element_blocks, selections)]
+    if not tets:
+        return np.empty((0, 4), dtype=np.int64)
+    return np.concatenate(tets)
+
+
+def cut_tetrahedra(nodes, tets, node_distances):
+    """Return the Section of the tetrahedra (a (tetrahedra, 4) array of
+    nodes) with the surface where node_distances is 0.
+
+    node_distances holds a value for every node, linear along the edges of
+    the tetrahedra: the signed distance from a plane for a cross section,
+    the field value minus the iso-value for an isosurface. The triangles
+    face towards growing node_distances.
+    """
+    below = node_distances[tets] < 0
+    cases = (below * np.array([1, 2, 4, 8])).sum(axis=1)
+    cut = (cases != 0) & (cases != 15)
+    tets, below = tets[cut], below[cut]
+    triangle_edges = TET_CASES[cases[cut]]
+
+    # One row per triangle: the tetrahedron it comes from and its edges.
+    valid = triangle_edges[:, :, 0] >= 0
+    triangle_tets = np.nonzero(valid)[0]
+    triangle_edges = triangle_edges[valid]
+
+    # The node pairs of all triangle corners, smaller node first.
+    corner_nodes = tets[triangle_tets[:, np.newaxis, np.newaxis],
+                        TET_EDGES[triangle_edges]]
+    corner_nodes = np.sort(corner_nodes.reshape(-1, 2), axis=1)
+
+    # Triangles of neighbouring tetrahedra share the corners on common
+    # edges. An edge is keyed by one integer, which np.unique sorts much
+    # faster than rows.
+    node_count = np.int64(node_distances.shape[0])
+    edge_keys, corners = np.unique(
+        corner_nodes[:, 0].astype(np.int64) * node_count + corner_nodes[:, 1],
+        return_inverse=True)
+    edge_nodes = np.stack([edge_keys // node_count, edge_keys % node_count],
+                          axis=1)
+    triangles = corners.reshape(-1, 3)
+
+    distance_a = node_distances[edge_nodes[:, 0]]
+    distance_b = node_distances[edge_nodes[:, 1]]
+    weights = distance_a / (distance_a - distance_b)
+    positions = ((1 - weights)[:, np.newaxis] * nodes[edge_nodes[:, 0]] +
+                 weights[:, np.newaxis] * nodes[edge_nodes[:, 1]])
+
+    # Turn all triangles to face from the corners of their tetrahedron
+    # below the surface to the corners above it.
+    if (triangles.shape[0] > 0):
+        tet_below = below[triangle_tets]
+        tet_weights = (~tet_below / (~tet_below).sum(
+            axis=1, keepdims=True) - tet_below / tet_below.sum(
+                axis=1, keepdims=True))
+        upwards = (tet_weights[:, :, np.newaxis] *
+                   nodes[tets[triangle_tets]]).sum(axis=1)
+
+        corner_positions = positions[triangles]
+        facing = (np.cross(
+            corner_positions[:, 1] - corner_positions[:, 0],
+            corner_positions[:, 2] - corner_positions[:, 0]) *
+            upwards).sum(axis=1)
+        flip = facing < 0
+        triangles[flip] = triangles[flip][:, [0, 2, 1]]
+
+    return Section(edge_nodes, weights, positions, triangles)
+
+
+class CrossSections:
+    """Sections of one mesh, with the projections for the last few plane
+    normals and the last few sections kept.
+
+    The mesh is passed to every call and not kept, so a cached
+    CrossSections does not keep a mesh alive. resized() is called whenever
+    a projection or a section has been added.
+    """
+
+    def __init__(self, projection_entries=2, section_entries=8,
+                 resized=None):
+        self.resized = resized
+        self.projection_entries = projection_entries
+        self.section_entries = section_entries
+        self._projections = collections.OrderedDict()
+        self._sections = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def projections(self, mesh, normal_key):
+        """Return the projection of every node on a normal and, for every
+        element block of the mesh, the minimum and maximum projection of
+        every element.
+        """
+        with self._lock:
+            if normal_key in self._projections:
+                self._projections.move_to_end(normal_key)
+                return self._projections[normal_key]
+
+        node_projections = np.asarray(mesh.nodes) @ np.array(normal_key)
+        element_ranges = []
+        for _, elements in mesh.element_blocks:
+            element_projections = node_projections[elements]
+            element_ranges.append((element_projections.min(axis=1),
+                                   element_projections.max(axis=1)))
+        projections = (node_projections, element_ranges)
+
+        with self._lock:
+            self._projections[normal_key] = projections
+            while len(self._projections) > self.projection_entries:
+                self._projections.popitem(last=False)
+
+        if self.resized is not None:
+            self.resized()
+        return projections
+
+    def section(self, mesh, normal, point=None, offset=None):
+        """Return the Section of the mesh with the plane through point (or
+        at the distance offset from the origin) with the given normal.
+        """
+        normal = np.asarray(normal, dtype=np.float64)
+        length = np.linalg.norm(normal)
+        if not (np.all(np.isfinite(normal)) and length > 0):
+            raise ValueError('The normal of the plane must not be 0.')
+        normal = normal / length
+        if point is not None:
+            offset = float(np.asarray(point, dtype=np.float64) @ normal)
+        offset = float(offset)
+
+        normal_key = tuple(np.round(normal, 12).tolist())
+        key = (normal_key, offset)
+        with self._lock:
+            if key in self._sections:
+                self._sections.move_to_end(key)
+                return self._sections[key]
+
+        node_projections, element_ranges = self.projections(mesh, normal_key)
+        tets = element_tetrahedra(
+            mesh.element_blocks,
+            [(minimum < offset) & (maximum >= offset)
+             for minimum, maximum in element_ranges])
+        section = cut_tetrahedra(np.asarray(mesh.nodes), tets,
+                                 node_projections - offset)
+
+        with self._lock:
+            self._sections[key] = section
+            while len(self._sections) > self.section_entries:
+                self._sections.popitem(last=False)
+
+        if self.resized is not None:
+            self.resized()
+        return section
+
+    def nbytes(self):
+        """Return the memory used by the projections and the sections.
+        """
+        with self._lock:
+            return (sum(node_projections.nbytes +
+                        sum(minimum.nbytes + maximum.nbytes
+                            for minimum, maximum in element_ranges)
+                        for node_projections, element_ranges
+                        in self._projections.values()) +
+                    sum(section.nbytes()
+                        for section in self._sections.values()))
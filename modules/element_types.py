@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The element types a mesh can consist of, and the extraction of the
+boundary of a mesh from them.
+
+An element file holds the (0-based) node numbers of its elements, the
+number of nodes per element is given by the element type. The type is
+taken from the name of the file, case.<type>.bin, e.g. case.dc3d8.bin or
+case.c3d10.bin (a leading 'd' for heat transfer elements and trailing
+letters like 'r' or 'h' are ignored). A mesh with elements of several
+types has one element file per type.
+
+For every type the registry holds the faces of an element, each with its
+corner nodes in outward winding (counter-clockwise seen from outside) and
+all its nodes (corners first, then the midside nodes in the same order),
+the triangles a face is split into, and the tetrahedra an element is split
+into for cross sections and isosurfaces.
+
+A face of the mesh is numbered element * FACES_PER_ELEMENT + the number of
+the face in its element type, where the elements of all element files are
+numbered one after the other.
+"""
+
+import re
+import os
+
+import numpy as np
+
+FACES_PER_ELEMENT = 6
+
+# Triangles of a face, as indices into the nodes of the face, by the number
+# of nodes of the face.
+FACE_TRIANGLES = {
+    3: np.array([[0, 1, 2]]),
+    4: np.array([[0, 1, 2], [0, 2, 3]]),
+    6: np.array([[0, 3, 5], [3, 1, 4], [5, 4, 2], [3, 4, 5]]),
+    8: np.array([[0, 4, 7], [4, 1, 5], [5, 2, 6], [7, 6, 3],
+                 [4, 5, 6], [4, 6, 7]])
+}
+
+# The six tetrahedra of a hexahedron, all around the diagonal 0-6.
+HEX_TETS = [[0, 1, 2, 6], [0, 2, 3, 6], [0, 3, 7, 6],
+            [0, 7, 4, 6], [0, 4, 5, 6], [0, 5, 1, 6]]
+
+
+class ElementType:
+    """An element type: its name, the number of nodes of an element, its
+    faces as lists of nodes (corners first) and its tetrahedra.
+    """
+
+    def __init__(self, name, node_count, faces, tets):
+        self.name = name
+        self.node_count = node_count
+        self.faces = [np.array(face) for face in faces]
+        self.tets = np.array(tets)
+
+    def face_groups(self):
+        """Return the faces grouped by their number of nodes, as a list of
+        (face numbers, (faces, nodes) array).
+        """
+        groups = {}
+        for number, face in enumerate(self.faces):
+            groups.setdefault(face.shape[0], []).append(number)
+        return [(np.array(numbers),
+                 np.array([self.faces[number] for number in numbers]))
+                for numbers in groups.values()]
+
+
+ELEMENT_TYPES = {}
+
+
+def register(element_type):
+    """Add an element type to the registry.
+    """
+    ELEMENT_TYPES[element_type.name] = element_type
+    return element_type
+
+
+register(ElementType(
+    'c3d4', 4,
+    faces=[[0, 2, 1], [0, 1, 3], [1, 2, 3], [2, 0, 3]],
+    tets=[[0, 1, 2, 3]]))
+
+register(ElementType(
+    'c3d6', 6,
+    faces=[[0, 2, 1], [3, 4, 5],
+           [0, 1, 4, 3], [1, 2, 5, 4], [2, 0, 3, 5]],
+    tets=[[0, 1, 2, 3], [1, 2, 3, 4], [2, 3, 4, 5]]))
+
+register(ElementType(
+    'c3d8', 8,
+    faces=[[0, 1, 5, 4], [1, 2, 6, 5], [2, 3, 7, 6],
+           [3, 0, 4, 7], [4, 5, 6, 7], [3, 2, 1, 0]],
+    tets=HEX_TETS))
+
+# Midside nodes 4 to 9 lie on the edges 0-1, 1-2, 2-0, 0-3, 1-3 and 2-3.
+register(ElementType(
+    'c3d10', 10,
+    faces=[[0, 2, 1, 6, 5, 4], [0, 1, 3, 4, 8, 7],
+           [1, 2, 3, 5, 9, 8], [2, 0, 3, 6, 7, 9]],
+    tets=[[0, 1, 2, 3]]))
+
+# Midside nodes 8 to 19 lie on the edges 0-1, 1-2, 2-3, 3-0, 4-5, 5-6,
+# 6-7, 7-4, 0-4, 1-5, 2-6 and 3-7.
+register(ElementType(
+    'c3d20', 20,
+    faces=[[0, 1, 5, 4, 8, 17, 12, 16], [1, 2, 6, 5, 9, 18, 13, 17],
+           [2, 3, 7, 6, 10, 19, 14, 18], [3, 0, 4, 7, 11, 16, 15, 19],
+           [4, 5, 6, 7, 12, 13, 14, 15], [3, 2, 1, 0, 10, 9, 8, 11]],
+    tets=HEX_TETS))
+
+DEFAULT_TYPE = 'c3d8'
+
+TYPE_PATTERN = re.compile(r'^d?(c3d\d+)[a-z]*$')
+
+
+def type_name_for_path(path):
+    """Return the name of the element type of an element file, or None if
+    its name does not name one.
+    """
+    parts = os.path.basename(path).lower().split('.')
+    if (len(parts) < 3):
+        return None
+    match = TYPE_PATTERN.match(parts[-2])
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def element_type_for_path(path):
+    """Return the ElementType of an element file.
+
+    Files whose name does not name a type hold C3D8 elements. Raises a
+    ValueError for a type that is not in the registry.
+    """
+    name = type_name_for_path(path)
+    if name is None:
+        name = DEFAULT_TYPE
+    if name not in ELEMENT_TYPES:
+        raise ValueError('{path_t} holds {name_t} elements, which are not '
+                         'supported (supported are {names_t}).'.format(
+                             path_t=path, name_t=name.upper(),
+                             names_t=', '.join(sorted(ELEMENT_TYPES))))
+    return ELEMENT_TYPES[name]
+
+
+def find_boundary_faces(faces):
+    """Return the (ascending) indices of the faces that occur exactly once.
+
+    Two faces are the same if they consist of the same nodes, no matter in
+    which order or winding. Every face is canonicalised by sorting its nodes,
+    the canonical faces are sorted lexicographically and runs of equal faces
+    are counted. Faces with a count of one are not shared by two elements
+    and thus lie on the surface.
+    """
+    if (faces.shape[0] == 0):
+        return np.empty(0, dtype=np.intp)
+
+    canonical_faces = np.sort(faces, axis=1)
+
+    # np.lexsort sorts by the last key first.
+    order = np.lexsort(canonical_faces.T[::-1])
+    sorted_faces = canonical_faces[order]
+
+    # Mark the first face of every run of identical faces.
+    run_starts = np.empty(sorted_faces.shape[0], dtype=bool)
+    run_starts[0] = True
+    np.any(sorted_faces[1:] != sorted_faces[:-1], axis=1, out=run_starts[1:])
+
+    run_ids = np.cumsum(run_starts) - 1
+    run_lengths = np.bincount(run_ids)
+
+    return np.sort(order[run_lengths[run_ids] == 1])
+
+
+def face_corner_count(face):
+    """Return the number of corners of a face given by all its nodes.
+    """
+    return {3: 3, 4: 4, 6: 3, 8: 4}[face.shape[0]]
+
+
+def boundary_faces(element_blocks):
+    """Return the faces of a mesh that lie on its boundary.
+
+    element_blocks is a list of (ElementType, elements) with an
+    (elements, nodes) array per element type. The faces of all elements
+    are generated at once per element type and face shape. A face that
+    belongs to exactly one element lies on the boundary. Faces are compared
+    by their corners, so triangular faces of tetrahedra and wedges (and
+    quadrilateral faces of wedges and hexahedra) of different blocks are
+    matched with each other.
+
+    Returns a list of batches (elements, element offset, face numbers,
+    faces, rows), one per element type and face shape, where rows are the
+    boundary faces of the batch (element row * number of faces + face).
+    """
+    # Per number of corners: the corner faces, and for every batch of them
+    # (element type, face group) what is needed to triangulate it.
+    corner_faces = {3: [], 4: []}
+    batches = {3: [], 4: []}
+
+    element_offset = 0
+    for element_type, elements in element_blocks:
+        for numbers, faces in element_type.face_groups():
+            corners = face_corner_count(faces[0])
+            corner_faces[corners].append(
+                elements[:, faces[:, :corners]].reshape(-1, corners))
+            batches[corners].append(
+                (elements, element_offset, numbers, faces))
+        element_offset += elements.shape[0]
+
+    boundary_batches = []
+    for corners in (3, 4):
+        if not corner_faces[corners]:
+            continue
+        faces = corner_faces[corners]
+        boundary = find_boundary_faces(
+            faces[0] if len(faces) == 1 else np.concatenate(faces))
+
+        start = 0
+        for elements, element_offset, numbers, faces in batches[corners]:
+            end = start + elements.shape[0] * numbers.shape[0]
+            rows = boundary[(boundary >= start) & (boundary < end)] - start
+            start = end
+            boundary_batches.append(
+                (elements, element_offset, numbers, faces, rows))
+    return boundary_batches
+
+
+def triangulate_faces(boundary_batches):
+    """Return the triangles of the faces from boundary_faces and the face
+    number of every triangle.
+    """
+    triangles = []
+    triangle_faces = []
+    for elements, element_offset, numbers, faces, rows in boundary_batches:
+        # Rows are ordered element by element, face by face.
+        element_rows = rows // numbers.shape[0]
+        group_faces = rows % numbers.shape[0]
+
+        face_nodes = elements[element_rows[:, np.newaxis],
+                              faces[group_faces]]
+        face_triangles = FACE_TRIANGLES[faces.shape[1]]
+        triangles.append(face_nodes[:, face_triangles].reshape(-1, 3))
+        triangle_faces.append(np.repeat(
+            (element_offset + element_rows) * FACES_PER_ELEMENT +
+            numbers[group_faces], face_triangles.shape[0]))
+
+    if not triangles:
+        return (np.empty((0, 3), dtype=np.int64),
+                np.empty(0, dtype=np.int64))
+    return np.concatenate(triangles), np.concatenate(triangle_faces)
+
+
+def boundary_triangles(element_blocks):
+    """Return the triangles of the boundary of a mesh and the face number
+    of every triangle (see boundary_faces and triangulate_faces).
+    """
+    return triangulate_faces(boundary_faces(element_blocks))
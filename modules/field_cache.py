@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+A process-wide cache of field values on the surface of a mesh.
+"""
+
+import modules.mesh_parser as fem_mesh
+from modules.cache import LRUCache
+
+
+class FieldCache:
+    """Hold the surface values of field files.
+
+    Only the values of the surface nodes (or, for element fields, of the
+    elements that own surface faces) of a mesh are kept, that is all the
+    viewer needs. An entry is keyed by the mesh it belongs to and by the
+    path, size and mtime of the field file (or its time-series store), so a
+    rewritten file is read again. The least recently used entries are
+    dropped once the entries exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_bytes, size_of=lambda values: values.nbytes)
+
+    def field_key(self, mesh_key, object_name, field, timestep):
+        """Return the cache key for the surface values of a field.
+        """
+        return (mesh_key, field, timestep, fem_mesh.field_identity(
+            object_name, field, timestep))
+
+    def contains(self, mesh_key, object_name, field, timestep):
+        """Return True if the surface values of a field are cached.
+
+        Does not count as a hit or a miss.
+        """
+        return self.field_key(mesh_key, object_name, field, timestep) \
+            in self.cache
+
+    def get(self, mesh_key, mesh, object_name, field, timestep):
+        """Return the values of a field on the surface nodes of mesh.
+
+        mesh_key is the key of mesh in the MeshCache.
+        """
+        key = self.field_key(mesh_key, object_name, field, timestep)
+        return self.cache.get_or_load(
+            key, lambda: mesh.return_data_for_unique_nodes(
+                object_name, field, timestep))
+
+    def get_elements(self, mesh_key, mesh, object_name, field, timestep):
+        """Return the values of an element field on the surface elements of
+        mesh (see UnpackMesh.return_data_for_surface_elements).
+        """
+        key = (mesh_key, 'elements', field, timestep,
+               fem_mesh.element_field_identity(object_name, field, timestep))
+        return self.cache.get_or_load(
+            key, lambda: mesh.return_data_for_surface_elements(
+                object_name, field, timestep))
+
+    def stats(self):
+        """Return the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.stats()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Statistics of the nodal fields of an object: the minimum, maximum and mean
+of every timestep and of all timesteps together, and histograms.
+
+The statistics of a timestep are computed in two passes over its values,
+first the minimum, maximum and sum, then the histogram over the range of
+all timesteps (so the histograms of all timesteps have the same bins and
+add up to the histogram of the field). Both passes read the values in
+chunks of CHUNK_VALUES and run for many timesteps at once on a thread pool.
+
+The results are kept in memory and on disk, in
+<object>/.fem-gl-cache/statistics or, if a cache directory is given, in
+<cache directory>/statistics/<hash of the object directory>, together with
+the identity (see mesh_parser.field_identity) of every
+timestep. Only timesteps that are new or whose file has changed are
+computed again.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+
+FORMAT_VERSION = 1
+DEFAULT_BINS = 64
+CHUNK_VALUES = 1 << 20
+
+
+def value_chunks(values):
+    """Yield an (n, 1) array of values in 1D chunks of at most CHUNK_VALUES
+    values.
+    """
+    for start in range(0, values.shape[0], CHUNK_VALUES):
+        yield values[start:start + CHUNK_VALUES, 0]
+
+
+def summarise_values(values):
+    """Return the minimum, maximum, mean and number of the values of an
+    (n, 1) array. Minimum, maximum and mean are None if there are none.
+    """
+    minimum, maximum, total = np.inf, -np.inf, 0.
+    for chunk in value_chunks(values):
+        minimum = min(minimum, float(chunk.min()))
+        maximum = max(maximum, float(chunk.max()))
+        total += float(chunk.sum(dtype=np.float64))
+
+    count = int(values.shape[0])
+    if (count == 0):
+        return {'min': None, 'max': None, 'mean': None, 'count': 0}
+    return {'min': minimum, 'max': maximum, 'mean': total / count,
+            'count': count}
+
+
+def histogram_edges(value_range, bins):
+    """Return the bin edges of a histogram with bins bins over
+    value_range.
+    """
+    return np.histogram_bin_edges(np.empty(0), bins=bins, range=value_range)
+
+
+def histogram_values(values, bins, value_range):
+    """Return the counts of a histogram of the values of an (n, 1) array.
+    """
+    counts = np.zeros(bins, dtype=np.int64)
+    for chunk in value_chunks(values):
+        counts += np.histogram(chunk, bins=bins, range=value_range)[0]
+    return counts
+
+
+class FieldStatistics:
+    """Compute and keep the statistics of fields.
+
+    If cache_directory is None the statistics are stored in a directory
+    called .fem-gl-cache in every object directory.
+    """
+
+    def __init__(self, workers=4, bins=DEFAULT_BINS, cache_directory=None):
+        self.bins = bins
+        self.cache_directory = cache_directory
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='statistics')
+
+        self._lock = threading.Lock()
+        self._field_locks = {}
+        self._entries = {}
+
+    def statistics_path(self, object_directory, field):
+        """Return the path of the file that holds the statistics of a field.
+        """
+        if self.cache_directory is None:
+            return os.path.join(object_directory, '.fem-gl-cache',
+                                'statistics', field + '.json')
+        entry_name = hashlib.sha1(
+            os.path.abspath(object_directory).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_directory, 'statistics', entry_name,
+                            field + '.json')
+
+    def field_lock(self, key):
+        """Return the lock that serialises the work on the statistics of a
+        field.
+        """
+        with self._lock:
+            return self._field_locks.setdefault(key, threading.Lock())
+
+    def load_entry(self, object_directory, field):
+        """Return the statistics of a field as far as they are known, from
+        memory or from disk, or None.
+        """
+        key = (object_directory, field)
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+
+        try:
+            with open(self.statistics_path(object_directory, field)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if (entry.get('version') != FORMAT_VERSION):
+            return None
+
+        with self._lock:
+            return self._entries.setdefault(key, entry)
+
+    def save_entry(self, object_directory, field, entry):
+        """Write the statistics of a field to disk. Does nothing if the
+        object directory is not writable.
+        """
+        path = self.statistics_path(object_directory, field)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temporary_path, 'w') as file:
+                json.dump(entry, file)
+            os.replace(temporary_path, path)
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    def cached(self, object_directory, field):
+        """Return the statistics of a field from the last call of get
+        without checking the files, or None.
+        """
+        entry = self.load_entry(object_directory, field)
+        if entry is None:
+            return None
+        return self.summary(entry, per_timestep=False)
+
+    def get(self, object_directory, field, timesteps, per_timestep=True,
+            timestep_histograms=False):
+        """Return the statistics of a field over the given timesteps.
+
+        Timesteps that have not been seen before or whose files changed are
+        read, the rest comes from memory (see summary for the result).
+        """
+        key = (object_directory, field)
+        with self.field_lock(key):
+            old_entry = self.load_entry(object_directory, field) or {}
+            old_timesteps = old_entry.get('timesteps', {})
+
+            identities = dict(self.executor.map(
+                lambda timestep: (timestep, list(fem_mesh.field_identity(
+                    object_directory, field, timestep))), timesteps))
+
+            entry = {'version': FORMAT_VERSION, 'bins': self.bins,
+                     'range': None, 'timesteps': {}}
+            stale = []
+            for timestep in timesteps:
+                old = old_timesteps.get(timestep)
+                if (old is not None and
+                        old['identity'] == identities[timestep]):
+                    entry['timesteps'][timestep] = dict(old)
+                else:
+                    stale.append(timestep)
+
+            def summarise(timestep):
+                values = fem_mesh.read_field(object_directory, field, timestep)
+                summary = summarise_values(values)
+                summary['identity'] = identities[timestep]
+                return timestep, summary
+
+            for timestep, summary in self.executor.map(summarise, stale):
+                entry['timesteps'][timestep] = summary
+
+            minima = [summary['min'] for summary in
+                      entry['timesteps'].values() if summary['count'] > 0]
+            maxima = [summary['max'] for summary in
+                      entry['timesteps'].values() if summary['count'] > 0]
+            if minima:
+                entry['range'] = [min(minima), max(maxima)]
+
+            # Histograms over another range or with other bins are useless.
+            if (entry['range'] != old_entry.get('range') or
+                    self.bins != old_entry.get('bins')):
+                for summary in entry['timesteps'].values():
+                    summary.pop('histogram', None)
+
+            def histogram(timestep):
+                values = fem_mesh.read_field(object_directory, field, timestep)
+                return timestep, histogram_values(
+                    values, self.bins, entry['range']).tolist()
+
+            missing = [timestep for timestep, summary in
+                       entry['timesteps'].items()
+                       if 'histogram' not in summary]
+            if entry['range'] is not None:
+                for timestep, counts in self.executor.map(histogram, missing):
+                    entry['timesteps'][timestep]['histogram'] = counts
+
+            with self._lock:
+                self._entries[key] = entry
+            if (stale or missing or
+                    set(old_timesteps) != set(entry['timesteps'])):
+                self.save_entry(object_directory, field, entry)
+
+        return self.summary(entry, timesteps, per_timestep,
+                            timestep_histograms)
+
+    def summary(self, entry, timesteps=None, per_timestep=True,
+                timestep_histograms=False):
+        """Turn the statistics of a field into the answer of get.
+
+        That is a dict with the minimum, maximum, mean, number of values,
+        histogram counts and bin edges over all timesteps and, if
+        per_timestep, a list with the minimum, maximum, mean and number of
+        values (and the histogram if timestep_histograms) of every
+        timestep.
+        """
+        if timesteps is None:
+            timesteps = sorted(entry['timesteps'], key=float)
+        summaries = [entry['timesteps'][timestep] for timestep in timesteps]
+        summaries_with_values = [summary for summary in summaries
+                                 if summary['count'] > 0]
+
+        count = sum(summary['count'] for summary in summaries_with_values)
+        statistics = {'timesteps': len(summaries), 'count': count,
+                      'min': None, 'max': None, 'mean': None,
+                      'histogram': None, 'bin_edges': None}
+        if summaries_with_values:
+            statistics['min'] = min(
+                summary['min'] for summary in summaries_with_values)
+            statistics['max'] = max(
+                summary['max'] for summary in summaries_with_values)
+            statistics['mean'] = sum(
+                summary['mean'] * summary['count']
+                for summary in summaries_with_values) / count
+            if all('histogram' in summary for summary in summaries):
+                statistics['histogram'] = np.sum(
+                    [summary['histogram'] for summary in summaries],
+                    axis=0).tolist()
+                statistics['bin_edges'] = histogram_edges(
+                    entry['range'], entry['bins']).tolist()
+
+        result = {'global': statistics}
+        if per_timestep:
+            result['per_timestep'] = []
+            for timestep, summary in zip(timesteps, summaries):
+                timestep_statistics = {
+                    'timestep': timestep, 'min': summary['min'],
+                    'max': summary['max'], 'mean': summary['mean'],
+                    'count': summary['count']}
+                if timestep_histograms:
+                    timestep_statistics['histogram'] = summary.get(
+                        'histogram')
+                result['per_timestep'].append(timestep_statistics)
+        return result
+
+    def shutdown(self):
+        """Stop the thread pool.
+        """
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Isosurfaces of nodal fields through the element volume of a mesh.
+
+An isosurface of a field at the value v is the surface where field - v is
+0, so it is cut out of the elements like a cross section (see
+cross_section.cut_tetrahedra), with field - v in place of the distance from
+the plane.
+
+Only elements whose minimum value is below v and whose maximum value is at
+or above v are cut. The minimum and maximum of every element are computed
+once per field and timestep. Around the first iso-value the elements whose
+values overlap a band of BAND_FRACTION of the value range are kept, so
+moving the iso-value within the band (a slider) only looks at these.
+"""
+
+import threading
+import collections
+
+import numpy as np
+
+import modules.cross_section as cross_section
+
+BAND_FRACTION = 0.05
+
+
+class ElementRanges:
+    """The minimum and maximum value of a field on every element, and the
+    elements that can be cut by iso-values within the last band.
+
+    The elements of all element blocks of a mesh are numbered one after
+    the other.
+    """
+
+    def __init__(self, element_blocks, node_values,
+                 band_fraction=BAND_FRACTION):
+        minima, maxima = [], []
+        for _, elements in element_blocks:
+            element_values = node_values[elements]
+            minima.append(element_values.min(axis=1))
+            maxima.append(element_values.max(axis=1))
+        self.element_minimum = np.concatenate(minima)
+        self.element_maximum = np.concatenate(maxima)
+        self.block_starts = np.cumsum(
+            [0] + [elements.shape[0] for _, elements in element_blocks])
+        self.band_width = band_fraction * float(
+            np.max(node_values) - np.min(node_values)
+            if node_values.shape[0] > 0 else 0.)
+        self.band = None
+        self._lock = threading.Lock()
+
+    def active_elements(self, iso_value):
+        """Return the indices of the elements that the isosurface at
+        iso_value cuts.
+        """
+        with self._lock:
+            if (self.band is None or
+                    not self.band[0] <= iso_value <= self.band[1]):
+                low = iso_value - self.band_width
+                high = iso_value + self.band_width
+                candidates = np.nonzero((self.element_minimum < high) &
+                                        (self.element_maximum >= low))[0]
+                self.band = (low, high, candidates,
+                             self.element_minimum[candidates],
+                             self.element_maximum[candidates])
+            _, _, candidates, minimum, maximum = self.band
+
+        return candidates[(minimum < iso_value) & (maximum >= iso_value)]
+
+    def block_selections(self, elements):
+        """Split ascending element numbers into the element indices of every
+        element block.
+        """
+        bounds = np.searchsorted(elements, self.block_starts)
+        return [elements[bounds[block]:bounds[block + 1]] -
+                self.block_starts[block]
+                for block in range(len(self.block_starts) - 1)]
+
+    def nbytes(self):
+        """Return the memory used by the ranges.
+        """
+        with self._lock:
+            band = self.band
+        return (self.element_minimum.nbytes + self.element_maximum.nbytes +
+                self.block_starts.nbytes +
+                (sum(array.nbytes for array in band[2:])
+                 if band is not None else 0))
+
+
+class Isosurfaces:
+    """Isosurfaces of one mesh, with the ElementRanges of the last few
+    fields and the last few isosurfaces kept.
+
+    A field is given by a key that changes when its values change (see
+    mesh_parser.field_identity) and its values at all nodes.
+
+    The mesh is passed to every call and not kept, so a cached Isosurfaces
+    does not keep a mesh alive. resized() is called whenever ranges or an
+    isosurface have been added.
+    """
+
+    def __init__(self, range_entries=4, surface_entries=8,
+                 band_fraction=BAND_FRACTION, resized=None):
+        self.resized = resized
+        self.range_entries = range_entries
+        self.surface_entries = surface_entries
+        self.band_fraction = band_fraction
+        self._ranges = collections.OrderedDict()
+        self._surfaces = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def ranges(self, mesh, field_key, node_values):
+        """Return the ElementRanges of a field.
+        """
+        with self._lock:
+            if field_key in self._ranges:
+                self._ranges.move_to_end(field_key)
+                return self._ranges[field_key]
+
+        ranges = ElementRanges(mesh.element_blocks, node_values,
+                               self.band_fraction)
+
+        with self._lock:
+            self._ranges[field_key] = ranges
+            while len(self._ranges) > self.range_entries:
+                self._ranges.popitem(last=False)
+
+        if self.resized is not None:
+            self.resized()
+        return ranges
+
+    def surface(self, mesh, field_key, node_values, iso_value):
+        """Return the isosurface of a field at iso_value as a
+        cross_section.Section. node_values is an (n,) or (n, 1) array with
+        the values at all nodes.
+        """
+        iso_value = float(iso_value)
+        if not np.isfinite(iso_value):
+            raise ValueError('The iso-value must be finite.')
+
+        key = (field_key, iso_value)
+        with self._lock:
+            if key in self._surfaces:
+                self._surfaces.move_to_end(key)
+                return self._surfaces[key]
+
+        node_values = np.asarray(node_values, dtype=np.float64).ravel()
+        ranges = self.ranges(mesh, field_key, node_values)
+        tets = cross_section.element_tetrahedra(
+            mesh.element_blocks,
+            ranges.block_selections(ranges.active_elements(iso_value)))
+        surface = cross_section.cut_tetrahedra(
+            np.asarray(mesh.nodes), tets, node_values - iso_value)
+
+        with self._lock:
+            self._surfaces[key] = surface
+            while len(self._surfaces) > self.surface_entries:
+                self._surfaces.popitem(last=False)
+
+        if self.resized is not None:
+            self.resized()
+        return surface
+
+    def nbytes(self):
+        """Return the memory used by the ranges and the isosurfaces.
+        """
+        with self._lock:
+            ranges = list(self._ranges.values())
+            surfaces = list(self._surfaces.values())
+        return (sum(element_ranges.nbytes() for element_ranges in ranges) +
+                sum(surface.nbytes() for surface in surfaces))
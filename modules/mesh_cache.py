@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+A process-wide cache of processed meshes.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+import modules.metrics as metrics
+from modules.cache import LRUCache
+
+
+def file_identity(path):
+    """Return (absolute path, size, mtime in ns) of a file.
+
+    If the file is rewritten, its size or mtime changes and so does its
+    identity.
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    return (abs_path, stat.st_size, stat.st_mtime_ns)
+
+
+def release_mesh(key, mesh):
+    """Release the shared memory behind the surface of a mesh that left the
+    cache (see process_pool.SharedSurface).
+
+    The surface arrays of the mesh are dropped first. A request that still
+    uses the mesh extracts the surface again.
+    """
+    shared_surface = getattr(mesh, 'shared_surface', None)
+    if shared_surface is None:
+        return
+    for name in shared_surface.arrays:
+        setattr(mesh, name, None)
+    mesh.shared_surface = None
+    shared_surface.release()
+
+
+class MeshCache:
+    """Hold processed UnpackMesh instances, keyed by the identity of their
+    node and element file.
+
+    Meshes are loaded with their surface already extracted, so a cache hit
+    does not cost any work. The least recently used meshes are dropped once
+    the meshes exceed max_bytes.
+
+    With a surface_cache (see modules/surface_cache.py) a surface that has
+    been extracted once is memory-mapped from disk instead of extracted
+    again, also after a restart.
+
+    With a process_pool (see modules/process_pool.py) surfaces are extracted
+    in worker processes, so a large mesh does not hold the GIL of the web
+    server while it is processed.
+
+    preload starts loading a mesh in the background, on up to
+    preload_workers threads.
+    """
+
+    def __init__(self, max_bytes, surface_cache=None, process_pool=None,
+                 preload_workers=2):
+        self.cache = LRUCache(
+            max_bytes, size_of=lambda mesh: mesh.memory_footprint(),
+            dropped=release_mesh)
+        self.surface_cache = surface_cache
+        self.process_pool = process_pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=preload_workers, thread_name_prefix='mesh-load')
+
+    def mesh_key(self, node_path, element_path):
+        """Return the cache key for a mesh. element_path is one path or a
+        list of paths (see mesh_parser.UnpackMesh).
+        """
+        return (file_identity(node_path),
+                tuple(file_identity(path)
+                      for path in fem_mesh.element_paths(element_path)))
+
+    def get(self, node_path, element_path):
+        """Return the processed mesh for the node and element file.
+
+        Concurrent requests for the same mesh wait for one load.
+        """
+        return self.get_by_key(self.mesh_key(node_path, element_path))
+
+    def get_by_key(self, key):
+        """Return the processed mesh for a key from mesh_key.
+        """
+        @metrics.timed('mesh_load')
+        def load():
+            node_path_abs = key[0][0]
+            element_path_abs = [identity[0] for identity in key[1]]
+            mesh = fem_mesh.UnpackMesh(
+                node_path=node_path_abs,
+                element_path=element_path_abs
+            )
+
+            surface = None
+            if self.surface_cache is not None:
+                surface = self.surface_cache.load(
+                    node_path_abs, element_path_abs)
+                if surface is not None:
+                    print('Loaded cached surface.')
+                    mesh.import_surface(surface)
+                    return mesh
+
+            if self.process_pool is None:
+                mesh.generate_unique_surface_triangles()
+            else:
+                shared_surface = self.process_pool.extract_surface(
+                    node_path_abs, element_path_abs)
+                mesh.import_surface(shared_surface.arrays)
+                # The surface arrays live in the shared memory blocks.
+                mesh.shared_surface = shared_surface
+
+            if self.surface_cache is not None:
+                self.surface_cache.save(
+                    node_path_abs, element_path_abs, mesh.export_surface())
+            return mesh
+
+        return self.cache.get_or_load(key, load)
+
+    def preload(self, key):
+        """Start loading the mesh for a key from mesh_key in the background,
+        unless it is cached. A request for the mesh in the meantime waits
+        for this load.
+        """
+        if key not in self.cache:
+            self.executor.submit(self.get_by_key, key)
+
+    def surface_summary(self, key):
+        """Return the vertex and triangle count, the bounding box and the
+        center of the surface of a mesh, if they are known without loading
+        the mesh: it is cached, or its surface is in the surface cache.
+        Otherwise return None.
+        """
+        mesh = self.cache.get(key) if key in self.cache else None
+        if mesh is not None:
+            vertices = mesh.return_unique_surface_nodes().shape[0]
+            triangles = mesh.return_surface_indices().shape[0]
+            bounding_box = mesh.return_bounding_box()
+        elif self.surface_cache is not None:
+            surface = self.surface_cache.load(
+                key[0][0], [identity[0] for identity in key[1]])
+            if surface is None:
+                return None
+            vertices = surface['unique_surface_triangles'].shape[0]
+            triangles = surface['surface_indices'].shape[0]
+            bounding_box = surface['bounding_box']
+        else:
+            return None
+
+        bounding_box = np.asarray(bounding_box, dtype=np.float64)
+        return {
+            'vertices': int(vertices),
+            'triangles': int(triangles),
+            'bounding_box': bounding_box.tolist(),
+            'center': ((bounding_box[0] + bounding_box[1]) / 2).tolist()
+        }
+
+    def shutdown(self):
+        """Stop the preload threads, without waiting for running loads.
+        """
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        """Return the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.stats()
@@ -19,17 +19,295 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 """main.py
-Unpacks some binary files and finds the surface of the mesh. Right now this is
-limited to C3D8 file format.
+Unpacks some binary files and finds the surface of the mesh. The element types
+that are understood are listed in modules/element_types.py.
 """
 
-import struct
+import os
 import numpy as np
 import matplotlib.cm as cm
 import sys
 
+import modules.timeseries as timeseries
+import modules.element_types as element_types
+import modules.metrics as metrics
+
+# The binary files are written as little-endian doubles (node coordinates and
+# field values) and little-endian 4 byte integers (element connectivity, as
+# many per element as the element type has nodes).
+NODE_DTYPE = np.dtype('<f8')
+ELEMENT_DTYPE = np.dtype('<i4')
+FIELD_DTYPE = np.dtype('<f8')
+
+# How the entries of the surface nodes are read from a field file: 'mmap'
+# gathers them from a memory map, 'pread' reads runs of them with
+# positioned reads (see read_entries), which needs fewer and larger reads on
+# network file systems. Set from the command line (see fem_gl.py).
+FIELD_READ_MODE = 'mmap'
+
+# The directories of a timestep that hold element fields, one value per
+# element, in the order they are looked in.
+ELEMENT_FIELD_DIRECTORIES = ['ef', 'eo']
+
+# Entries that are at most this many bytes apart are read with one pread,
+# including the bytes between them.
+COALESCE_GAP = 16 * 1024
+
+
+def read_binary_array(path, dtype, points_per_unit):
+    """Memory-map a binary file and return it as a (units, points_per_unit)
+    array.
+
+    No data is read here. The array is a read-only view over the file, the
+    operating system pages it in when (and if) it is accessed. Raises a
+    ValueError if the file size does not fit the dtype and the number of
+    points per unit.
+    """
+    dtype = np.dtype(dtype)
+    unit_size = dtype.itemsize * points_per_unit
+    file_size = os.path.getsize(path)
+
+    if (file_size % unit_size != 0):
+        raise ValueError(
+            '{path_t} has {size_t} bytes, which is not a multiple of '
+            '{unit_t} bytes ({points_t} x {dtype_t}).'.format(
+                path_t=path, size_t=file_size, unit_t=unit_size,
+                points_t=points_per_unit, dtype_t=dtype.str))
+
+    units = file_size // unit_size
+
+    # mmap refuses to map an empty file.
+    if (units == 0):
+        return np.empty((0, points_per_unit), dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r',
+                     shape=(units, points_per_unit))
+
+
+def read_entries(path, indices, dtype):
+    """Read the entries with the given indices from a binary file that
+    holds one value of dtype per entry.
+
+    Neighbouring indices are combined into runs (see COALESCE_GAP) and
+    every run is read with one positioned read into a common buffer, from
+    which the entries are gathered. Raises an IndexError for indices
+    outside of the file.
+    """
+    dtype = np.dtype(dtype)
+    indices = np.asarray(indices, dtype=np.int64)
+    if (indices.shape[0] == 0):
+        return np.empty(0, dtype=dtype)
+
+    # Sorted unique indices give the runs, the result is mapped back to the
+    # original order at the end.
+    inverse = None
+    if np.any(np.diff(indices) <= 0):
+        indices, inverse = np.unique(indices, return_inverse=True)
+
+    entries = os.path.getsize(path) // dtype.itemsize
+    if (indices[0] < 0 or indices[-1] >= entries):
+        raise IndexError('{path_t} has {entries_t} entries, index {index_t} '
+                         'is out of range.'.format(
+                             path_t=path, entries_t=entries,
+                             index_t=indices[0] if indices[0] < 0
+                             else indices[-1]))
+
+    gap = max(COALESCE_GAP // dtype.itemsize, 1)
+    run_breaks = np.flatnonzero(np.diff(indices) > gap) + 1
+    run_first = np.concatenate([[0], run_breaks])
+    run_last = np.concatenate([run_breaks - 1, [indices.shape[0] - 1]])
+    run_starts = indices[run_first]
+    run_lengths = indices[run_last] + 1 - run_starts
+    buffer_starts = np.concatenate([[0], np.cumsum(run_lengths)[:-1]])
+
+    buffer = np.empty(int(run_lengths.sum()), dtype=dtype)
+    byte_buffer = memoryview(buffer).cast('B')
+    metrics.READ_BYTES.inc(buffer.nbytes, source='field')
+    with open(path, 'rb', buffering=0) as binary_file:
+        descriptor = binary_file.fileno()
+        for run_start, run_length, buffer_start in zip(
+                run_starts.tolist(), run_lengths.tolist(),
+                buffer_starts.tolist()):
+            offset = run_start * dtype.itemsize
+            view = byte_buffer[buffer_start * dtype.itemsize:
+                               (buffer_start + run_length) * dtype.itemsize]
+            while view:
+                read_bytes = os.preadv(descriptor, [view], offset)
+                if (read_bytes == 0):
+                    raise ValueError('{} is shorter than expected.'.format(
+                        path))
+                view = view[read_bytes:]
+                offset += read_bytes
+
+    run_of_index = np.repeat(np.arange(run_starts.shape[0]),
+                             run_last - run_first + 1)
+    values = buffer[buffer_starts[run_of_index] + indices -
+                    run_starts[run_of_index]]
+
+    if inverse is not None:
+        return values[inverse]
+    return values
+
+
+def field_file_path(object_name, field, timestep):
+    """Return the path of the file that holds the nodal values of a field
+    for a timestep.
+    """
+    return os.path.join(object_name, 'fo', timestep, 'nf', field + '.bin')
+
+
+def element_field_path(object_name, field, timestep):
+    """Return the path of the file that holds the element values of a field
+    for a timestep, from the first of ELEMENT_FIELD_DIRECTORIES that has it.
+    """
+    paths = [os.path.join(object_name, 'fo', timestep, directory,
+                          field + '.bin')
+             for directory in ELEMENT_FIELD_DIRECTORIES]
+    for path in paths:
+        if os.path.isfile(path):
+            return path
+    return paths[0]
+
+
+def read_element_field_entries(object_name, field, timestep, elements):
+    """Return the values of an element field at a timestep for the given
+    elements as a 1D array, read as set by FIELD_READ_MODE.
+
+    Elements are numbered over all element files of the mesh, one after
+    the other, like the values in the field file.
+    """
+    path = element_field_path(object_name, field, timestep)
+    with metrics.timed('element_field_read'):
+        if (FIELD_READ_MODE == 'pread' and hasattr(os, 'preadv')):
+            return read_entries(path, elements, FIELD_DTYPE)
+        values = read_binary_array(path, FIELD_DTYPE, 1)[elements, 0]
+        metrics.READ_BYTES.inc(values.nbytes, source='field')
+        return values
+
+
+def element_field_identity(object_name, field, timestep):
+    """Return a tuple that changes when the values of an element field at a
+    timestep change.
+    """
+    path = os.path.abspath(element_field_path(object_name, field, timestep))
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def field_store_index(object_name, field, timestep):
+    """Return the time-series store of a field and the index of a timestep
+    in it, or (None, None) if no store holds the current values of the
+    timestep (see modules/timeseries.py).
+    """
+    store = timeseries.open_store(object_name, field)
+    if store is None:
+        return None, None
+    index = store.index(timestep, object_name, field)
+    if index is None:
+        return None, None
+    return store, index
+
+
+def read_field(object_name, field, timestep):
+    """Return the nodal values of a field at a timestep as an (n, 1) array.
+
+    The values come from the time-series store of the field if it holds
+    the timestep, otherwise the file of the timestep is memory-mapped.
+    """
+    store, index = field_store_index(object_name, field, timestep)
+    if store is not None:
+        return store.values(index)
+    return read_binary_array(
+        field_file_path(object_name, field, timestep), FIELD_DTYPE, 1)
+
+
+def read_field_entries(object_name, field, timestep, nodes):
+    """Return the values of a field at a timestep at the given nodes as a
+    1D array.
+
+    Only the entries of the nodes are read, from the time-series store of
+    the field if it holds the timestep, otherwise from the file of the
+    timestep as set by FIELD_READ_MODE.
+    """
+    with metrics.timed('field_read'):
+        store, index = field_store_index(object_name, field, timestep)
+        if store is not None:
+            values = store.values(index)[nodes, 0]
+            metrics.READ_BYTES.inc(values.nbytes, source='field_store')
+            return values
+
+        path = field_file_path(object_name, field, timestep)
+        if (FIELD_READ_MODE == 'pread' and hasattr(os, 'preadv')):
+            return read_entries(path, nodes, FIELD_DTYPE)
+        values = read_binary_array(path, FIELD_DTYPE, 1)[nodes, 0]
+        metrics.READ_BYTES.inc(values.nbytes, source='field')
+        return values
+
+
+def read_node_history(object_name, field, timesteps, nodes):
+    """Return the values of a field at the given nodes over the given
+    timesteps as a (len(timesteps), len(nodes)) array.
+
+    The timesteps that the time-series store of the field holds are
+    gathered from the store in one go, the others from their files with
+    read_field_entries.
+    """
+    nodes = np.asarray(nodes, dtype=np.intp)
+    history = np.empty((len(timesteps), nodes.shape[0]), dtype=FIELD_DTYPE)
+
+    store = timeseries.open_store(object_name, field)
+    store_rows = []
+    store_indices = []
+    for row, timestep in enumerate(timesteps):
+        index = None
+        if store is not None:
+            index = store.index(timestep, object_name, field)
+        if index is None:
+            history[row] = read_field_entries(
+                object_name, field, timestep, nodes)
+        else:
+            store_rows.append(row)
+            store_indices.append(index)
+
+    if store_rows:
+        history[store_rows] = store.history(nodes)[store_indices]
+    return history
+
+
+def field_identity(object_name, field, timestep):
+    """Return a tuple that changes when the values of a field at a
+    timestep change.
+
+    That is the path, size and mtime of the file of the timestep, or of the
+    time-series store if the file has been deleted after packing.
+    """
+    path = os.path.abspath(field_file_path(object_name, field, timestep))
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        store, index = field_store_index(object_name, field, timestep)
+        if store is None:
+            raise
+        return store.identity + (index,)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+
+def element_paths(element_path):
+    """Return the paths of the element files of a mesh as a list, from one
+    path or a list of paths.
+    """
+    if isinstance(element_path, (str, bytes, os.PathLike)):
+        return [element_path]
+    return list(element_path)
+
+
 class UnpackMesh:
     """Unpacks mesh data from two binary files and does some magic to it.
+
+    element_path is the path of an element file, or a list of paths for a
+    mesh with elements of several types (one file per type, see
+    modules/element_types.py).
     """
 
     def __init__(self, node_path, element_path):
@@ -37,15 +315,23 @@ class UnpackMesh:
 
         - unpacking the nodes and the elements of the mesh
         - initialising the timestep array
-        - initialising the surface quads for the elements
+        - initialising the surface faces for the elements
         - initialising the triangulated surface
         """
         self.get_binary_data(node_path, do='unpack', what='nodes')
-        self.get_binary_data(element_path, do='unpack', what='elements')
+        self.element_blocks = []
+        for path in element_paths(element_path):
+            self.get_binary_data(path, do='unpack', what='elements')
+        if not self.element_blocks:
+            raise ValueError('A mesh needs at least one element file.')
         self.timesteps = []
-        self.surface_quads = None
+        self.surface_faces = None
         self.surface_triangles = None
         self.unique_surface_triangles = None
+        self.surface_indices = None
+        self.unique_surface_elements = None
+        self.surface_element_indices = None
+        self.bounding_box = None
 
     def add_timestep(self, path):
         """Wrapper around the get_binary_data function.
@@ -54,6 +340,12 @@ class UnpackMesh:
         """
         return self.get_binary_data(path, do='add', what='timestep')
 
+    def read_timestep(self, path):
+        """Memory-map the field values of a timestep without adding them to
+        self.timesteps.
+        """
+        return read_binary_array(path, FIELD_DTYPE, 1)
+
     def get_binary_data(
             self, path,
             do,                 # {'unpack', 'add'}
@@ -64,207 +356,150 @@ class UnpackMesh:
         Specifying the what to do will either unpack nodes or elements or
         add a timestep to self.timesteps.
 
-        Open a file and read it as binary, unpack into an array in a specified
-        format, cast the array to numpy and reshape it.
+        The file is memory-mapped with an explicit little-endian dtype (see
+        read_binary_array), so the returned array is a view over the page
+        cache and not a copy of the file.
         """
         if (do == 'unpack' and what == 'nodes'):
-            size_of_data = 8    # 8 bytes of ...
-            data_type = 'd'     # ... doubles
+            data_type = NODE_DTYPE
             points_per_unit = 3  # 3 coords per node
         elif (do == 'unpack' and what == 'elements'):
-            size_of_data = 4    # 4 bytes of ...
-            data_type = 'i'     # ... integers
-            points_per_unit = 8  # 8 points per element
+            element_type = element_types.element_type_for_path(path)
+            data_type = ELEMENT_DTYPE
+            points_per_unit = element_type.node_count
         elif (do == 'add' and what == 'timestep'):
-            size_of_data = 8    # 8 bytes of ...
-            data_type = 'd'     # ... doubles
+            data_type = FIELD_DTYPE
             points_per_unit = 1  # 1 data point per unit.
         else:
             raise ValueError('Unknown parameters. Doing nothing.')
 
-        f = open(path, 'rb')
-        bin_data = f.read()
-        bin_data_points = int(len(bin_data) / size_of_data)
-
-        # I.e. '<123i' or '<123d' for bin_data_points = 123
-        struct_format = '<{size}'.format(size=bin_data_points) + data_type
+        with metrics.timed('unpack_' + what):
+            data = read_binary_array(path, data_type, points_per_unit)
+        if (do == 'unpack'):
+            metrics.READ_BYTES.inc(data.nbytes, source='mesh')
 
-        data = struct.unpack(struct_format, bin_data)
-        data = np.asarray(data)
-        data.shape = (int(bin_data_points/points_per_unit), points_per_unit)
         if (do == 'unpack' and what == 'nodes'):
             self.nodes = data
             print('Parsed {nodes_t} nodes.'.format(
                 nodes_t=data.shape[0]))
         elif (do == 'unpack' and what == 'elements'):
-            self.elements = data
-            print('Parsed {elements_t} elements.'.format(
-                elements_t=data.shape[0]))
-        elif (do == 'add', what == 'timestep'):
-            data = np.asarray(data)
+            self.element_blocks.append((element_type, data))
+            print('Parsed {elements_t} {type_t} elements.'.format(
+                elements_t=data.shape[0], type_t=element_type.name.upper()))
+        elif (do == 'add' and what == 'timestep'):
             self.timesteps.append(data)
         return data
 
     def generate_surfaces_for_elements(self):
-        """Finds the outward faces of the mesh (in other words: the surface).
-        Returns a numpy array with the surface faces.
-
-        The mesh consists of cubic elements with corner nodes.
-        Count the unique occurrences of each node. For each element generate
-        the six (outward pointing) faces. Iterate over all the points of
-        each face and add the occurrences (as previously generated) up.
-        Faces at the corner will have a count of 9, faces at the border a
-        count of 12 and faces in the middle of the plane a count of 16.
-        (You might want to draw it on a piece of paper.)
-        """
-        # self.elements is a map that points from each element to the nodes
-        # that constitute an element. In that sense two neighbouring elements
-        # will share at least 1 (corner) node. So that node will then appear
-        # at least twice in self.elements
-        _, node_counts = np.unique(self.elements,
-                                   return_counts=True)
-
-        # The ordering of the element indices that generate six outward
-        # pointing faces. Each element has 8 entries, counting from 0.
-        element_faces = [
-            [0, 1, 5, 4],
-            [1, 2, 6, 5],
-            [2, 3, 7, 6],
-            [3, 0, 4, 7],
-            [4, 5, 6, 7],
-            [3, 2, 1, 0]
-        ]
-
-        surfaces = []
-
-        def append_face_to_surfaces(element, element_face):
-            """Append the face to the output array.
-            """
-            face = [
-                element[element_face[0]],
-                element[element_face[1]],
-                element[element_face[2]],
-                element[element_face[3]]
-            ]
-            surfaces.append(face)
-
-        for element in self.elements:
-            for element_face in element_faces:
-                node_weight = node_counts[element[element_face[0]]] \
-                              + node_counts[element[element_face[1]]] \
-                              + node_counts[element[element_face[2]]] \
-                              + node_counts[element[element_face[3]]]
-
-                if (
-                        (node_weight == 9) or  # Corner faces
-                        (node_weight == 12) or  # Border faces
-                        (node_weight == 16)     # Plane faces
-                ):
-                    append_face_to_surfaces(element, element_face)
-                else:
-                    pass
-
-        self.surface_quads = np.asarray(surfaces)
-        print('Parsed {surface_quads_t} surface quads.'.format(
-            surface_quads_t=self.surface_quads.shape[0]))
-        return self.surface_quads
-
-    def generate_triangles_from_quads(self):
-        """From our list of quads generate outward pointing triangles.
+        """Finds the outward faces of the mesh (in other words: the surface)
+        and triangulates them. Returns a numpy array with the surface
+        triangles.
+
+        For each element generate its (outward pointing) faces, all
+        elements of a type at once. A face that is shared by two elements
+        lies inside the mesh, a face that belongs to exactly one element lies
+        on the surface. This only depends on the connectivity, so it also
+        holds for graded or unstructured meshes. See
+        element_types.boundary_triangles.
+
+        Also sets self.surface_faces, the face number (see
+        modules/element_types.py) of every surface triangle.
         """
-        if (self.surface_quads is None):
-            self.generate_surfaces_for_elements()
-
-        triangles = []
-
-        # Two triangles in every quad. This generates outward pointing
-        # triangles.
-        polygon_coordinates_in_quad = [
-            [0, 1, 2],
-            [0, 2, 3]
-        ]
-
-        print('Triangulating surface.')
-
-        for quad in self.surface_quads:
-            for polygon_coord in polygon_coordinates_in_quad:
-                triangle = [
-                    quad[polygon_coord[0]],
-                    quad[polygon_coord[1]],
-                    quad[polygon_coord[2]],
-                ]
-                triangles.append(triangle)
-
-        self.surface_triangles = np.asarray(triangles)
+        with metrics.timed('surface_extraction'):
+            self.surface_triangles, self.surface_faces = \
+                element_types.boundary_triangles(self.element_blocks)
         print('Parsed {surface_triangles_t} surface triangles.'.format(
             surface_triangles_t=self.surface_triangles.shape[0]))
         return self.surface_triangles
 
     def return_unique_surface_nodes(self):
-        """Returns the unique surface triangles.
+        """Returns the coordinates of the unique surface nodes.
+
+        A (nodes, 3) array, row i belongs to vertex index i as used in
+        return_surface_indices.
         """
         if (self.unique_surface_triangles is None):
             self.generate_unique_surface_triangles()
 
-        unique_surface_nodes = []
-        for triangle in self.unique_surface_triangles:
-            for corner in [0, 1, 2]:
-                unique_surface_nodes.append(self.nodes[triangle][corner])
-
-        return unique_surface_nodes
+        return np.take(self.nodes, self.unique_surface_triangles, axis=0)
 
     def return_surface_indices(self):
         """Returns the indices for the OpenGL array triangles.
 
         If a node is already present by means of another triangle, we dont want
-        to output it too. We dont want redundancy.
+        to output it too. We dont want redundancy. A (triangles, 3) array of
+        indices into return_unique_surface_nodes.
         """
         if (self.unique_surface_triangles is None):
             self.generate_unique_surface_triangles()
 
-        # Figure out how many unique nodes we have.
-        unique_nodes = np.unique(self.elements).shape[0]
-
-        # Initialise an array for those unique nodes with None for every
-        # element.
-        self.node_map = [None]*unique_nodes
+        return self.surface_indices
 
-        # Overwrite the None in this array with an index for the unique
-        # elements.
-        for index, value in enumerate(self.unique_surface_triangles):
-            self.node_map[value] = index
+    def return_data_for_unique_nodes(self, object_name, field, timestep):
+        """Returns the (i.e.) temperature data for unique nodes.
 
-        # We want to find out which index belongs to every corner of every
-        # triangle.
-        index_list = []
-        for triangle in self.surface_triangles:
-            for corner in triangle:
-                index_list.append(self.node_map[corner])
+        One value per vertex of return_unique_surface_nodes.
+        """
+        if (self.unique_surface_triangles is None):
+            self.generate_unique_surface_triangles()
 
-        return index_list
+        return read_field_entries(
+            object_name, field, timestep, self.unique_surface_triangles)
 
-    def return_data_for_unique_nodes(self, object_name, field, timestep):
-        """Returns the (i.e.) temperature data for unique nodes.
+    def return_nodes_for_surface_vertices(self, surface_vertices):
+        """Return the node numbers of vertices of
+        return_unique_surface_nodes.
         """
         if (self.unique_surface_triangles is None):
             self.generate_unique_surface_triangles()
 
-        # NOTE: Fixme.
-        timestep_data = self.add_timestep(object_name+'/fo/'+timestep+'/nf/'+field+'.bin')
+        return self.unique_surface_triangles[surface_vertices]
 
-        unique_surface_data = []
-        for triangle in self.unique_surface_triangles:
-            unique_surface_data.append(timestep_data[triangle])
+    def return_data_for_surface_elements(self, object_name, field,
+                                         timestep):
+        """Returns the values of an element field for the elements that own
+        a surface face.
 
-        return unique_surface_data
+        One value per entry of self.unique_surface_elements, the value of
+        surface triangle i is entry self.surface_element_indices[i].
+        """
+        if (self.unique_surface_triangles is None):
+            self.generate_unique_surface_triangles()
+
+        return read_element_field_entries(
+            object_name, field, timestep, self.unique_surface_elements)
 
     def generate_unique_surface_triangles(self):
         """Generate the unique surface triangles from all the surface_triangles.
+
+        Also generates the compact vertex index for every triangle corner and
+        self.node_map (see generate_node_map).
         """
         if (self.surface_triangles is None):
-            self.generate_triangles_from_quads()
+            self.generate_surfaces_for_elements()
+
+        with metrics.timed('index_remap'):
+            self.unique_surface_triangles, inverse = np.unique(
+                self.surface_triangles, return_inverse=True)
+            self.surface_indices = inverse.reshape(
+                self.surface_triangles.shape)
+
+            self.generate_surface_elements()
+            self.generate_node_map()
+
+    def generate_surface_elements(self):
+        """Generate the elements that own the surface triangles.
 
-        self.unique_surface_triangles = np.unique(self.surface_triangles)
+        self.unique_surface_elements holds every element with a face on the
+        surface once (ascending), self.surface_element_indices the index
+        into it for every surface triangle. An element field is then read
+        only at the surface elements and spread onto the triangles with one
+        gather.
+        """
+        self.unique_surface_elements, inverse = np.unique(
+            self.surface_faces // element_types.FACES_PER_ELEMENT,
+            return_inverse=True)
+        self.surface_element_indices = inverse.ravel()
 
     # def generate_triangle_files(self):
     #     """Generates a list of unique nodes and a index list to generate
@@ -342,34 +577,84 @@ class UnpackMesh:
 
         temperature_file.close()
 
+    def generate_node_map(self):
+        """Generate self.node_map, which maps a mesh node to its compact
+        surface vertex index (-1 for nodes that are not on the surface).
+        """
+        self.node_map = np.full(self.nodes.shape[0], -1, dtype=np.intp)
+        self.node_map[self.unique_surface_triangles] = np.arange(
+            self.unique_surface_triangles.shape[0])
+
+    def export_surface(self):
+        """Return the results of the surface pipeline as a dict of arrays.
+
+        The dict can be stored and handed to import_surface later to skip
+        the surface extraction.
+        """
+        if (self.unique_surface_triangles is None):
+            self.generate_unique_surface_triangles()
+
+        return {
+            'surface_faces': self.surface_faces,
+            'surface_triangles': self.surface_triangles,
+            'unique_surface_triangles': self.unique_surface_triangles,
+            'surface_indices': self.surface_indices,
+            'unique_surface_elements': self.unique_surface_elements,
+            'surface_element_indices': self.surface_element_indices,
+            'bounding_box': self.return_bounding_box()
+        }
+
+    def import_surface(self, surface):
+        """Set the results of the surface pipeline from a dict of arrays as
+        returned by export_surface.
+        """
+        self.surface_faces = surface['surface_faces']
+        self.surface_triangles = surface['surface_triangles']
+        self.unique_surface_triangles = surface['unique_surface_triangles']
+        self.surface_indices = surface['surface_indices']
+        self.unique_surface_elements = surface['unique_surface_elements']
+        self.surface_element_indices = surface['surface_element_indices']
+        self.bounding_box = surface['bounding_box']
+
+        self.generate_node_map()
+
+    def memory_footprint(self):
+        """Return the number of bytes held by the arrays of this mesh.
+
+        Memory-mapped arrays are backed by the page cache and can be paged
+        out at any time, so they do not count.
+        """
+        def array_bytes(value):
+            if isinstance(value, np.memmap):
+                return 0
+            elif isinstance(value, np.ndarray):
+                return value.nbytes
+            elif isinstance(value, (list, tuple)):
+                return sum(array_bytes(item) for item in value)
+            return 0
+
+        return sum(array_bytes(value) for value in vars(self).values())
+
+    def return_bounding_box(self):
+        """Get the axis aligned bounding box of the surface.
+
+        A (2, 3) array, the first row is the minimum and the second row the
+        maximum of the x, y and z coordinates.
+        """
+        if (self.bounding_box is None):
+            with metrics.timed('bounding_box'):
+                surface_nodes = self.return_unique_surface_nodes()
+                self.bounding_box = np.asarray([surface_nodes.min(axis=0),
+                                                surface_nodes.max(axis=0)])
+        return self.bounding_box
+
     def return_metadata(self):
         """Get the meta-data for the mesh.
 
         Size, etc.
         """
-        if (self.surface_triangles is None):
-            self.generate_triangles_from_quads()
-
-        x_nodes = []
-        y_nodes = []
-        z_nodes = []
-        unique_triangles = np.unique(self.surface_triangles)
-        for node in unique_triangles:
-            x_nodes.append(self.nodes[node][0])
-            y_nodes.append(self.nodes[node][1])
-            z_nodes.append(self.nodes[node][2])
-        x_nodes = np.asarray(x_nodes)
-        y_nodes = np.asarray(y_nodes)
-        z_nodes = np.asarray(z_nodes)
-        x_min = x_nodes.min()
-        x_max = x_nodes.max()
-        y_min = y_nodes.min()
-        y_max = y_nodes.max()
-        z_min = z_nodes.min()
-        z_max = z_nodes.max()
-        x_center = (x_max + x_min)/2
-        y_center = (y_max + y_min)/2
-        z_center = (z_max + z_min)/2
+        bounding_box = self.return_bounding_box()
+        x_center, y_center, z_center = (bounding_box[0] + bounding_box[1])/2
 
         # metafile = open('welding_sim.metafile', 'w')
         # metafile.write('{x_center_t},{y_center_t},{z_center_t}'.format(
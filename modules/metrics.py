@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Counters and latency histograms of the server, in the Prometheus text
+format (version 0.0.4), served on /metrics (see backend.WebServer.start).
+
+The stages of loading a mesh or a field are timed with timed(stage), the
+request handlers with instrument_handlers. Values that other parts already
+count, like the hits and misses of the caches, are read when the metrics
+are rendered, by collectors.
+
+Metrics are per process, stages that run in the worker processes of a
+process_pool.MeshProcessPool only show up in mesh_load.
+"""
+
+import os
+import time
+import threading
+import functools
+import contextlib
+
+# The upper bounds of the latency buckets in seconds, from reading a few
+# field values to extracting the surface of a large mesh.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5,
+                   5., 10., 30., 60.)
+
+
+def format_value(value):
+    """Return a sample value as Prometheus expects it.
+    """
+    if (value == float('inf')):
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(labels):
+    """Return {name="value",...} for a list of (name, value), or '' if
+    there are none.
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{name_t}="{value_t}"'.format(
+            name_t=name, value_t=str(value).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+class Counter:
+    """A value per combination of labels that only goes up.
+    """
+
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the value for the given labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        """Return the samples as a list of (name, labels, value).
+        """
+        with self._lock:
+            return [(self.name, list(zip(self.labels, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """The distribution of observed values (latencies) per combination of
+    labels, counted into buckets.
+    """
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # labels -> [bucket counts, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Count a value for the given labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.]
+            counts = self._values[key][0]
+            for index, bound in enumerate(self.buckets):
+                if (value <= bound):
+                    counts[index] += 1
+                    break
+            self._values[key][1] += value
+
+    def samples(self):
+        """Return the samples as a list of (name, labels, value), with
+        cumulative bucket counts.
+        """
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                labels = list(zip(self.labels, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((self.name + '_bucket',
+                                    labels + [('le', format_value(bound))],
+                                    cumulative))
+                samples.append((self.name + '_sum', labels, total))
+                samples.append((self.name + '_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """All metrics of the process and the collectors that are asked for
+    their values when the metrics are rendered.
+
+    A collector is a function that returns a list of (name, type,
+    documentation, samples) with samples like those of Counter.samples.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric and return it.
+        """
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def set_collector(self, name, collector):
+        """Add a collector, replacing the one with the same name.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self):
+        """Return all metrics in the Prometheus text format.
+        """
+        with self._lock:
+            families = [(metric.name, metric.metric_type,
+                         metric.documentation, metric.samples())
+                        for metric in self._metrics]
+            collectors = list(self._collectors.values())
+        for collector in collectors:
+            families.extend(collector())
+
+        lines = []
+        for name, metric_type, documentation, samples in families:
+            lines.append('# HELP {name_t} {documentation_t}'.format(
+                name_t=name, documentation_t=documentation))
+            lines.append('# TYPE {name_t} {type_t}'.format(
+                name_t=name, type_t=metric_type))
+            for sample_name, labels, value in samples:
+                lines.append('{name_t}{labels_t} {value_t}'.format(
+                    name_t=sample_name, labels_t=format_labels(labels),
+                    value_t=format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'fem_gl_stage_seconds',
+    'Time spent in a stage of loading a mesh or field or of encoding a '
+    'response.', ['stage']))
+
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'fem_gl_request_seconds', 'Time spent in a request handler.',
+    ['handler']))
+
+REQUESTS = REGISTRY.register(Counter(
+    'fem_gl_requests_total', 'Handled requests by response status.',
+    ['handler', 'status']))
+
+READ_BYTES = REGISTRY.register(Counter(
+    'fem_gl_read_bytes_total',
+    'Bytes read from mesh, field and surface cache files. Memory-mapped '
+    'files count with the bytes that are mapped.', ['source']))
+
+SENT_BYTES = REGISTRY.register(Counter(
+    'fem_gl_sent_bytes_total',
+    'Bytes of the responses of a handler before compression.', ['handler']))
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Time a block (or, as a decorator, a function) as a stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def instrument_handler(name, handler):
+    """Return handler wrapped to record its latency, the status of its
+    response and the size of its response.
+    """
+    @functools.wraps(handler)
+    def instrumented(*args, **kwargs):
+        start = time.perf_counter()
+        status = 500
+        try:
+            result = handler(*args, **kwargs)
+            status = 200
+        except Exception as error:
+            # cherrypy.HTTPError and HTTPRedirect carry their status.
+            status = getattr(error, 'status', 500)
+            raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                    handler=name)
+            REQUESTS.inc(handler=name, status=status)
+
+        if isinstance(result, (bytes, str)):
+            SENT_BYTES.inc(len(result), handler=name)
+        return result
+    return instrumented
+
+
+def instrument_handlers(cls):
+    """Class decorator that instruments all exposed methods of a CherryPy
+    handler class.
+    """
+    for name, attribute in list(vars(cls).items()):
+        if callable(attribute) and getattr(attribute, 'exposed', False):
+            setattr(cls, name, instrument_handler(name, attribute))
+    return cls
+
+
+def cache_collector(caches):
+    """Return a collector for caches, a dict of cache name -> function that
+    returns the stats of the cache (like cache.LRUCache.stats).
+    """
+    counters = [('hits', 'Lookups that found their value in a cache.'),
+                ('misses', 'Lookups that did not find their value in a '
+                 'cache.'),
+                ('evictions', 'Values dropped from a cache to make room.')]
+    gauges = [('entries', 'Values in a cache.'),
+              ('bytes', 'Bytes held by a cache.'),
+              ('max_bytes', 'The memory budget of a cache.')]
+
+    def collect():
+        stats = dict((name, stats_function())
+                     for name, stats_function in sorted(caches.items()))
+        families = []
+        for kinds, metric_type, suffix in [(counters, 'counter', '_total'),
+                                           (gauges, 'gauge', '')]:
+            for kind, documentation in kinds:
+                name = 'fem_gl_cache_' + kind + suffix
+                families.append((name, metric_type, documentation, [
+                    (name, [('cache', cache)], cache_stats[kind])
+                    for cache, cache_stats in stats.items()
+                    if kind in cache_stats]))
+        return families
+    return collect
+
+
+def process_collector():
+    """Return a collector for the disk reads and the resident memory of the
+    process, from /proc (only on Linux, nothing elsewhere).
+    """
+    def collect():
+        families = []
+        try:
+            with open('/proc/self/io') as io_file:
+                io = dict(line.split(': ') for line in
+                          io_file.read().splitlines())
+            families.append((
+                'fem_gl_process_disk_read_bytes_total', 'counter',
+                'Bytes the process read from disk (not from the page '
+                'cache).', [('fem_gl_process_disk_read_bytes_total', [],
+                             int(io['read_bytes']))]))
+        except (OSError, KeyError, ValueError):
+            pass
+        try:
+            with open('/proc/self/statm') as statm_file:
+                resident_pages = int(statm_file.read().split()[1])
+            families.append((
+                'fem_gl_process_resident_memory_bytes', 'gauge',
+                'Resident memory of the process.',
+                [('fem_gl_process_resident_memory_bytes', [],
+                  resident_pages * os.sysconf('SC_PAGE_SIZE'))]))
+        except (OSError, IndexError, ValueError):
+            pass
+        return families
+    return collect
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Load the timesteps around the one that is displayed into the field cache
+in the background.
+"""
+
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ViewerPrefetch:
+    """What one viewer looks at and the prefetches queued for it.
+    """
+
+    def __init__(self):
+        self.context = None
+        self.last_index = None
+        self.direction = 1
+        self.futures = []
+
+    def cancel_pending(self):
+        """Cancel all prefetches of the viewer that did not start yet.
+        """
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+
+
+class TimestepPrefetcher:
+    """Prefetch the neighbouring timesteps of the displayed timestep.
+
+    After every timestep request, up to window timesteps before and after it
+    are loaded into the field cache on a thread pool. The timesteps in the
+    direction the user is stepping in are loaded first. If the user jumps
+    to a timestep that is not a neighbour, or switches to another object or
+    field, everything that is still queued is cancelled.
+
+    This is tracked per viewer (e.g. the session id), so viewers do not
+    cancel each other's prefetches. The state of the max_viewers viewers
+    that asked most recently is kept, the queued prefetches of older ones
+    are cancelled.
+    """
+
+    def __init__(self, field_cache, window=2, workers=2, max_viewers=64):
+        self.field_cache = field_cache
+        self.window = window
+        self.max_viewers = max_viewers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='prefetch')
+
+        self._lock = threading.Lock()
+        self._viewers = collections.OrderedDict()  # viewer -> ViewerPrefetch
+
+    def schedule(self, viewer, mesh_key, mesh, object_name, field,
+                 timesteps, current_timestep):
+        """Prefetch around current_timestep for a viewer.
+
+        timesteps is the sorted list of the timesteps of the object.
+        """
+        if (self.window < 1):
+            return
+        try:
+            index = timesteps.index(current_timestep)
+        except ValueError:
+            return
+
+        context = (mesh_key, object_name, field)
+
+        with self._lock:
+            state = self._viewers.pop(viewer, None)
+            if state is None:
+                state = ViewerPrefetch()
+            self._viewers[viewer] = state
+            while len(self._viewers) > self.max_viewers:
+                _, dropped = self._viewers.popitem(last=False)
+                dropped.cancel_pending()
+
+            step = None
+            if (context == state.context and state.last_index is not None):
+                step = index - state.last_index
+
+            if step in (1, -1):
+                state.direction = step
+            elif step != 0:
+                # A jump (or a new object/field): drop the old window.
+                state.direction = 1
+                state.cancel_pending()
+
+            state.context = context
+            state.last_index = index
+
+            # Nearest first, the timestep in scrub direction before the one
+            # behind it.
+            neighbours = []
+            for distance in range(1, self.window + 1):
+                for offset in (distance * state.direction,
+                               -distance * state.direction):
+                    if (0 <= index + offset < len(timesteps)):
+                        neighbours.append(timesteps[index + offset])
+
+            state.futures = [future for future in state.futures
+                             if not future.done()]
+            for timestep in neighbours:
+                state.futures.append(self.executor.submit(
+                    self.prefetch, state, mesh_key, mesh,
+                    object_name, field, timestep))
+
+    def prefetch(self, state, mesh_key, mesh, object_name, field, timestep):
+        """Load a timestep into the field cache, unless the viewer moved on
+        to another object or field in the meantime.
+        """
+        with self._lock:
+            if ((mesh_key, object_name, field) != state.context):
+                return
+        try:
+            if not self.field_cache.contains(
+                    mesh_key, object_name, field, timestep):
+                self.field_cache.get(
+                    mesh_key, mesh, object_name, field, timestep)
+        except (OSError, ValueError):
+            # Missing or broken files are reported when the user actually
+            # asks for them.
+            pass
+
+    def cancel(self):
+        """Cancel all prefetches that did not start yet.
+        """
+        with self._lock:
+            for state in self._viewers.values():
+                state.context = None
+                state.cancel_pending()
+            self._viewers.clear()
+
+    def shutdown(self):
+        """Cancel pending prefetches and stop the thread pool.
+        """
+        self.cancel()
+        self.executor.shutdown(wait=False)
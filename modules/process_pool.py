@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Run the surface extraction of UnpackMesh in worker processes.
+
+Surface extraction is CPU-bound and holds the GIL, so in a request thread
+it stalls every other request of the server. In a worker process it does
+not. The resulting arrays are written to multiprocessing.shared_memory
+blocks, the server maps these blocks instead of receiving pickled copies.
+"""
+
+import weakref
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+
+# Blocks that could not be closed yet because arrays still use them, see
+# SharedSurface.release.
+_pending_blocks = []
+_pending_lock = threading.Lock()
+
+
+def extract_surface(node_path, element_path):
+    """Extract the surface of a mesh and put the arrays of
+    UnpackMesh.export_surface into shared memory.
+
+    Runs in a worker process. Returns a dict that maps the name of every
+    array to (name of the shared memory block, shape, dtype string).
+    """
+    mesh = fem_mesh.UnpackMesh(node_path=node_path, element_path=element_path)
+
+    descriptions = {}
+    for name, array in mesh.export_surface().items():
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(
+            create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = \
+            array
+        descriptions[name] = (block.name, array.shape, array.dtype.str)
+        block.close()
+    return descriptions
+
+
+class SharedSurface:
+    """The shared memory blocks behind the surface arrays of one mesh.
+
+    The blocks are unlinked as soon as they are mapped, so they are freed
+    when they are closed. The mesh keeps a reference to this object for as
+    long as it uses the arrays, and calls release once it is done with
+    them (see mesh_cache.release_mesh).
+    """
+
+    def __init__(self, descriptions):
+        self.blocks = []  # (block, weak reference to the array on it)
+        self.arrays = {}
+        for name, (block_name, shape, dtype) in descriptions.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            block.unlink()
+            self.arrays[name] = np.ndarray(
+                shape, dtype=np.dtype(dtype), buffer=block.buf)
+            self.blocks.append((block, weakref.ref(self.arrays[name])))
+
+    def release(self):
+        """Drop the arrays and close the blocks.
+
+        Closing a block unmaps its memory, even if an array still uses it,
+        so a block is only closed once its array (and every view of it) is
+        gone. The other blocks are kept and closed by a later release.
+        """
+        self.arrays = {}
+        blocks, self.blocks = self.blocks, []
+        with _pending_lock:
+            _pending_blocks.extend(blocks)
+            blocks = list(_pending_blocks)
+            del _pending_blocks[:]
+            for block, array in blocks:
+                if array() is None:
+                    block.close()
+                else:
+                    _pending_blocks.append((block, array))
+
+    def __del__(self):
+        # Otherwise SharedMemory.__del__ closes the blocks, whether the
+        # arrays on them are gone or not.
+        self.release()
+
+
+class MeshProcessPool:
+    """A pool of worker processes for surface extraction.
+    """
+
+    def __init__(self, workers):
+        # Worker processes are spawned, forking the threaded web server is
+        # not safe.
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'))
+
+    def extract_surface(self, node_path, element_path):
+        """Extract the surface of a mesh in a worker process and return it
+        as a SharedSurface.
+
+        Blocks the calling thread, but not the other threads of the server.
+        """
+        descriptions = self.executor.submit(
+            extract_surface, node_path, element_path).result()
+        return SharedSurface(descriptions)
+
+    def shutdown(self):
+        """Stop the worker processes.
+        """
+        self.executor.shutdown(wait=True, cancel_futures=True)
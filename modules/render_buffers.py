@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Generate GPU-ready (non-indexed) vertex buffers on the server.
+
+The viewer draws the surface without an index buffer, every triangle has
+its own three vertices. Expanding the indexed surface, averaging field
+values over triangles and generating barycentric coordinates for the
+wireframe overlay is done here with numpy instead of in the browser.
+"""
+
+import threading
+import collections
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+
+
+def expand_positions(surface_nodes, surface_indices):
+    """Return the float32 positions of every triangle corner.
+
+    A (3*triangles, 3) array, the three corners of a triangle follow each
+    other.
+    """
+    return np.take(np.asarray(surface_nodes, dtype=np.float32),
+                   np.ravel(surface_indices), axis=0)
+
+
+def barycentric_coordinates(triangle_count):
+    """Return the barycentric coordinates for the corners of all triangles.
+
+    (1, 0, 0), (0, 1, 0), (0, 0, 1) for every triangle, used by the shader
+    to draw the wireframe.
+    """
+    return np.tile(np.eye(3, dtype=np.float32), (triangle_count, 1))
+
+
+def expand_field(values, surface_indices, flat_shading=False):
+    """Return the field value for every triangle corner.
+
+    values holds one value per surface vertex. With flat_shading every
+    corner gets the average of the three corner values of its triangle.
+    """
+    corner_values = np.take(np.asarray(values, dtype=np.float32),
+                            surface_indices).reshape(-1, 3)
+    if flat_shading:
+        corner_values = np.repeat(
+            corner_values.mean(axis=1, dtype=np.float32), 3)
+    return corner_values.ravel()
+
+
+def expand_triangle_field(triangle_values):
+    """Return the field value for every triangle corner from one value per
+    triangle (flat shading).
+    """
+    return np.repeat(np.asarray(triangle_values, dtype=np.float32), 3)
+
+
+def field_identity(object_name, field, timestep, location='node'):
+    """Return a tuple that changes when the values of a nodal (location
+    'node') or element (location 'element') field at a timestep change.
+    """
+    if (location == 'element'):
+        return fem_mesh.element_field_identity(object_name, field, timestep)
+    return fem_mesh.field_identity(object_name, field, timestep)
+
+
+def normalise_field(values, value_range):
+    """Map the values linearly from value_range = (min, max) onto [0, 1].
+
+    For a range of zero width (a constant field) all values become 0.
+    """
+    minimum, maximum = value_range
+    if (maximum == minimum):
+        return np.zeros(np.shape(values), dtype=np.float32)
+    return ((values - np.float32(minimum)) /
+            np.float32(maximum - minimum)).astype(np.float32)
+
+
+class RenderBuffers:
+    """Cache the render buffers of one surface (the surface of a mesh or a
+    level of detail of it, see modules/surface_lod.py).
+
+    The geometry buffers are generated once. Field buffers are kept for the
+    last few requested timesteps, so stepping back and forth does not
+    expand the same field twice. Field buffers are keyed by the identity of
+    the field file (see field_identity), so a rewritten file is expanded
+    again.
+
+    The surface is passed to every call and not kept, so a cached
+    RenderBuffers does not keep a mesh alive. resized() is called whenever
+    buffers have been added, e.g. to measure the RenderBuffers again in the
+    cache that holds it.
+    """
+
+    def __init__(self, field_cache_entries=8, resized=None):
+        self.field_cache_entries = field_cache_entries
+        self.resized = resized
+        self.positions = None
+        self.barycentrics = None
+        self.field_buffers = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def geometry(self, surface):
+        """Return the expanded positions and the barycentric coordinates of
+        a surface (anything with return_unique_surface_nodes and
+        return_surface_indices, like an UnpackMesh).
+        """
+        with self._lock:
+            if (self.positions is None):
+                surface_indices = surface.return_surface_indices()
+                self.positions = expand_positions(
+                    surface.return_unique_surface_nodes(), surface_indices)
+                self.barycentrics = barycentric_coordinates(
+                    surface_indices.shape[0])
+                added = True
+            else:
+                added = False
+            positions, barycentrics = self.positions, self.barycentrics
+
+        if added and self.resized is not None:
+            self.resized()
+        return positions, barycentrics
+
+    def field(self, surface, object_directory, field, timestep, values,
+              flat_shading=False, value_range=None, location='node'):
+        """Return the expanded field values for a timestep.
+
+        values() returns the values of the field on the surface vertices,
+        or for location 'element' (an element field, which is always flat
+        shaded) on the surface triangles. It is only called if the buffer
+        is not cached. If value_range is given the values are normalised
+        onto [0, 1].
+        """
+        if value_range is not None:
+            value_range = tuple(value_range)
+        key = (object_directory, field, timestep,
+               field_identity(object_directory, field, timestep, location),
+               flat_shading, value_range, location)
+
+        with self._lock:
+            if key in self.field_buffers:
+                self.field_buffers.move_to_end(key)
+                return self.field_buffers[key]
+
+        if (location == 'element'):
+            expanded = expand_triangle_field(values())
+        else:
+            expanded = expand_field(
+                values(), surface.return_surface_indices(),
+                flat_shading=flat_shading)
+        if value_range is not None:
+            expanded = normalise_field(expanded, value_range)
+
+        with self._lock:
+            self.field_buffers[key] = expanded
+            while len(self.field_buffers) > self.field_cache_entries:
+                self.field_buffers.popitem(last=False)
+
+        if self.resized is not None:
+            self.resized()
+        return expanded
+
+    def nbytes(self):
+        """Return the memory used by the buffers.
+        """
+        with self._lock:
+            return sum(array.nbytes for array in
+                       [self.positions, self.barycentrics] +
+                       list(self.field_buffers.values())
+                       if array is not None)
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Keep the extracted surfaces of meshes on disk, so that a restart of the
+server does not mean extracting them again.
+
+Every mesh gets a directory with one .npy file per array from
+UnpackMesh.export_surface and a meta.json that records the size and mtime
+of the node and element file the surface was extracted from. Cached arrays
+are memory-mapped when they are loaded.
+"""
+
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+import modules.metrics as metrics
+from modules.mesh_cache import file_identity
+
+CACHE_VERSION = 3
+
+SIDECAR_DIRECTORY = '.fem-gl-cache'
+
+SURFACE_ARRAYS = [
+    'surface_faces',
+    'surface_triangles',
+    'unique_surface_triangles',
+    'surface_indices',
+    'unique_surface_elements',
+    'surface_element_indices',
+    'bounding_box'
+]
+
+
+class SurfaceCache:
+    """Store and load the surface of a mesh.
+
+    If cache_directory is None the cache lives in a directory called
+    .fem-gl-cache next to the element file of every mesh.
+    """
+
+    def __init__(self, cache_directory=None):
+        self.cache_directory = cache_directory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def entry_directory(self, node_path, element_path):
+        """Return the directory that holds the cached surface of a mesh.
+        """
+        node_path = os.path.abspath(node_path)
+        element_paths = [os.path.abspath(path)
+                         for path in fem_mesh.element_paths(element_path)]
+
+        entry_name = hashlib.sha1(
+            '\n'.join([node_path] + element_paths).encode('utf-8')
+        ).hexdigest()
+
+        if self.cache_directory is None:
+            base_directory = os.path.join(
+                os.path.dirname(element_paths[0]), SIDECAR_DIRECTORY)
+        else:
+            base_directory = self.cache_directory
+        return os.path.join(base_directory, entry_name)
+
+    def identity(self, node_path, element_path):
+        """Return what a cached surface is validated against.
+        """
+        _, node_size, node_mtime = file_identity(node_path)
+        return {
+            'version': CACHE_VERSION,
+            'node_file': [node_size, node_mtime],
+            'element_files': [list(file_identity(path)[1:]) for path in
+                              fem_mesh.element_paths(element_path)]
+        }
+
+    def load(self, node_path, element_path):
+        """Return the cached surface arrays of a mesh as a dict, or None if
+        there is no valid cached surface.
+        """
+        with metrics.timed('surface_cache_load'):
+            surface = self.read_entry(node_path, element_path)
+
+        with self._lock:
+            if surface is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if surface is not None:
+            metrics.READ_BYTES.inc(
+                sum(array.nbytes for array in surface.values()),
+                source='surface_cache')
+        return surface
+
+    def read_entry(self, node_path, element_path):
+        """Return the arrays of the cache entry of a mesh, or None if it is
+        missing or out of date.
+        """
+        entry_directory = self.entry_directory(node_path, element_path)
+        try:
+            with open(os.path.join(entry_directory, 'meta.json')) as meta_file:
+                meta = json.load(meta_file)
+            if meta != self.identity(node_path, element_path):
+                return None
+
+            return {
+                name: np.load(os.path.join(entry_directory, name + '.npy'),
+                              mmap_mode='r')
+                for name in SURFACE_ARRAYS
+            }
+        except (OSError, ValueError):
+            return None
+
+    def save(self, node_path, element_path, surface):
+        """Write the surface arrays of a mesh.
+
+        Every file is written under a temporary name and moved in place,
+        meta.json comes last. Returns False if the cache is not writable.
+        """
+        with metrics.timed('surface_cache_save'):
+            return self.write_entry(node_path, element_path, surface)
+
+    def write_entry(self, node_path, element_path, surface):
+        """Write the cache entry of a mesh, see save.
+        """
+        entry_directory = self.entry_directory(node_path, element_path)
+        identity = self.identity(node_path, element_path)
+        try:
+            os.makedirs(entry_directory, exist_ok=True)
+
+            # Invalidate the old entry first.
+            meta_path = os.path.join(entry_directory, 'meta.json')
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+
+            for name in SURFACE_ARRAYS:
+                array_path = os.path.join(entry_directory, name + '.npy')
+                with open(array_path + '.tmp', 'wb') as array_file:
+                    np.save(array_file, np.ascontiguousarray(surface[name]))
+                os.replace(array_path + '.tmp', array_path)
+
+            with open(meta_path + '.tmp', 'w') as meta_file:
+                json.dump(identity, meta_file)
+            os.replace(meta_path + '.tmp', meta_path)
+        except OSError as error:
+            print('Could not write surface cache to {path_t}: {error_t}'.format(
+                path_t=entry_directory, error_t=error))
+            return False
+        return True
+
+    def stats(self):
+        """Return the number of meshes whose surface was found in the cache
+        and the number of meshes whose surface was not.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
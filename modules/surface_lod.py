@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Coarser versions (levels of detail) of the surface of a mesh.
+
+A level is made by vertex clustering: the bounding box is divided into a
+grid of cubic cells, all surface vertices in a cell that face in the same
+direction become one vertex at their mean position, and triangles that
+collapse are dropped. The field value of a clustered vertex is the mean of
+the values of its vertices, so every level can show every field.
+
+The levels double the grid resolution from BASE_RESOLUTION cells along the
+longest side of the bounding box until a level has more than FULL_FRACTION
+of the triangles of the surface, the resolution reaches the number of
+surface vertices (no more vertices can be merged) or there are MAX_LEVELS
+levels. The last level is the surface itself. It is not kept in the
+SurfaceLOD, its arrays belong to the mesh.
+"""
+
+import numpy as np
+
+from modules.cache import LRUCache
+
+BASE_RESOLUTION = 16
+FULL_FRACTION = 0.5
+
+# At most BASE_RESOLUTION * 2**15 cells along a side, so the cell keys of
+# cluster_surface fit into int64.
+MAX_LEVELS = 16
+
+
+def vertex_directions(surface_nodes, surface_indices):
+    """Return the direction class (0 to 5: -x, +x, -y, +y, -z, +z) of the
+    normal of every surface vertex.
+
+    The normal of a vertex is the sum of the (area weighted) normals of its
+    triangles. Clustering vertices of different classes separately keeps
+    the two sides of thin walls apart.
+    """
+    corners = surface_nodes[surface_indices]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0],
+                            corners[:, 2] - corners[:, 0])
+
+    vertex_normals = np.zeros((surface_nodes.shape[0], 3))
+    for corner in range(3):
+        for axis in range(3):
+            vertex_normals[:, axis] += np.bincount(
+                surface_indices[:, corner], weights=face_normals[:, axis],
+                minlength=surface_nodes.shape[0])
+
+    axes = np.abs(vertex_normals).argmax(axis=1)
+    positive = vertex_normals[np.arange(axes.shape[0]), axes] > 0
+    return 2 * axes + positive
+
+
+class SurfaceLevel:
+    """One level of detail of a surface.
+
+    vertex_clusters maps every vertex of the full surface to its vertex in
+    this level. A level has the return_unique_surface_nodes and
+    return_surface_indices of a mesh, so it can be handed to
+    render_buffers.RenderBuffers.
+    """
+
+    def __init__(self, surface_nodes, surface_indices, vertex_clusters):
+        self.surface_nodes = surface_nodes
+        self.surface_indices = surface_indices
+        self.vertex_clusters = vertex_clusters
+        self.cluster_sizes = np.bincount(
+            vertex_clusters, minlength=surface_nodes.shape[0])
+
+    def return_unique_surface_nodes(self):
+        """Return the vertex positions of the level.
+        """
+        return self.surface_nodes
+
+    def return_surface_indices(self):
+        """Return the triangles of the level.
+        """
+        return self.surface_indices
+
+    def field_values(self, values):
+        """Return the values for the vertices of this level from the values
+        on the vertices of the full surface.
+        """
+        sums = np.bincount(self.vertex_clusters, weights=values,
+                           minlength=self.surface_nodes.shape[0])
+        return sums / np.maximum(self.cluster_sizes, 1)
+
+    def triangle_values(self, values, surface_indices):
+        """Return the values for the triangles of this level from the values
+        on the triangles (surface_indices) of the full surface.
+
+        The values are averaged onto the vertices of the full surface, onto
+        the vertices of this level and then over the corners of every
+        triangle.
+        """
+        vertex_count = self.vertex_clusters.shape[0]
+        corners = np.ravel(surface_indices)
+        vertex_values = np.bincount(
+            corners, weights=np.repeat(values, 3),
+            minlength=vertex_count) / np.maximum(
+                np.bincount(corners, minlength=vertex_count), 1)
+        return self.field_values(vertex_values)[
+            self.surface_indices].mean(axis=1)
+
+    def nbytes(self):
+        """Return the memory used by the arrays of the level.
+        """
+        return (self.surface_nodes.nbytes + self.surface_indices.nbytes +
+                self.vertex_clusters.nbytes + self.cluster_sizes.nbytes)
+
+
+def cluster_surface(surface_nodes, surface_indices, directions,
+                    bounding_box, resolution):
+    """Return the SurfaceLevel of a surface for a grid with resolution
+    cells along the longest side of the bounding box.
+    """
+    origin = bounding_box[0]
+    cell_size = float(np.max(bounding_box[1] - bounding_box[0])) / resolution
+    if (cell_size <= 0):
+        cell_size = 1.
+
+    cells = np.floor((surface_nodes - origin) / cell_size).astype(np.int64)
+    cells = np.clip(cells, 0, resolution)
+    cell_keys = ((cells[:, 0] * (resolution + 1) + cells[:, 1]) *
+                 (resolution + 1) + cells[:, 2]) * 6 + directions
+    _, vertex_clusters = np.unique(cell_keys, return_inverse=True)
+    vertex_clusters = vertex_clusters.ravel()
+
+    cluster_count = int(vertex_clusters.max()) + 1
+    cluster_sizes = np.bincount(vertex_clusters, minlength=cluster_count)
+    cluster_nodes = np.stack(
+        [np.bincount(vertex_clusters, weights=surface_nodes[:, axis],
+                     minlength=cluster_count)
+         for axis in range(3)], axis=1) / cluster_sizes[:, np.newaxis]
+
+    triangles = vertex_clusters[surface_indices]
+    triangles = triangles[(triangles[:, 0] != triangles[:, 1]) &
+                          (triangles[:, 1] != triangles[:, 2]) &
+                          (triangles[:, 2] != triangles[:, 0])]
+
+    # Several triangles can collapse onto the same three vertices.
+    _, first = np.unique(np.sort(triangles, axis=1), axis=0,
+                         return_index=True)
+    triangles = triangles[np.sort(first)]
+
+    return SurfaceLevel(cluster_nodes, triangles.astype(surface_indices.dtype),
+                        vertex_clusters)
+
+
+class SurfaceLOD:
+    """The levels of detail of the surface of a mesh, coarsest first.
+
+    levels holds the coarser levels only. The last level, number
+    len(levels), is the surface of the mesh itself, of which only the
+    vertex and triangle count are kept, so a cached SurfaceLOD does not
+    keep the surface of an evicted mesh alive.
+    """
+
+    def __init__(self, mesh):
+        surface_nodes = np.asarray(mesh.return_unique_surface_nodes(),
+                                   dtype=np.float64)
+        surface_indices = np.asarray(mesh.return_surface_indices())
+        bounding_box = np.asarray(mesh.return_bounding_box(),
+                                  dtype=np.float64)
+        full_triangles = surface_indices.shape[0]
+        self.full_vertices = surface_nodes.shape[0]
+        self.full_triangles = full_triangles
+
+        self.levels = []
+        if (full_triangles > 0):
+            directions = vertex_directions(surface_nodes, surface_indices)
+            resolution = BASE_RESOLUTION
+            while (len(self.levels) < MAX_LEVELS and
+                   resolution < surface_nodes.shape[0]):
+                level = cluster_surface(surface_nodes, surface_indices,
+                                        directions, bounding_box, resolution)
+                if (level.surface_indices.shape[0] >
+                        FULL_FRACTION * full_triangles):
+                    break
+                self.levels.append(level)
+                resolution *= 2
+
+    def level_count(self):
+        """Return the number of levels, including the full surface.
+        """
+        return len(self.levels) + 1
+
+    def describe(self):
+        """Return the vertex and triangle count of every level.
+        """
+        counts = [(level.surface_nodes.shape[0],
+                   level.surface_indices.shape[0]) for level in self.levels]
+        counts.append((self.full_vertices, self.full_triangles))
+        return [{'level': index,
+                 'vertices': int(vertices),
+                 'triangles': int(triangles)}
+                for index, (vertices, triangles) in enumerate(counts)]
+
+    def nbytes(self):
+        """Return the memory used by the levels.
+        """
+        return sum(level.nbytes() for level in self.levels)
+
+
+class SurfaceLODCache:
+    """Hold the SurfaceLOD of meshes, keyed by the key of the mesh in the
+    MeshCache. The least recently used are dropped once they exceed
+    max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_bytes, size_of=lambda lod: lod.nbytes())
+
+    def get(self, mesh_key, mesh):
+        """Return the SurfaceLOD of a mesh, building it on the first call.
+        """
+        return self.cache.get_or_load(mesh_key, lambda: SurfaceLOD(mesh))
+
+    def stats(self):
+        """Return the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.stats()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Generate synthetic objects of any size for benchmarks and demos.
+
+An object is a plate of PLATE_SIZE meshed with C3D8 elements, NX:NY:NZ =
+4:2:1, in the layout fem-gl reads:
+
+    <object>/fo/<timestep>/mesh/case.nodes.bin     (first timestep only)
+    <object>/fo/<timestep>/mesh/case.dc3d8.bin     (first timestep only)
+    <object>/fo/<timestep>/nf/temperatures.bin
+
+The temperature field is a heat source that moves along the top of the
+plate over the timesteps. The nodes can be moved at random by a fraction of
+the element size (a perturbed instead of a structured mesh) and the
+elements can be shuffled, so that the element file has no locality.
+
+Nodes, elements and fields are written layer by layer along z, so meshes
+with millions of elements are generated with little memory.
+"""
+
+import os
+
+import numpy as np
+
+import modules.mesh_parser as fem_mesh
+
+PLATE_SIZE = np.array([0.4, 0.2, 0.1])
+FIELD = 'temperatures'
+NODE_FILE = 'case.nodes.bin'
+ELEMENT_FILE = 'case.dc3d8.bin'
+
+
+def plate_shape(element_count):
+    """Return the number of elements along x, y and z of a plate with
+    about element_count elements.
+    """
+    n = max(1, int(round((element_count / 8.) ** (1. / 3))))
+    return np.array([4 * n, 2 * n, n])
+
+
+def timestep_names(timesteps):
+    """Return the names of the timestep directories.
+    """
+    return ['{:.1f}'.format(timestep + 1.) for timestep in range(timesteps)]
+
+
+def layer_nodes(shape, layer, perturbation, random):
+    """Return the (nx + 1) * (ny + 1) nodes of a layer of the plate.
+    """
+    cell_size = PLATE_SIZE / shape
+    y, x = np.mgrid[0:shape[1] + 1, 0:shape[0] + 1]
+    nodes = np.stack([x.ravel() * cell_size[0],
+                      y.ravel() * cell_size[1],
+                      np.full(x.size, layer * cell_size[2])], axis=1)
+    if (perturbation > 0):
+        nodes += (random.uniform(-0.5, 0.5, nodes.shape) * perturbation *
+                  cell_size)
+    return nodes
+
+
+def layer_elements(shape, layer):
+    """Return the nx * ny elements between node layer layer and the next.
+    """
+    row = shape[0] + 1
+    layer_size = row * (shape[1] + 1)
+    y, x = np.mgrid[0:shape[1], 0:shape[0]]
+    first = (layer * layer_size + y * row + x).ravel()
+    bottom = [first, first + 1, first + row + 1, first + row]
+    top = [corner + layer_size for corner in bottom]
+    return np.stack(bottom + top, axis=1)
+
+
+def temperatures(nodes, time_fraction):
+    """Return the temperatures at nodes for a heat source that has moved
+    time_fraction of the way along the top of the plate.
+    """
+    source = np.array([0.1 + 0.8 * time_fraction, 0.5, 1.]) * PLATE_SIZE
+    distance = np.sum(((nodes - source) / (0.15 * PLATE_SIZE[1])) ** 2,
+                      axis=1)
+    return 20. + 1500. * np.exp(-distance)
+
+
+def write_object(object_directory, element_count, timesteps=3,
+                 perturbation=0., shuffle=False, seed=0):
+    """Write a synthetic object with about element_count elements.
+
+    Returns a dict with the node and element path, the timestep names, the
+    number of nodes and elements and the parameters the object was
+    generated with.
+    """
+    shape = plate_shape(element_count)
+    names = timestep_names(timesteps)
+    random = np.random.default_rng(seed)
+
+    mesh_directory = os.path.join(object_directory, 'fo', names[0], 'mesh')
+    os.makedirs(mesh_directory, exist_ok=True)
+    node_path = os.path.join(mesh_directory, NODE_FILE)
+    element_path = os.path.join(mesh_directory, ELEMENT_FILE)
+
+    with open(node_path, 'wb') as node_file:
+        for layer in range(shape[2] + 1):
+            node_file.write(layer_nodes(
+                shape, layer, perturbation, random).astype(
+                    fem_mesh.NODE_DTYPE).tobytes())
+
+    element_total = int(np.prod(shape))
+    if shuffle:
+        elements = np.concatenate(
+            [layer_elements(shape, layer) for layer in range(shape[2])])
+        elements[random.permutation(element_total)].astype(
+            fem_mesh.ELEMENT_DTYPE).tofile(element_path)
+        del elements
+    else:
+        with open(element_path, 'wb') as element_file:
+            for layer in range(shape[2]):
+                element_file.write(layer_elements(shape, layer).astype(
+                    fem_mesh.ELEMENT_DTYPE).tobytes())
+
+    nodes = fem_mesh.read_binary_array(node_path, fem_mesh.NODE_DTYPE, 3)
+    layer_size = int((shape[0] + 1) * (shape[1] + 1))
+    for index, name in enumerate(names):
+        field_directory = os.path.join(object_directory, 'fo', name, 'nf')
+        os.makedirs(field_directory, exist_ok=True)
+        time_fraction = index / max(1, timesteps - 1)
+        with open(os.path.join(field_directory, FIELD + '.bin'),
+                  'wb') as field_file:
+            for start in range(0, nodes.shape[0], 64 * layer_size):
+                field_file.write(temperatures(
+                    np.asarray(nodes[start:start + 64 * layer_size]),
+                    time_fraction).astype(fem_mesh.FIELD_DTYPE).tobytes())
+    del nodes
+
+    return {'node_path': node_path,
+            'element_path': element_path,
+            'timesteps': names,
+            'nodes': int(np.prod(shape + 1)),
+            'elements': element_total,
+            'generator': {'element_count': element_count,
+                          'timesteps': timesteps,
+                          'perturbation': perturbation,
+                          'shuffle': shuffle,
+                          'seed': seed}}
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Time-series stores: all timesteps of a nodal field in one file.
+
+A field is normally written as one small file per timestep
+(fo/<timestep>/nf/<field>.bin). Anything that runs over time then opens
+thousands of files. pack_field copies these files into one store at
+<object>/ts/<field>.fgts, which is memory-mapped as a whole; a timestep is
+a slice of it.
+
+File layout (little-endian):
+
+    header      '<4sIIIQQ': magic b'FGTS', format version, layout,
+                number of timesteps, number of nodes, offset of the values
+    timesteps   one TIMESTEP_DTYPE record per timestep, sorted by value
+    values      float64, starting at a multiple of DATA_ALIGNMENT
+
+With LAYOUT_TIME the values are stored as (timesteps, nodes), a timestep is
+contiguous. With LAYOUT_NODE they are stored as (nodes, timesteps), the
+history of a node is contiguous.
+
+A timestep record holds the size and mtime of the file it was copied from.
+As long as that file exists it has to be unchanged for the store to be
+used for the timestep. If it has been deleted the store is used.
+"""
+
+import os
+import struct
+import threading
+
+import numpy as np
+
+FORMAT_VERSION = 1
+MAGIC = b'FGTS'
+HEADER = struct.Struct('<4sIIIQQ')
+TIMESTEP_DTYPE = np.dtype([('value', '<f8'),
+                           ('size', '<i8'),
+                           ('mtime_ns', '<i8'),
+                           ('name', 'S32')])
+VALUE_DTYPE = np.dtype('<f8')
+DATA_ALIGNMENT = 4096
+
+LAYOUT_TIME = 0
+LAYOUT_NODE = 1
+LAYOUTS = {'time': LAYOUT_TIME, 'node': LAYOUT_NODE}
+
+# Number of timesteps that are collected before they are written to a store
+# in LAYOUT_NODE.
+WRITE_BLOCK = 64
+
+
+def store_path(object_directory, field):
+    """Return the path of the time-series store of a field.
+    """
+    return os.path.join(object_directory, 'ts', field + '.fgts')
+
+
+def source_path(object_directory, field, timestep):
+    """Return the path of the file of a field at a timestep.
+    """
+    return os.path.join(object_directory, 'fo', timestep, 'nf',
+                        field + '.bin')
+
+
+class TimeSeriesStore:
+    """A memory-mapped time-series store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        stat = os.stat(path)
+        self.identity = (os.path.abspath(path), stat.st_size,
+                         stat.st_mtime_ns)
+
+        with open(path, 'rb') as store_file:
+            header = store_file.read(HEADER.size)
+            if (len(header) != HEADER.size):
+                raise ValueError('{} is too short.'.format(path))
+            (magic, version, self.layout, timestep_count, self.node_count,
+             data_offset) = HEADER.unpack(header)
+            if (magic != MAGIC or version != FORMAT_VERSION):
+                raise ValueError(
+                    '{} is not a version {} time-series store.'.format(
+                        path, FORMAT_VERSION))
+            self.timestep_table = np.frombuffer(
+                store_file.read(TIMESTEP_DTYPE.itemsize * timestep_count),
+                dtype=TIMESTEP_DTYPE)
+
+        if (self.layout == LAYOUT_TIME):
+            shape = (timestep_count, self.node_count)
+        elif (self.layout == LAYOUT_NODE):
+            shape = (self.node_count, timestep_count)
+        else:
+            raise ValueError('{} has an unknown layout {}.'.format(
+                path, self.layout))
+
+        if (stat.st_size < data_offset + VALUE_DTYPE.itemsize *
+                timestep_count * self.node_count):
+            raise ValueError('{} is truncated.'.format(path))
+
+        if (timestep_count * self.node_count == 0):
+            self.data = np.empty(shape, dtype=VALUE_DTYPE)
+        else:
+            self.data = np.memmap(path, dtype=VALUE_DTYPE, mode='r',
+                                  offset=data_offset, shape=shape)
+
+        self.timestep_names = [name.decode('ascii')
+                               for name in self.timestep_table['name']]
+        self.timestep_values = self.timestep_table['value']
+        self.timestep_index = dict(
+            (name, index) for index, name in enumerate(self.timestep_names))
+
+    def index(self, timestep, object_directory=None, field=None):
+        """Return the index of a timestep in the store, or None if the store
+        does not hold it.
+
+        If object_directory and field are given, None is also returned if
+        the file the timestep was copied from has changed since.
+        """
+        index = self.timestep_index.get(timestep)
+        if (index is None or object_directory is None):
+            return index
+
+        try:
+            stat = os.stat(source_path(object_directory, field, timestep))
+        except FileNotFoundError:
+            return index
+        record = self.timestep_table[index]
+        if (stat.st_size != record['size'] or
+                stat.st_mtime_ns != record['mtime_ns']):
+            return None
+        return index
+
+    def values(self, index):
+        """Return the values at the timestep with the given index as an
+        (nodes, 1) array, like a timestep file.
+        """
+        if (self.layout == LAYOUT_TIME):
+            return self.data[index].reshape(-1, 1)
+        return self.data[:, index:index + 1]
+
+    def history(self, nodes):
+        """Return the values of the given nodes over all timesteps as a
+        (timesteps, len(nodes)) array.
+        """
+        if (self.layout == LAYOUT_TIME):
+            return self.data[:, nodes]
+        return self.data[nodes].T
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(object_directory, field):
+    """Return the TimeSeriesStore of a field, or None if there is none.
+
+    Stores are opened once and kept open until their file changes.
+    """
+    path = store_path(object_directory, field)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    identity = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    with _stores_lock:
+        store = _stores.get(identity[0])
+        if (store is None or store.identity != identity):
+            store = TimeSeriesStore(path)
+            _stores[identity[0]] = store
+        return store
+
+
+def list_stores(object_directory):
+    """Return the names of the fields that have a time-series store.
+    """
+    try:
+        file_names = os.listdir(os.path.join(object_directory, 'ts'))
+    except OSError:
+        return []
+    return sorted(file_name[:-len('.fgts')] for file_name in file_names
+                  if file_name.endswith('.fgts'))
+
+
+def pack_field(object_directory, field, layout='time'):
+    """Copy all timestep files of a nodal field into its time-series store.
+
+    layout is 'time' (a timestep is contiguous) or 'node' (the history of a
+    node is contiguous). Timesteps of an existing store whose files have
+    been deleted are taken over from it. Returns the path of the store. The
+    store is written to a temporary file first and replaces an existing
+    store only when it is complete.
+    """
+    existing_store = open_store(object_directory, field)
+
+    # Timestep name -> (value, (size, mtime), function that reads it)
+    sources = {}
+    if existing_store is not None:
+        for index, record in enumerate(existing_store.timestep_table):
+            name = existing_store.timestep_names[index]
+            sources[name] = (
+                record['value'], (record['size'], record['mtime_ns']),
+                lambda index=index: np.array(
+                    existing_store.values(index)).ravel())
+
+    fo_directory = os.path.join(object_directory, 'fo')
+    for name in os.listdir(fo_directory):
+        try:
+            value = float(name)
+        except ValueError:
+            continue
+        path = source_path(object_directory, field, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        sources[name] = (value, (stat.st_size, stat.st_mtime_ns),
+                         lambda path=path: np.fromfile(
+                             path, dtype=VALUE_DTYPE))
+
+    if not sources:
+        raise FileNotFoundError('No timestep of {} in {}'.format(
+            field, object_directory))
+
+    timesteps = sorted((value, name) for name, (value, _, _)
+                       in sources.items())
+    table = np.zeros(len(timesteps), dtype=TIMESTEP_DTYPE)
+    for index, (value, name) in enumerate(timesteps):
+        if (len(name.encode('ascii')) > TIMESTEP_DTYPE['name'].itemsize):
+            raise ValueError('Timestep name {} is too long.'.format(name))
+        size, mtime_ns = sources[name][1]
+        table[index] = (value, size, mtime_ns, name.encode('ascii'))
+
+    node_size = table['size'][0]
+    if (node_size % VALUE_DTYPE.itemsize != 0 or
+            np.any(table['size'] != node_size)):
+        raise ValueError(
+            'The files of {} do not all hold the same number of '
+            'values.'.format(field))
+    node_count = int(node_size // VALUE_DTYPE.itemsize)
+    timestep_count = len(timesteps)
+
+    def read(name):
+        values = sources[name][2]()
+        if (values.shape[0] != node_count):
+            raise ValueError('{} at {} has changed while packing.'.format(
+                field, name))
+        return values
+
+    data_offset = HEADER.size + table.nbytes
+    data_offset += -data_offset % DATA_ALIGNMENT
+
+    path = store_path(object_directory, field)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+
+    try:
+        with open(temporary_path, 'wb') as store_file:
+            store_file.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, LAYOUTS[layout], timestep_count,
+                node_count, data_offset))
+            store_file.write(table.tobytes())
+            store_file.truncate(data_offset + VALUE_DTYPE.itemsize *
+                                timestep_count * node_count)
+
+            store_file.seek(data_offset)
+            if (LAYOUTS[layout] == LAYOUT_TIME):
+                for _, name in timesteps:
+                    store_file.write(read(name).tobytes())
+
+        if (LAYOUTS[layout] == LAYOUT_NODE and node_count > 0):
+            data = np.memmap(temporary_path, dtype=VALUE_DTYPE, mode='r+',
+                             offset=data_offset,
+                             shape=(node_count, timestep_count))
+            for start in range(0, timestep_count, WRITE_BLOCK):
+                block = timesteps[start:start + WRITE_BLOCK]
+                data[:, start:start + len(block)] = np.stack(
+                    [read(name) for _, name in block], axis=1)
+            data.flush()
+            del data
+
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+    print('Packed {} timesteps of {} into {}.'.format(
+        timestep_count, field, path))
+    return path
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The render buffers, cross sections and isosurfaces of meshes, shared by all
+viewers.
+
+They are keyed by the key of the mesh in the MeshCache and hold no mesh,
+so viewers that look at the same mesh share them and a mesh that has been
+evicted from the MeshCache is not kept alive. They grow as fields and
+planes are requested and are measured again whenever they do, the least
+recently used are dropped once all of them exceed max_bytes.
+"""
+
+from modules.cache import LRUCache
+import modules.render_buffers as render_buffers
+import modules.cross_section as cross_section
+import modules.isosurface as isosurface
+
+
+class ViewCache:
+    """Hold the RenderBuffers, CrossSections and Isosurfaces of meshes.
+    """
+
+    def __init__(self, max_bytes):
+        self.cache = LRUCache(max_bytes, size_of=lambda entry: entry.nbytes())
+
+    def _get(self, key, create):
+        return self.cache.get_or_load(
+            key, lambda: create(resized=lambda: self.cache.refresh(key)))
+
+    def render_buffers(self, mesh_key, level=None):
+        """Return the RenderBuffers of the surface of a mesh, or of a level
+        of its SurfaceLOD (see modules/surface_lod.py).
+        """
+        return self._get((mesh_key, 'render_buffers', level),
+                         render_buffers.RenderBuffers)
+
+    def cross_sections(self, mesh_key):
+        """Return the CrossSections of a mesh.
+        """
+        return self._get((mesh_key, 'cross_sections'),
+                         cross_section.CrossSections)
+
+    def isosurfaces(self, mesh_key):
+        """Return the Isosurfaces of a mesh.
+        """
+        return self._get((mesh_key, 'isosurfaces'), isosurface.Isosurfaces)
+
+    def stats(self):
+        """Return the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.stats()
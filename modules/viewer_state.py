@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# This file is part of fem-gl.
+#
+# Copyright (C) 2017 Matthias Plock <matthias.plock@bam.de>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+The state of one viewer (browser session): which mesh is loaded for which
+object.
+
+The meshes themselves live in the process-wide mesh cache and their render
+buffers, cross sections and isosurfaces in the view cache (see
+modules/view_cache.py), both are shared between viewers. A viewer only
+holds the keys of its meshes.
+"""
+
+import threading
+
+
+class ObjectHandle:
+    """A mesh that a viewer has loaded for an object, by its key in the
+    MeshCache.
+    """
+
+    def __init__(self, object_name, object_directory, mesh_key):
+        self.object_name = object_name
+        self.object_directory = object_directory
+        self.mesh_key = mesh_key
+
+
+class ViewerState:
+    """The object handles of one viewer, keyed by object name.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles = {}
+
+    def get(self, object_name):
+        """Return the handle for an object, or None.
+        """
+        with self._lock:
+            return self._handles.get(object_name)
+
+    def set(self, handle):
+        """Store a handle, replacing the old handle of its object unless it
+        holds the same mesh. Returns the stored handle.
+        """
+        with self._lock:
+            old_handle = self._handles.get(handle.object_name)
+            if (old_handle is not None and
+                    old_handle.mesh_key == handle.mesh_key):
+                return old_handle
+            self._handles[handle.object_name] = handle
+            return handle